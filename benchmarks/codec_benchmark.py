@@ -0,0 +1,107 @@
+"""
+Compares the serialization options for the database files and the wire.
+
+    python -m chat_server.benchmarks.codec_benchmark [--users N] [--messages N]
+
+Storage: encode/decode time and size of a users-like and a messages-like
+database. Wire: encoding one chat message envelope, as done once per
+fan-out in ClientManager.send_to_users.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+from chat_server.utils import codec
+
+
+def make_users(n):
+    users = {}
+    for i in range(n):
+        uid = str(uuid.uuid4())
+        users[uid] = {
+            "id": uid, "username": f"user{i}", "tag": f"{i % 10000:04d}",
+            "handle": f"user{i}#{i % 10000:04d}", "password": "$2b$12$" + "x" * 53,
+            "created_at": time.time(), "avatar": None, "fcm_token": None,
+        }
+    return users
+
+
+def make_messages(n, chats=100):
+    messages = {}
+    senders = [str(uuid.uuid4()) for _ in range(50)]
+    for i in range(n):
+        chat = f"chat_{i % chats}"
+        messages.setdefault(chat, []).append({
+            "id": str(uuid.uuid4()), "sender_id": random.choice(senders),
+            "content": "héllo wörld " * random.randint(1, 8), "type": "group",
+            "timestamp": int(time.time() * 1000) + i, "reply_to": None,
+            "is_deleted": False, "reactions": {},
+        })
+    return messages
+
+
+def timeit(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def storage_variants():
+    variants = [
+        ("stdlib json indent=4 (old)", lambda d: json.dumps(d, indent=4, ensure_ascii=False).encode("utf-8"), json.loads),
+        ("stdlib json compact", lambda d: json.dumps(d, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), json.loads),
+    ]
+    if codec.orjson is not None:
+        variants.append(("orjson compact", codec.JSONCodec.encode, codec.JSONCodec.decode))
+    if codec.msgpack is not None:
+        variants.append(("msgpack", codec.MsgpackCodec.encode, codec.MsgpackCodec.decode))
+    return variants
+
+
+def bench_storage(name, data, repeat):
+    print(f"\n{name}")
+    print(f"  {'codec':<28}{'size KiB':>10}{'encode ms':>12}{'decode ms':>12}")
+    for label, encode, decode in storage_variants():
+        raw = encode(data)
+        enc = timeit(lambda: encode(data), repeat) * 1000
+        dec = timeit(lambda: decode(raw), repeat) * 1000
+        print(f"  {label:<28}{len(raw) / 1024:>10.1f}{enc:>12.2f}{dec:>12.2f}")
+
+
+def bench_wire(repeat, sends=10000):
+    payload = {
+        "type": "new_message", "status": "success",
+        "data": {
+            "id": str(uuid.uuid4()), "sender_id": str(uuid.uuid4()), "content": "see you at 5 🙂",
+            "type": "group", "timestamp": int(time.time() * 1000), "reply_to": None,
+            "is_deleted": False, "reactions": {}, "group_id": str(uuid.uuid4()),
+        },
+    }
+    print(f"\nWire: {sends} message envelopes")
+    print(f"  {'encoder':<28}{'total ms':>10}{'us/msg':>10}")
+    variants = [("stdlib json.dumps (old)", json.dumps), ("codec.dumps (stdlib)", codec._encode)]
+    if codec.orjson is not None:
+        variants.append(("codec.dumps (orjson)", codec.dumps))
+    for label, dumps in variants:
+        total = timeit(lambda: [dumps(payload) for _ in range(sends)], repeat)
+        print(f"  {label:<28}{total * 1000:>10.1f}{total / sends * 1e6:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serialization benchmark")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"orjson: {'yes' if codec.orjson else 'no'}   msgpack: {'yes' if codec.msgpack else 'no'}")
+    bench_storage(f"users.json ({args.users} users)", make_users(args.users), args.repeat)
+    bench_storage(f"messages ({args.messages} messages)", make_messages(args.messages), args.repeat)
+    bench_wire(args.repeat)
+
+if __name__ == "__main__":
+    main()
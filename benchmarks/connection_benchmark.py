@@ -0,0 +1,117 @@
+"""
+Memory held per open connection (core/connection.py).
+
+    python -m chat_server.benchmarks.connection_benchmark [--connections N] [--second-device 0.1]
+
+Registers N simulated, idle connections (a share of the users with a
+second device) and measures with tracemalloc what the server keeps for
+them: the connection records plus the user -> connections registry.
+The websocket objects themselves belong to the websockets library and
+are left out (one shared stub). Compared against the previous layout:
+a plain wrapper with an always-allocated deque and two asyncio.Events,
+and two dicts plus a set per user.
+
+Also times close() on both: the old wrapper reached the socket through
+__getattr__, the slotted one has it as a method.
+"""
+import gc
+import time
+import asyncio
+import argparse
+import tracemalloc
+from collections import deque
+from chat_server.core.connection import ConnectionWrapper, ConnectionRegistry
+
+
+class StubSocket:
+    async def close(self, code=1000, reason=""):
+        pass
+
+    async def ping(self, data=None):
+        pass
+
+
+class LegacyConnection:
+    """The per-connection state before it was slotted."""
+    def __init__(self, websocket):
+        self.ws = websocket
+        self.queue = deque()
+        self.drop_at = 100
+        self.high_watermark = 1000
+        self.policy = "disconnect"
+        self.dropped = 0
+        self.closed = False
+        self._writer = None
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+
+def legacy_layout(user_ids, socket):
+    active_connections, ws_to_user = {}, {}
+    for user_id in user_ids:
+        conn = LegacyConnection(socket)
+        active_connections.setdefault(user_id, set()).add(conn)
+        ws_to_user[conn] = user_id
+    return active_connections, ws_to_user
+
+
+def slotted_layout(user_ids, socket):
+    registry = ConnectionRegistry()
+    for user_id in user_ids:
+        registry.add(user_id, ConnectionWrapper(socket))
+    return registry
+
+
+def measure(build, user_ids, socket):
+    """Bytes allocated by build(), and the result (kept alive until measured)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(user_ids, socket)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, result
+
+
+def time_close(conn, runs=200000):
+    start = time.perf_counter()
+    for _ in range(runs):
+        conn.close
+    return (time.perf_counter() - start) / runs * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-connection memory benchmark")
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--second-device", type=float, default=0.1,
+                        help="share of the connections that are a user's second device")
+    args = parser.parse_args(argv)
+
+    second = int(args.connections * args.second_device)
+    users = [f"user-{i:07d}" for i in range(args.connections - second)]
+    # Created before measuring: the user ids exist anyway (in the tokens, the stores)
+    user_ids = users + users[:second]
+    socket = StubSocket()
+
+    print(f"{args.connections} connections, {len(users)} users")
+    print(f"\n  {'layout':<34}{'total MB':>10}{'bytes/conn':>12}")
+    results = {}
+    for label, build in (("before (dict + set per user)", legacy_layout), ("slotted + ConnectionRegistry", slotted_layout)):
+        used, kept = measure(build, user_ids, socket)
+        results[label] = used
+        print(f"  {label:<34}{used / 1e6:>10.1f}{used / args.connections:>12.0f}")
+        del kept
+    before, after = results.values()
+    print(f"\n  {1 - after / before:.0%} less memory per connection")
+
+    print(f"\n  {'attribute':<34}{'ns':>10}")
+    print(f"  {'close (via __getattr__)':<34}{time_close(LegacyConnection(socket)):>10.1f}")
+    print(f"  {'close (slotted method)':<34}{time_close(ConnectionWrapper(socket)):>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency of the type-ahead user search (utils/search_index.py).
+
+    python -m chat_server.benchmarks.search_benchmark [--users N] [--queries N]
+
+Builds the index over N synthetic users, then times prefix and fuzzy
+queries of one page (SEARCH_PAGE_SIZE) and incremental updates.
+Reports build time and p50 / p99 per operation, and what a reload that
+changed 1% of the users costs off and on the event loop.
+"""
+import time
+import random
+import string
+import argparse
+from chat_server.config import SEARCH_PAGE_SIZE, INDEX_REFILE_BATCH
+from chat_server.utils.search_index import TextSearchIndex, USER_SEARCH
+
+SYLLABLES = ["al", "ex", "an", "der", "jo", "na", "than", "mi", "ka", "el", "sa", "ra", "li", "to", "ny", "be", "th", "or"]
+
+
+def make_name(rng):
+    name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    if rng.random() < 0.3:
+        name += str(rng.randint(0, 999))
+    return name
+
+
+def make_users(n, rng):
+    users = {}
+    for i in range(n):
+        uid = f"user-{i}"
+        name = make_name(rng)
+        users[uid] = {"id": uid, "username": name, "handle": f"{name}#{rng.randint(0, 9999):04d}"}
+    return users
+
+
+def typo(name, rng):
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+    return pick(0.50), pick(0.99)
+
+
+def bench(label, func, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    p50, p99 = percentiles(samples)
+    print(f"  {label:<30}{p50:>10.3f}{p99:>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="User search benchmark")
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args(argv)
+    rng = random.Random(42)
+
+    users = make_users(args.users, rng)
+    index = TextSearchIndex(USER_SEARCH)
+    start = time.perf_counter()
+    index.rebuild(users, generation=1)
+    print(f"{args.users} users, index built in {time.perf_counter() - start:.1f} s")
+
+    names = [u["username"] for u in rng.sample(list(users.values()), min(args.queries, len(users)))]
+    prefixes = [(n[:rng.randint(1, len(n))], SEARCH_PAGE_SIZE, 0, False) for n in names]
+    fuzzy = [(typo(n, rng), SEARCH_PAGE_SIZE, 0, True) for n in names]
+    deep = [(n[:2], SEARCH_PAGE_SIZE, 200, False) for n in names]
+
+    renamed = []
+    for uid in rng.sample(list(users), min(args.queries, len(users))):
+        name = make_name(rng)
+        renamed.append((uid, {"id": uid, "username": name, "handle": f"{name}#0000"}))
+
+    print(f"\n  {'operation':<30}{'p50 ms':>10}{'p99 ms':>10}")
+    bench("prefix", index.search, prefixes)
+    bench("prefix, offset 200", index.search, deep)
+    bench("fuzzy (one typo)", index.search, fuzzy)
+    bench("update (rename)", index.update, renamed)
+
+    # A reload from disk (AsyncStore.search): the diff runs on the I/O
+    # executor, only the records it finds changed are re-filed on the loop
+    users.update(renamed)
+    reloaded = dict(users)
+    for uid in rng.sample(list(users), len(users) // 100):
+        name = make_name(rng)
+        reloaded[uid] = {"id": uid, "username": name, "handle": f"{name}#0001"}
+    start = time.perf_counter()
+    changed = index.changes(reloaded)
+    diffed = time.perf_counter() - start
+    start = time.perf_counter()
+    for uid in changed:
+        index.update(uid, reloaded.get(uid))
+    applied = time.perf_counter() - start
+    print(f"\nreload with {len(changed)} changed users: diff {diffed:.1f} s (I/O executor), "
+          f"re-filed in {applied * 1000:.0f} ms "
+          f"(event loop, {INDEX_REFILE_BATCH} per iteration)")
+
+if __name__ == "__main__":
+    main()
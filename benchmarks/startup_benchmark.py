@@ -0,0 +1,88 @@
+"""
+Start-up cost of the server, i.e. the time before it can accept the
+reconnect storm of a rolling restart.
+
+    python -m chat_server.benchmarks.startup_benchmark [--runs N] [--budget-ms MS] [--module M]
+
+Each run starts a fresh interpreter with '-X importtime', imports the
+server module and creates the Dispatcher, just like server.py does before
+it starts listening. The same is then done with every handler module
+imported up front (how the dispatcher used to start) for comparison. Reports the
+median time-to-ready and the slowest imports, and exits with status 1 if
+the lazy start-up is over the budget.
+"""
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Runs in the child interpreter; prints the seconds it took to get ready
+CHILD = """
+import time
+start = time.perf_counter()
+import importlib
+module = importlib.import_module({module!r})
+from chat_server.core.dispatcher import Dispatcher, HANDLERS
+dispatcher = getattr(module, "dispatcher", None) or Dispatcher(None)
+if {eager!r}:
+    # Imported only: creating the handlers would open (and migrate) the real databases
+    for module_name, _ in HANDLERS.values():
+        importlib.import_module(module_name)
+print(time.perf_counter() - start)
+"""
+
+
+def parse_importtime(stderr):
+    """{ module: (self us, cumulative us) } from '-X importtime' output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header line
+        modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return modules
+
+
+def run(module, eager):
+    code = CHILD.format(module=module, eager=eager)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"Start-up failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    return float(proc.stdout.strip().splitlines()[-1]), parse_importtime(proc.stderr)
+
+
+def measure(label, module, eager, runs):
+    results = [run(module, eager) for _ in range(runs)]
+    ready = statistics.median(seconds for seconds, _ in results) * 1000
+    _, imports = results[-1]
+    print(f"  {label:<30}{ready:>10.1f}{len(imports):>10}")
+    return ready, imports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server start-up benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--module", default="chat_server.server",
+                        help="Entry point to import (e.g. chat_server.core.dispatcher without websockets installed)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args(argv)
+
+    print(f"\n  {'start-up':<30}{'ready ms':>10}{'modules':>10}")
+    lazy, imports = measure("lazy handlers", args.module, False, args.runs)
+    eager, eager_imports = measure("every handler up front", args.module, True, args.runs)
+
+    print(f"\n  Deferred until first use: {len(set(eager_imports) - set(imports))} modules, {eager - lazy:.1f} ms")
+    print(f"\n  {'slowest imports (lazy)':<40}{'self ms':>10}{'cum ms':>10}")
+    slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"  {name:<40}{self_us / 1000:>10.1f}{cumulative_us / 1000:>10.1f}")
+
+    verdict = "within" if lazy <= args.budget_ms else "OVER"
+    print(f"\n  Time to ready {lazy:.1f} ms, {verdict} the {args.budget_ms:.0f} ms budget")
+    return 0 if lazy <= args.budget_ms else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,17 +32,139 @@ TEMP_DIR = os.path.join(UPLOADS_DIR, "temp")  # For processing uploads before sa
 # ==========================================
 USERS_DB = os.path.join(DB_DIR, "users.json")
 GROUPS_DB = os.path.join(DB_DIR, "groups.json")
-MESSAGES_DB = os.path.join(DB_DIR, "messages.json")
+MESSAGES_DB = os.path.join(DB_DIR, "messages.json")  # Legacy single-file store (migrated on startup)
+MESSAGES_DIR = os.path.join(DB_DIR, "messages")      # One shard per chat key
 MEDIA_DB = os.path.join(DB_DIR, "media_refs.json")
 VOICE_DB = os.path.join(DB_DIR, "voice_channels.json")
 
+# ==========================================
+# STORAGE BACKEND
+# ==========================================
+# "json"   - one JSON file per database (default)
+# "sqlite" - users, groups, media refs and messages in one SQLite file (WAL mode).
+#            Import existing data once with: python -m chat_server.utils.migrate_to_sqlite
+STORAGE_BACKEND = "json"
+SQLITE_DB = os.path.join(DB_DIR, "chat.sqlite3")
+
+# Encoding of the database files (see utils/codec.py):
+#   "json"    - compact JSON (orjson if installed)
+#   "msgpack" - binary MessagePack (needs the msgpack package); smaller and faster to load
+# Files are read back in whatever format they were written, so this can be changed at any time.
+STORAGE_CODEC = "json"
+
+# JSON database -> SQLite table (anything not listed stays a JSON file)
+SQLITE_TABLES = {
+    USERS_DB: "users",
+    GROUPS_DB: "groups",
+    MEDIA_DB: "media_refs",
+}
+# Record changes remembered in the SQLite change log, which every process
+# reads to refresh just the records another one changed. A process that
+# falls further behind than this reloads the whole table.
+SQLITE_CHANGE_LOG_KEEP = 10000
+
+# ==========================================
+# DURABILITY
+# ==========================================
+# When writes are forced to disk, per database (or directory of shards):
+#   "always" - fsync before every write returns (safest, slowest)
+#   "batch"  - fsync every FSYNC_BATCH_WRITES writes or FSYNC_BATCH_INTERVAL_MS
+#   "os"     - rely on the OS page cache (fastest, may lose recent writes on power loss)
+# All modes write atomically (temp file + rename), so a crash never truncates a file.
+DURABILITY = {
+    USERS_DB: "always",
+    GROUPS_DB: "always",
+    MEDIA_DB: "batch",
+    MESSAGES_DIR: "batch",
+    VOICE_DB: "os",  # Live call state, rebuilt as users rejoin
+    SQLITE_DB: "always",  # Holds users and groups when STORAGE_BACKEND = "sqlite"
+}
+DEFAULT_DURABILITY = "batch"
+FSYNC_BATCH_WRITES = 100
+FSYNC_BATCH_INTERVAL_MS = 200
+
+# ==========================================
+# SNAPSHOTS
+# ==========================================
+# Background copies of DB_DIR under BACKUP_DIR/snapshots (see utils/snapshot_service.py).
+# Unchanged files are hard-linked to the previous snapshot, so idle periods cost little.
+SNAPSHOT_INTERVAL = 15 * 60  # Seconds between snapshots
+SNAPSHOT_RETENTION = 96      # Snapshots kept (one day at the default interval)
+
+# ==========================================
+# MESSAGE RETENTION
+# ==========================================
+# Per chat, the newest RETENTION_HOT_MESSAGES messages and anything younger than
+# RETENTION_HOT_DAYS stay in the hot shard. Older ones are moved, in whole segments,
+# into immutable compressed files under MESSAGES_DIR/.archive (see utils/message_archive.py).
+# History paging reads them back transparently.
+RETENTION_HOT_MESSAGES = 1000
+RETENTION_HOT_DAYS = 30
+ARCHIVE_SEGMENT_MESSAGES = 500  # Messages per segment file
+ARCHIVE_BLOCK_MESSAGES = 50     # Messages per compressed block (the unit a history page decodes)
+ARCHIVE_COMPRESSION = "zlib"    # "zlib" (faster), "lzma" (smaller) or "none"; all are always readable
+ARCHIVE_CACHE_SEGMENTS = 64     # Segments kept open (memory-mapped) for scroll-back
+
+# ==========================================
+# OUTBOUND QUEUES
+# ==========================================
+# Every connection has its own queue of frames, written by its own task
+# (see core/connection.py), so one slow client never delays the others.
+# Past SEND_QUEUE_DROP_AT queued frames, droppable events (typing, presence)
+# are skipped for that client. At SEND_QUEUE_HIGH_WATERMARK the
+# SLOW_CONSUMER_POLICY applies:
+# "disconnect" - close the connection; the client reconnects and resyncs
+# "drop"       - discard further frames until the queue drains
+SEND_QUEUE_DROP_AT = 100
+SEND_QUEUE_HIGH_WATERMARK = 1000
+SLOW_CONSUMER_POLICY = "disconnect"
+DROPPABLE_EVENTS = ("typing", "presence")
+
+# ==========================================
+# PRESENCE
+# ==========================================
+# Online/offline changes only go to users who share a group or a private chat
+# with the user, or subscribed to them (see core/presence.py). They are
+# collected for PRESENCE_BATCH_WINDOW seconds and sent as one batched
+# 'presence' frame, so flapping connections cause no traffic.
+PRESENCE_BATCH_WINDOW = 1.0
+# Users one client can follow with subscribe_presence
+PRESENCE_MAX_SUBSCRIPTIONS = 500
+
+# ==========================================
+# TYPING INDICATORS
+# ==========================================
+# See core/typing_indicators.py. Seconds, except for the member count.
+TYPING_THROTTLE_INTERVAL = 3.0  # At most one 'typing' fan-out per user per chat per interval
+TYPING_TIMEOUT = 6.0            # 'is_typing: false' is sent after this long without a typing event
+TYPING_SUMMARY_MEMBERS = 50     # Larger groups get periodic "N people typing" summaries instead
+TYPING_SUMMARY_INTERVAL = 2.0
+
+# ==========================================
+# WORKER PROCESSES
+# ==========================================
+# python -m chat_server.server --workers N runs N server processes that all
+# accept on PORT (SO_REUSEPORT, so the kernel spreads connections across them)
+# and exchange deliveries and presence over a Unix socket bus run by the
+# parent process (see core/workers.py). Needs STORAGE_BACKEND = "sqlite":
+# the JSON files are owned by a single process.
+WORKERS = 1
+WORKER_BUS_PATH = f"/tmp/chat_server_{PORT}.sock"
+WORKER_RESTART_DELAY = 1.0  # Seconds before a crashed worker is started again
+BUS_BATCH_MAX = 256         # Bus events coalesced into one write at most
+BUS_RECONNECT_DELAY = 0.1   # Seconds before reconnecting to a lost bus, doubled per failed attempt...
+BUS_RECONNECT_MAX_DELAY = 5.0  # ...up to this
+BUS_RESYNC_GRACE = 1.0      # Seconds after a reconnect for the other workers to resend their subscriptions
+
 # ==========================================
 # INITIALIZATION
 # ==========================================
-# Ensure all critical directories exist on startup
+# Directories the server writes into. Created by ensure_dirs() when the
+# server starts, not at import time (importing config must stay cheap).
 CRITICAL_DIRS = [
     DB_DIR, 
     BACKUP_DIR, 
+    MESSAGES_DIR,
     LOG_DIR,
     UPLOADS_DIR, 
     AVATARS_DIR, # <--- ADDED THIS
@@ -51,11 +173,55 @@ CRITICAL_DIRS = [
     TEMP_DIR
 ]
 
-for path in CRITICAL_DIRS:
-    os.makedirs(path, exist_ok=True)
+def ensure_dirs():
+    for path in CRITICAL_DIRS:
+        os.makedirs(path, exist_ok=True)
 
 # ==========================================
 # CONSTANTS
 # ==========================================
 MAX_JOIN_CODE_LENGTH = 6
-BCRYPT_ROUNDS = 12
\ No newline at end of file
+# Random join codes tried per length before allocating a longer one
+JOIN_CODE_ATTEMPTS = 10
+BCRYPT_ROUNDS = 12
+
+# Number of appended records after which a write-ahead log is
+# folded back into its JSON snapshot (see utils/file_io.LogFileIO)
+LOG_COMPACT_THRESHOLD = 500
+
+# Threads in the dedicated storage I/O executor (see utils/async_store.py)
+IO_WORKERS = 4
+# Records re-filed per event-loop iteration when a search index catches up
+# with a reload (the diff itself runs on the I/O executor)
+INDEX_REFILE_BATCH = 500
+
+# Approximate bytes of chat history kept in memory (LRU across chats)
+MESSAGE_CACHE_BUDGET = 64 * 1024 * 1024
+
+# Characters of the original message copied into a reply's preview
+REPLY_PREVIEW_LENGTH = 100
+
+# Chat history paging (get_chat_history 'limit')
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# User search (search_user with mode "prefix" / "fuzzy")
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+# Deepest result reachable by paging (offset + limit)
+SEARCH_MAX_RESULTS = 500
+# Minimum Dice similarity (0..1) of trigrams for an approximate match
+SEARCH_FUZZY_MIN_SIMILARITY = 0.3
+# Most names read from the trigram postings per approximate query (rarest
+# trigrams first, common ones are skipped)
+SEARCH_FUZZY_MAX_POSTING = 500
+# Candidates re-scored per wanted result (those sharing the most trigrams)
+SEARCH_FUZZY_RESCORE = 4
+
+# Message search (search_messages)
+MESSAGE_SEARCH_PAGE_SIZE = 20
+MESSAGE_SEARCH_MAX_PAGE_SIZE = 50
+# Deepest result reachable by paging (offset + limit)
+MESSAGE_SEARCH_MAX_RESULTS = 500
+# Characters of message text returned around the first matching word
+SNIPPET_LENGTH = 120
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Local pub/sub bus between the worker processes of one server (see
+server.py --workers). The master process runs the Broker on a Unix domain
+socket; every worker connects a BusClient and publishes events that the
+broker forwards, unchanged, to all the other workers.
+
+Wire format: each frame is a 4-byte big-endian length followed by an
+event encoded with utils/codec (a dict with an "op" field). Events sent
+in the same event-loop iteration travel as one {"op": "batch", "events":
+[...]} frame, so a burst of small publishes costs one write per hop.
+
+A worker that loses its connection reconnects with backoff and receives a
+local {"op": "reconnected"} event once it is back, so it can announce its
+subscriptions again (the others dropped them when it left).
+"""
+import os
+import struct
+import asyncio
+import logging
+from chat_server.utils import codec
+from chat_server.config import BUS_BATCH_MAX, BUS_RECONNECT_DELAY, BUS_RECONNECT_MAX_DELAY
+
+LENGTH = struct.Struct("!I")
+
+
+async def read_frame(reader):
+    """The next raw frame from a stream (without its length prefix), or None at EOF."""
+    try:
+        header = await reader.readexactly(LENGTH.size)
+        return await reader.readexactly(LENGTH.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def encode_frame(event):
+    payload = codec.dumps_bytes(event)
+    return LENGTH.pack(len(payload)) + payload
+
+
+class Broker:
+    """
+    Fan-out hub of the bus. The first frame of each connection is a
+    {"op": "hello", "worker": id} naming the worker; every later frame is
+    forwarded to all other connected workers. The broker itself tells the
+    others when a worker joins ({"op": "worker_up", "worker": id}, so they
+    can send it their connected users) and leaves ({"op": "worker_down",
+    "worker": id}, so they can forget the users it had).
+    """
+    def __init__(self, path):
+        self.path = path
+        # worker id -> StreamWriter
+        self.workers = {}
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left over from a previous run
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.workers.values()):
+            writer.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    async def _serve(self, reader, writer):
+        hello = await read_frame(reader)
+        if hello is None:
+            writer.close()
+            return
+        worker = codec.loads(hello).get("worker")
+        self.workers[worker] = writer
+        logging.info(f"Worker {worker} joined the bus ({len(self.workers)} connected)")
+        self._announce(worker, {"op": "worker_up", "worker": worker})
+        try:
+            while True:
+                payload = await read_frame(reader)
+                if payload is None:
+                    break
+                frame = LENGTH.pack(len(payload)) + payload
+                for other, other_writer in list(self.workers.items()):
+                    if other != worker:
+                        other_writer.write(frame)
+                await self._drain(worker)
+        finally:
+            if self.workers.get(worker) is writer:
+                del self.workers[worker]
+            writer.close()
+            logging.info(f"Worker {worker} left the bus")
+            self._announce(worker, {"op": "worker_down", "worker": worker})
+
+    def _announce(self, worker, event):
+        frame = encode_frame(event)
+        for other, writer in list(self.workers.items()):
+            if other != worker:
+                writer.write(frame)
+
+    async def _drain(self, sender):
+        # Backpressure: a worker that stops reading slows down the publishers
+        for other, writer in list(self.workers.items()):
+            if other == sender:
+                continue
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+
+class BusClient:
+    """
+    A worker's connection to the Broker. send() queues an event for every
+    other worker; the queue is written as one frame at the end of the
+    current event-loop iteration (or once it holds 'batch_max' events).
+    Events from the other workers are passed to 'on_event' in order.
+
+    If the broker connection drops, events are kept queued while the client
+    reconnects (waiting 'reconnect_delay', doubled per failed attempt up to
+    'reconnect_max_delay'); then 'on_event' gets {"op": "reconnected"}.
+    """
+    def __init__(self, path, worker, on_event, batch_max=BUS_BATCH_MAX,
+                 reconnect_delay=BUS_RECONNECT_DELAY, reconnect_max_delay=BUS_RECONNECT_MAX_DELAY):
+        self.path = path
+        self.worker = worker
+        self.on_event = on_event
+        self.batch_max = batch_max
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.reader = None
+        self.writer = None
+        self.pending = []
+        self._flush_handle = None
+        self._task = None
+
+    async def connect(self):
+        await self._open()
+        self._task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.writer.write(encode_frame({"op": "hello", "worker": self.worker}))
+        # Anything queued while disconnected follows the hello
+        self.flush()
+        await self.writer.drain()
+
+    def send(self, event):
+        """Queues an event for the other workers."""
+        self.pending.append(event)
+        if len(self.pending) >= self.batch_max:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        """Writes the queued events now, as a single frame."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.pending or self.writer.is_closing():
+            # Disconnected: kept until the client has reconnected
+            return
+        events, self.pending = self.pending, []
+        event = events[0] if len(events) == 1 else {"op": "batch", "events": events}
+        self.writer.write(encode_frame(event))
+
+    async def drain(self):
+        """Waits while the broker is behind (the socket's write buffer is full)."""
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+
+    async def _read_loop(self):
+        while True:
+            payload = await read_frame(self.reader)
+            if payload is None:
+                logging.error("Lost the connection to the worker bus; reconnecting")
+                await self._reconnect()
+                continue
+            event = codec.loads(payload)
+            for event in event["events"] if event.get("op") == "batch" else (event,):
+                try:
+                    await self.on_event(event)
+                except Exception as e:
+                    logging.error(f"Bus event failed: {e}")
+
+    async def _reconnect(self):
+        self.writer.close()
+        delay = self.reconnect_delay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._open()
+                break
+            except OSError as e:
+                delay = min(delay * 2, self.reconnect_max_delay)
+                logging.warning(f"Worker bus unreachable ({e}); retrying in {delay:.1f}s")
+        logging.info(f"Worker {self.worker} reconnected to the bus")
+        try:
+            await self.on_event({"op": "reconnected", "worker": self.worker})
+        except Exception as e:
+            logging.error(f"Bus event failed: {e}")
@@ -1,13 +1,21 @@
-import json
 import asyncio
 import logging
+from chat_server.utils import codec
+from chat_server.core.connection import ConnectionWrapper, ConnectionRegistry
+from chat_server.core.presence import PresenceService
+from chat_server.core.transport import InProcessTransport
+from chat_server.config import DROPPABLE_EVENTS
 
 class ClientManager:
     def __init__(self):
-        # Maps user_id -> set of websocket connections (supports multi-device)
-        self.active_connections: dict[str, set] = {}
-        # Maps websocket -> user_id (for fast reverse lookup on disconnect)
-        self.ws_to_user: dict = {}
+        # user_id -> their ConnectionWrappers (supports multi-device); each
+        # wrapper knows its user_id, for the reverse lookup on disconnect
+        self.connections = ConnectionRegistry()
+        # Scoped, batched online/offline notifications
+        self.presence = PresenceService(self)
+        # How published frames reach users (see core/transport.py); replaced
+        # by a BusTransport in multi-worker mode (core/workers.py)
+        self.transport = InProcessTransport(self.deliver_local)
 
     # ==========================================
     # CORE CONNECTION LOGIC
@@ -18,39 +26,31 @@ class ClientManager:
         Registers a new connection.
         Called by AuthHandler.
         """
-        is_new_user = user_id not in self.active_connections
-        
-        if is_new_user:
-            self.active_connections[user_id] = set()
-            
-        self.active_connections[user_id].add(wrapper)
-        self.ws_to_user[wrapper] = user_id
-        
-        logging.info(f"✅ User {user_id} registered (Total connections: {len(self.ws_to_user)})")
+        is_new_user = self.connections.add(user_id, wrapper)
+
+        logging.info(f"✅ User {user_id} registered (Total connections: {self.connections.count})")
         
-        # Broadcast "online" status only if this is their first active connection
         if is_new_user:
-            await self._broadcast_presence(user_id, "online")
+            await self.transport.subscribe(user_id)
+            # Announce "online" only if this is their first active connection (on any worker)
+            if not self.transport.elsewhere(user_id):
+                self.presence.changed(user_id, "online")
 
     async def remove_client(self, wrapper):
         """
         Unregisters a connection.
         Called by server.py when socket closes.
         """
-        user_id = self.ws_to_user.get(wrapper)
-        
+        user_id = self.get_user_id(wrapper)
+
         if user_id:
-            if user_id in self.active_connections:
-                self.active_connections[user_id].discard(wrapper)
-                
-                # If no more connections, user is offline
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
-                    await self._broadcast_presence(user_id, "offline")
-            
-            if wrapper in self.ws_to_user:
-                del self.ws_to_user[wrapper]
-                
+            # If no more connections, user is offline
+            if self.connections.discard(wrapper):
+                self.presence.unsubscribe(user_id)
+                await self.transport.unsubscribe(user_id)
+                if not self.transport.elsewhere(user_id):
+                    self.presence.changed(user_id, "offline")
+
             logging.info(f"❌ User {user_id} disconnected.")
             return user_id
         
@@ -65,84 +65,110 @@ class ClientManager:
         Helper to find who sent a message.
         Used by Dispatcher.
         """
-        return self.ws_to_user.get(wrapper)
+        user_id = getattr(wrapper, "user_id", None)
+        if user_id is None or wrapper not in self.connections.get(user_id):
+            return None  # Not (or no longer) registered
+        return user_id
 
     def get_user_sockets(self, user_id):
-        """Returns a set of all active websockets for a user."""
-        return self.active_connections.get(user_id, set())
+        """Returns a tuple of all active connections of a user on this process."""
+        return self.connections.get(user_id)
 
     def is_online(self, user_id):
-        """Checks if a user has any active connections."""
-        return user_id in self.active_connections
+        """Checks if a user has any active connections (on any worker)."""
+        return user_id in self.connections or self.transport.elsewhere(user_id)
+
+    def is_local(self, user_id):
+        """Checks if a user has an active connection to this process."""
+        return user_id in self.connections
 
     # ==========================================
     # MESSAGING HELPERS
     # ==========================================
+    # Fan-out only queues frames (see ConnectionWrapper.enqueue); each
+    # connection's own writer task does the actual, possibly slow, sending.
 
     async def send_to_user(self, user_id, msg_type, data):
         """
         Sends a standardized JSON message to a specific user.
         Used by Handlers (Group, Message, etc).
         """
-        payload = {"type": msg_type, "data": data, "status": "success"}
-        await self.send_personal_message(payload, user_id)
+        await self.send_to_users((user_id,), msg_type, data)
 
-    async def send_personal_message(self, message, user_id):
+    async def send_to_users(self, user_ids, msg_type, data, exclude_user=None, local_only=False):
+        """
+        Sends the same standardized JSON message to many users (a group's
+        members, a voice channel...). The payload is encoded once and that
+        one frame is published to every online recipient, however large
+        the group. 'local_only' skips users connected to other workers.
+        """
+        is_target = self.is_local if local_only else self.is_online
+        targets = [user_id for user_id in user_ids if user_id != exclude_user and is_target(user_id)]
+        if not targets:
+            return  # Nobody online, nothing encoded
+        frame = codec.dumps({"type": msg_type, "data": data, "status": "success"})
+        critical = msg_type not in DROPPABLE_EVENTS
+        if local_only:
+            for user_id in targets:
+                await self.deliver_local(user_id, frame, critical)
+        else:
+            await self.transport.publish(targets, frame, critical)
+
+    async def send_personal_message(self, message, user_id, critical=True):
         """
         Sends a raw message to all connected devices of a specific user.
         """
         if isinstance(message, dict):
-            message = json.dumps(message)
-            
-        sockets = self.get_user_sockets(user_id)
-        for ws_wrapper in sockets:
-            try:
-                # Use the wrapper's send method if available
-                if hasattr(ws_wrapper, 'send'):
-                    await ws_wrapper.send(message)
-                # Fallback for raw websockets
-                elif hasattr(ws_wrapper, 'send_text'): 
-                     await ws_wrapper.send_text(message)
-                else:
-                     await ws_wrapper.send(message)
-            except Exception as e:
-                logging.error(f"Error sending to {user_id}: {e}")
-
-    async def broadcast(self, message, exclude_user=None):
+            message = codec.dumps(message)
+        await self.transport.publish((user_id,), message, critical)
+
+    async def broadcast(self, message, exclude_user=None, critical=True):
         """Sends a message to all connected users."""
         if isinstance(message, dict):
-            message = json.dumps(message)
-
-        for user_id, sockets in self.active_connections.items():
-            if user_id == exclude_user:
-                continue
-            
-            for ws in sockets:
-                try:
-                    if hasattr(ws, 'send'): await ws.send(message)
-                    else: await ws.send(message)
-                except:
-                    pass
+            message = codec.dumps(message)
+
+        users = list(self.connections) + [
+            user_id for user_id in self.transport.topics_elsewhere() if user_id not in self.connections
+        ]
+        await self.transport.publish([user_id for user_id in users if user_id != exclude_user], message, critical)
+
+    async def deliver_local(self, user_id, frame, critical=True):
+        """Queues an encoded frame on every connection of 'user_id' to this process."""
+        # (A snapshot: a raw socket's send yields, and the user may connect or leave meanwhile)
+        for ws in self.connections.get(user_id):
+            await self._deliver(ws, frame, critical)
+
+    # ==========================================
+    # TRANSPORT
+    # ==========================================
+
+    async def set_transport(self, transport):
+        """Switches to another transport (e.g. a BusTransport), carrying over the connected users."""
+        for user_id in self.connections:
+            await transport.subscribe(user_id)
+        self.transport = transport
+
+    def remote_changed(self, user_id, online, initial=False):
+        """A user's first connection to another worker opened, or their last one closed."""
+        if initial:
+            # Online before this worker joined: nothing to announce, but known as online
+            self.presence.announced.add(user_id)
+        elif user_id not in self.connections:
+            self.presence.changed(user_id, "online" if online else "offline")
 
     # ==========================================
     # INTERNAL LOGIC
     # ==========================================
 
-    async def _broadcast_presence(self, user_id, status):
-        """Notifies all users when someone comes online or goes offline."""
-        payload = json.dumps({
-            "type": "presence", 
-            "data": {"user_id": user_id, "status": status}
-        })
-        
-        # Broadcast to ALL connected sockets
-        for sockets in self.active_connections.values():
-            for ws in sockets:
-                try:
-                    if hasattr(ws, 'send'): await ws.send(payload)
-                    else: await ws.send(payload)
-                except:
-                    pass
+    async def _deliver(self, ws, message, critical):
+        """Queues 'message' on a connection (raw sockets, e.g. in tools, are written directly)."""
+        try:
+            if isinstance(ws, ConnectionWrapper):
+                ws.enqueue(message, critical)
+            else:
+                await ws.send(message)
+        except Exception as e:
+            logging.error(f"Error sending to {getattr(ws, 'user_id', None)}: {e}")
 
 # Singleton Instance
 manager = ClientManager()
\ No newline at end of file
@@ -1,18 +1,131 @@
-import json
+import asyncio
 import logging
+import time
+from collections import deque
+from chat_server.utils import codec
+from chat_server.config import SEND_QUEUE_DROP_AT, SEND_QUEUE_HIGH_WATERMARK, SLOW_CONSUMER_POLICY
+
+try:
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    class ConnectionClosed(Exception):
+        """Stands in for websockets' exception, so the core imports without it (tests, benchmarks)."""
+
+# Close code sent to clients that can't keep up ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
 
 class ConnectionWrapper:
     """
     Wraps a raw websocket object to provide helper methods
     for sending formatted JSON responses.
+
+    Nothing is written to the socket by the caller: frames go into this
+    connection's bounded outbound queue and a writer task owned by the
+    connection sends them in order. Fan-out to many sockets is therefore
+    just a loop of enqueue() calls, and a slow client only ever delays
+    itself (see config.SLOW_CONSUMER_POLICY for what happens when it
+    falls too far behind).
+
+    One of these exists per open socket, so it is slotted and keeps
+    nothing around while idle: the queue and the writer task only exist
+    while frames are waiting to be sent.
     """
-    def __init__(self, websocket):
+    __slots__ = (
+        "ws", "user_id", "connected_at", "queue", "drop_at", "high_watermark", "policy",
+        "sent", "dropped", "closed", "_writer"
+    )
+
+    def __init__(self, websocket, drop_at=SEND_QUEUE_DROP_AT,
+                 high_watermark=SEND_QUEUE_HIGH_WATERMARK, policy=SLOW_CONSUMER_POLICY):
         self.ws = websocket
+        # Set by ClientManager.register_client once the socket is authenticated
+        self.user_id = None
+        self.connected_at = time.time()
+        # Frames waiting for the writer (None when there are none)
+        self.queue = None
+        self.drop_at = drop_at
+        self.high_watermark = high_watermark
+        self.policy = policy
+        # Frames handed to the socket, and frames skipped because the client was too slow
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._writer = None
+
+    # ==========================================
+    # OUTBOUND QUEUE
+    # ==========================================
+
+    def enqueue(self, frame, critical=True):
+        """
+        Queues an encoded frame for sending. Never blocks.
+        Non-critical frames (typing, presence) are the first to be dropped
+        when the client falls behind. Returns False if the frame was dropped.
+        """
+        if self.closed:
+            return False
+
+        queue = self.queue
+        if queue is None:
+            queue = self.queue = deque()
+        backlog = len(queue)
+        if not critical and backlog >= self.drop_at:
+            self.dropped += 1
+            return False
+        if backlog >= self.high_watermark:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                logging.warning(f"Slow consumer: {backlog} frames queued, disconnecting")
+                self.abort()
+            return False
+
+        queue.append(frame)
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+        return True
+
+    async def _write_loop(self):
+        # Runs while there is something to send, then releases the queue
+        try:
+            while self.queue and not self.closed:
+                frame = self.queue.popleft()
+                try:
+                    await self.ws.send(frame)
+                    self.sent += 1
+                except ConnectionClosed:
+                    # The peer is gone: nothing still queued can be delivered
+                    self.stop()
+                    break
+                except Exception as e:
+                    logging.error(f"Failed to send: {e}")
+        finally:
+            self._writer = None
+            if not self.queue:
+                self.queue = None
+
+    async def drain(self):
+        """Waits until every queued frame has been handed to the socket."""
+        while self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    def abort(self):
+        """Drops the queue and closes the socket (for clients that can't keep up)."""
+        self.stop()
+        asyncio.get_running_loop().create_task(self.ws.close(SLOW_CONSUMER_CLOSE_CODE, "Too slow"))
+
+    def stop(self):
+        """Stops the writer and discards anything still queued. Called once the socket is gone."""
+        self.closed = True
+        self.queue = None
+
+    # ==========================================
+    # SENDING
+    # ==========================================
 
     async def send_json(self, msg_type, data, status="success"):
         """
         Sends a standardized JSON message.
-        
+
         Args:
             msg_type (str): The type of event (e.g., 'login', 'message')
             data (dict/list): The payload to send.
@@ -24,7 +137,7 @@ class ConnectionWrapper:
             "data": data
         }
         try:
-            await self.ws.send(json.dumps(payload))
+            self.enqueue(codec.dumps(payload))
         except Exception as e:
             logging.error(f"Failed to send JSON: {e}")
 
@@ -39,7 +152,7 @@ class ConnectionWrapper:
             "data": {}
         }
         try:
-            await self.ws.send(json.dumps(payload))
+            self.enqueue(codec.dumps(payload))
         except Exception as e:
             logging.error(f"Failed to send Error: {e}")
 
@@ -47,15 +160,84 @@ class ConnectionWrapper:
         """
         Raw send method (for simple strings or pre-formatted JSON).
         """
-        try:
-            await self.ws.send(message)
-        except Exception as e:
-            logging.error(f"Failed to send raw message: {e}")
+        self.enqueue(message)
 
     async def recv(self):
         """Delegates recv to the underlying socket."""
         return await self.ws.recv()
 
-    def __getattr__(self, name):
-        """Delegate all other method calls (close, ping, etc.) to the underlying socket."""
-        return getattr(self.ws, name)
\ No newline at end of file
+    async def close(self, code=1000, reason=""):
+        """Discards the queue and closes the socket."""
+        self.stop()
+        await self.ws.close(code, reason)
+
+    async def ping(self, data=None):
+        """Pings the socket; returns the awaitable that resolves on the pong."""
+        return await self.ws.ping(data)
+
+    @property
+    def remote_address(self):
+        return self.ws.remote_address
+
+
+class ConnectionRegistry:
+    """
+    user_id -> open connections of that user, sized for very many users.
+
+    Most users have one device, so a lone connection is stored as is and
+    only a user with several gets a tuple. The connection itself carries
+    its user_id, so no reverse map is needed.
+    """
+    __slots__ = ("_by_user", "count")
+
+    def __init__(self):
+        self._by_user = {}
+        # Open connections, all users together
+        self.count = 0
+
+    def add(self, user_id, conn):
+        """Registers a connection. True if it is the user's first one."""
+        conn.user_id = user_id
+        current = self._by_user.get(user_id)
+        if current is None:
+            self._by_user[user_id] = conn
+        elif type(current) is tuple:
+            if conn in current:
+                return False
+            self._by_user[user_id] = current + (conn,)
+        elif current is conn:
+            return False
+        else:
+            self._by_user[user_id] = (current, conn)
+        self.count += 1
+        return current is None
+
+    def discard(self, conn):
+        """Unregisters a connection. True if it was its user's last one."""
+        user_id = conn.user_id
+        current = self._by_user.get(user_id)
+        if current is conn:
+            del self._by_user[user_id]
+            self.count -= 1
+            return True
+        if type(current) is tuple and conn in current:
+            rest = tuple(c for c in current if c is not conn)
+            self._by_user[user_id] = rest[0] if len(rest) == 1 else rest
+            self.count -= 1
+        return False
+
+    def get(self, user_id):
+        """The user's connections, as a tuple (empty if offline)."""
+        current = self._by_user.get(user_id)
+        if current is None:
+            return ()
+        return current if type(current) is tuple else (current,)
+
+    def __contains__(self, user_id):
+        return user_id in self._by_user
+
+    def __iter__(self):
+        return iter(self._by_user)
+
+    def __len__(self):
+        return len(self._by_user)
@@ -1,30 +1,122 @@
-import json
+import asyncio
 import logging
+import importlib
+from chat_server.utils import codec
 from chat_server.utils.response import error
+from chat_server.utils.store import registry
+from chat_server.utils.async_store import run_io
 
-# Import Handler Classes
-from chat_server.handlers.auth_handler import AuthHandler
-from chat_server.handlers.group_handler import GroupHandler
-from chat_server.handlers.message_handler import MessageHandler
-from chat_server.handlers.voice_handler import VoiceHandler
-from chat_server.handlers.admin_handler import AdminHandler
-from chat_server.handlers.user_search_handler import UserSearchHandler
-from chat_server.handlers.media_handler import MediaHandler
-from chat_server.handlers.profile_handler import ProfileHandler
+# Handler name -> (module, class). Modules are imported, and the handler
+# created, the first time one of its message types arrives: importing every
+# handler up front pulls in bcrypt, jwt and friends before we can listen.
+HANDLERS = {
+    "auth": ("chat_server.handlers.auth_handler", "AuthHandler"),
+    "group": ("chat_server.handlers.group_handler", "GroupHandler"),
+    "message": ("chat_server.handlers.message_handler", "MessageHandler"),
+    "voice": ("chat_server.handlers.voice_handler", "VoiceHandler"),
+    "admin": ("chat_server.handlers.admin_handler", "AdminHandler"),
+    "user_search": ("chat_server.handlers.user_search_handler", "UserSearchHandler"),
+    "media": ("chat_server.handlers.media_handler", "MediaHandler"),
+    "profile": ("chat_server.handlers.profile_handler", "ProfileHandler"),
+    "presence": ("chat_server.handlers.presence_handler", "PresenceHandler"),
+}
+
+# ==========================================
+# ROUTING TABLE
+# ==========================================
+# Message 'type' -> (handler name, method)
+ROUTES = {
+    # --- AUTHENTICATION ---
+    "register": ("auth", "handle_register"),
+    "login": ("auth", "handle_login"),
+    "reconnect": ("auth", "handle_reconnect"),
+
+    # --- GROUPS ---
+    "get_chats": ("group", "handle_get_chats"),
+    "create_group": ("group", "handle_create_group"),
+    "join_group": ("group", "handle_join_group"),
+
+    # --- MESSAGING ---
+    "message": ("message", "handle_send"),
+    "delete_message": ("message", "handle_delete"),
+    "typing": ("message", "handle_typing"),
+    "get_chat_history": ("message", "handle_get_history"),
+    "pin_message": ("message", "handle_pin"),
+
+    # --- VOICE / WEBRTC ---
+    "join_voice": ("voice", "handle_join_voice"),
+    "leave_voice": ("voice", "handle_leave_voice"),
+    "voice_state_update": ("voice", "handle_voice_state"),
+    "voice_signal": ("voice", "handle_voice_signal"),
+
+    # --- ADMIN ACTIONS ---
+    "admin_action": ("admin", "handle_admin_action"),
+
+    # --- SEARCH ---
+    "search_user": ("user_search", "handle_search"),
+    "search_messages": ("message", "handle_search"),
+
+    # --- MEDIA ---
+    "upload_media": ("media", "handle_upload_media"),
+    "get_media": ("media", "handle_get_media"),
+    "media_ref": ("media", "handle_media_ref"),
+
+    # --- PROFILE / AVATAR ---
+    "update_profile": ("profile", "handle_update_profile"),
+    "get_avatar": ("profile", "handle_get_avatar"),
+
+    # --- PRESENCE ---
+    "subscribe_presence": ("presence", "handle_subscribe"),
+    "unsubscribe_presence": ("presence", "handle_unsubscribe"),
+}
 
 class Dispatcher:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        
-        # Initialize Handlers
-        self.auth_handler = AuthHandler(client_manager)
-        self.group_handler = GroupHandler(client_manager)
-        self.message_handler = MessageHandler(client_manager)
-        self.voice_handler = VoiceHandler(client_manager)
-        self.admin_handler = AdminHandler(client_manager)
-        self.user_search_handler = UserSearchHandler(client_manager)
-        self.media_handler = MediaHandler(client_manager)
-        self.profile_handler = ProfileHandler(client_manager)
+        # One shared in-memory store per database file, handed to every handler
+        self.stores = stores
+        # Handler name -> instance, filled in on first use (see HANDLERS)
+        self.handlers = {}
+        # Handler name -> in-flight creation, so concurrent first uses share one
+        self._loading = {}
+
+    def get_handler(self, name):
+        """Returns the handler called 'name', importing and creating it if needed (blocking)."""
+        handler = self.handlers.get(name)
+        if handler is None:
+            module, class_name = HANDLERS[name]
+            handler_class = getattr(importlib.import_module(module), class_name)
+            handler = self.handlers[name] = handler_class(self.client_manager, self.stores)
+        return handler
+
+    async def load_handler(self, name):
+        """
+        Awaitable get_handler(). Creating a handler opens its stores (the
+        message store migrates and reconciles its indexes), so it runs on
+        the I/O executor instead of stalling every connection.
+        """
+        handler = self.handlers.get(name)
+        if handler is not None:
+            return handler
+        loading = self._loading.get(name)
+        if loading is None:
+            loading = self._loading[name] = asyncio.ensure_future(run_io(self.get_handler, name))
+            loading.add_done_callback(lambda _: self._loading.pop(name, None))
+        return await asyncio.shield(loading)
+
+    async def warm_up(self):
+        """
+        Loads the handlers nobody has used yet, one at a time. Awaited once
+        the server is listening so the first messages of each type don't pay
+        for the imports; clients are served in the meantime.
+        """
+        for name in HANDLERS:
+            if name not in self.handlers:
+                try:
+                    await self.load_handler(name)
+                except Exception as e:
+                    # e.g. an optional dependency is missing; reported again on first use
+                    logging.error(f"Could not load handler '{name}': {e}")
 
     async def dispatch(self, wrapper, raw_message):
         """
@@ -32,8 +124,8 @@ class Dispatcher:
         """
         # 1. Parse JSON
         try:
-            event = json.loads(raw_message)
-        except json.JSONDecodeError:
+            event = codec.loads(raw_message)
+        except ValueError:
             await wrapper.send_error("system", "Invalid JSON")
             return
 
@@ -41,75 +133,17 @@ class Dispatcher:
         msg_type = event.get("type")
         data = event.get("data", {})
         
-        # ==========================================
-        # ROUTING TABLE
-        # ==========================================
-
-        # --- AUTHENTICATION ---
-        if msg_type == "register":
-            await self.auth_handler.handle_register(wrapper, data)
-        elif msg_type == "login":
-            await self.auth_handler.handle_login(wrapper, data)
-        elif msg_type == "reconnect":
-            await self.auth_handler.handle_reconnect(wrapper, data)
-        
-        # --- GROUPS ---
-        elif msg_type == "get_chats":
-            await self.group_handler.handle_get_chats(wrapper, data)
-        elif msg_type == "create_group":
-            await self.group_handler.handle_create_group(wrapper, data)
-        elif msg_type == "join_group":
-            await self.group_handler.handle_join_group(wrapper, data)
-
-        # --- MESSAGING ---
-        elif msg_type == "message":
-            await self.message_handler.handle_send(wrapper, data)
-        elif msg_type == "delete_message":
-            await self.message_handler.handle_delete(wrapper, data)
-        elif msg_type == "typing":
-            await self.message_handler.handle_typing(wrapper, data)
-        elif msg_type == "get_chat_history":
-            await self.message_handler.handle_get_history(wrapper, data)
-        elif msg_type == "pin_message": # <--- THIS IS THE KEY FIX
-            await self.message_handler.handle_pin(wrapper, data)
-
-        # --- VOICE / WEBRTC ---
-        elif msg_type == "join_voice":
-            await self.voice_handler.handle_join_voice(wrapper, data)
-        elif msg_type == "leave_voice":
-            await self.voice_handler.handle_leave_voice(wrapper, data)
-        elif msg_type == "voice_state_update":
-            await self.voice_handler.handle_voice_state(wrapper, data)
-        elif msg_type == "voice_signal":
-            await self.voice_handler.handle_voice_signal(wrapper, data)
-
-        # --- ADMIN ACTIONS ---
-        elif msg_type == "admin_action":
-            await self.admin_handler.handle_admin_action(wrapper, data)
-
-        # --- SEARCH ---
-        elif msg_type == "search_user":
-            await self.user_search_handler.handle_search(wrapper, data)
-
-        # --- MEDIA ---
-        elif msg_type == "upload_media":
-            await self.media_handler.handle_upload_media(wrapper, data)
-        elif msg_type == "get_media":
-            await self.media_handler.handle_get_media(wrapper, data)
-        elif msg_type == "media_ref":
-            await self.media_handler.handle_media_ref(wrapper, data)
-
-        # --- PROFILE / AVATAR ---
-        elif msg_type == "update_profile":
-            await self.profile_handler.handle_update_profile(wrapper, data)
-        elif msg_type == "get_avatar":
-            await self.profile_handler.handle_get_avatar(wrapper, data)
-
         # --- SYSTEM / HEALTH ---
-        elif msg_type == "health_check":
+        if msg_type == "health_check":
             await wrapper.send_json("health_check", {"status": "ok"})
+            return
+
+        route = ROUTES.get(msg_type) if isinstance(msg_type, str) else None
+        if route is not None:
+            handler_name, method = route
+            await getattr(await self.load_handler(handler_name), method)(wrapper, data)
+            return
 
         # --- UNKNOWN ---
-        else:
-            logging.warning(f"⚠️ Unknown message type received: {msg_type}")
-            await wrapper.send_error("system", f"Unknown type: {msg_type}")
\ No newline at end of file
+        logging.warning(f"⚠️ Unknown message type received: {msg_type}")
+        await wrapper.send_error("system", f"Unknown type: {msg_type}")
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from collections import defaultdict
+from chat_server.utils.store import registry
+from chat_server.utils.indexes import GROUP_BY_MEMBER
+from chat_server.config import (
+    GROUPS_DB, MESSAGES_DB, MESSAGES_DIR, PRESENCE_BATCH_WINDOW, PRESENCE_MAX_SUBSCRIPTIONS
+)
+
+class PresenceService:
+    """
+    Tells users when the people they chat with come online or go offline.
+
+    A user's audience is everyone who shares a group or a private chat with
+    them, plus whoever subscribed to them (subscribe_presence); nobody else
+    hears about them. Transitions are collected for 'window' seconds and
+    then sent as one 'presence' frame per recipient:
+
+        { "type": "presence", "data": { "updates": [ { "user_id", "status" }, ... ] } }
+
+    Only the latest status of a user in the window counts, and it is only
+    sent if it differs from the one last announced, so a connection that
+    drops and comes back within the window costs nothing.
+
+    A user's contacts (groups and private chats) are cached until the
+    groups store or the private chats change (their versions).
+    """
+    def __init__(self, client_manager, stores=registry, window=PRESENCE_BATCH_WINDOW):
+        self.client_manager = client_manager
+        self.stores = stores
+        self.window = window
+        # Opened on first use (the ClientManager singleton exists before any store is needed)
+        self.groups_io = None
+        self.message_store = None
+
+        # subject -> users subscribed to them, and the reverse for cleanup
+        self.subscribers = defaultdict(set)
+        self.subscriptions = defaultdict(set)
+        # user_id -> latest status seen in the current window
+        self.pending = {}
+        # Users last announced as online
+        self.announced = set()
+        # user_id -> ((groups version, private chats version), contacts)
+        self._contacts = {}
+        self._flush_task = None
+
+    # ==========================================
+    # TRANSITIONS
+    # ==========================================
+
+    def changed(self, user_id, status):
+        """Records a transition ("online" / "offline"); sent with the next batch."""
+        self.pending[user_id] = status
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Presence delivery failed: {e}")
+
+    async def flush(self):
+        """Sends the transitions collected so far."""
+        pending, self.pending = self.pending, {}
+        updates = []
+        for user_id, status in pending.items():
+            online = status == "online"
+            if online == (user_id in self.announced):
+                continue  # Back where it was last announced
+            if online:
+                self.announced.add(user_id)
+            else:
+                self.announced.discard(user_id)
+            updates.append({"user_id": user_id, "status": status})
+        if not updates:
+            return
+
+        # Once per batch: picks up group changes (e.g. from other workers)
+        self._open()
+        await self.groups_io.read_json()
+
+        # recipient -> positions (in 'updates') of the changes they should see.
+        # Every worker sees every transition, and only tells its own clients.
+        seen = defaultdict(list)
+        for i, update in enumerate(updates):
+            for recipient in await self.audience(update["user_id"]):
+                if recipient != update["user_id"] and self.client_manager.is_local(recipient):
+                    seen[recipient].append(i)
+            if update["status"] == "offline":
+                # Rebuilt when they are back
+                self._contacts.pop(update["user_id"], None)
+
+        # Recipients that see the same changes share one encoded frame
+        batches = defaultdict(list)
+        for recipient, positions in seen.items():
+            batches[tuple(positions)].append(recipient)
+        for positions, recipients in batches.items():
+            data = {"updates": [updates[i] for i in positions]}
+            await self.client_manager.send_to_users(recipients, "presence", data, local_only=True)
+
+    async def audience(self, user_id):
+        """Users allowed to see the presence of 'user_id' (as of the groups last read)."""
+        self._open()
+        groups_db = await self.groups_io.read_cached()
+        version = (self.groups_io.store.version, self.message_store.peers_version)
+        cached = self._contacts.get(user_id)
+        if cached is None or cached[0] != version:
+            contacts = set()
+            for group_id in self.groups_io.lookup(GROUP_BY_MEMBER, user_id):
+                contacts.update(groups_db.get(group_id, {}).get("members", {}))
+            contacts.update(await self.message_store.private_peers(user_id))
+            # The version from before the await: a change meanwhile rebuilds it next time
+            cached = self._contacts[user_id] = (version, contacts)
+        return cached[1] | self.subscribers.get(user_id, set())
+
+    # ==========================================
+    # SUBSCRIPTIONS
+    # ==========================================
+
+    def subscribe(self, user_id, subjects):
+        """
+        Follows the presence of 'subjects' (e.g. users shown in a search or
+        profile) until 'user_id' goes offline. Returns their current status.
+        """
+        room = max(0, PRESENCE_MAX_SUBSCRIPTIONS - len(self.subscriptions[user_id]))
+        for subject in list(subjects)[:room]:
+            if subject != user_id:
+                self.subscribers[subject].add(user_id)
+                self.subscriptions[user_id].add(subject)
+        return {s: self.status(s) for s in subjects}
+
+    def unsubscribe(self, user_id, subjects=None):
+        """Stops following 'subjects' (all of them if None)."""
+        following = self.subscriptions.get(user_id, set())
+        for subject in list(following if subjects is None else subjects):
+            following.discard(subject)
+            followers = self.subscribers.get(subject)
+            if followers is not None:
+                followers.discard(user_id)
+                if not followers:
+                    del self.subscribers[subject]
+        if not following:
+            self.subscriptions.pop(user_id, None)
+
+    def status(self, user_id):
+        return "online" if self.client_manager.is_online(user_id) else "offline"
+
+    def _open(self):
+        if self.groups_io is None:
+            self.groups_io = self.stores.get(GROUPS_DB)
+        if self.message_store is None:
+            self.message_store = self.stores.get_messages(MESSAGES_DIR, legacy_path=MESSAGES_DB)
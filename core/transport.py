@@ -0,0 +1,176 @@
+"""
+Fan-out transports: how a frame published for a user reaches the sockets
+of that user, wherever they are connected.
+
+Topics are user ids. ClientManager subscribes a user's topic while they
+have a connection to this process, publishes encoded frames to topics,
+and gets back deliver(topic, frame, critical) for the topics it
+subscribed. Handlers only talk to ClientManager, so the same code runs
+on one process (InProcessTransport) or several (BusTransport).
+"""
+import asyncio
+import logging
+from chat_server.config import BUS_RESYNC_GRACE
+
+
+class Transport:
+    """
+    Interface of a transport. 'deliver' is an async callable
+    (topic, frame, critical) for frames on this process's topics;
+    'changed' an optional callable (topic, subscribed, initial) told when a
+    topic gains its first or loses its last subscriber among the *other*
+    processes ('initial': it was already subscribed when we joined).
+    """
+    def __init__(self, deliver, changed=None):
+        self.deliver = deliver
+        self.changed = changed
+        # Topics subscribed by this process
+        self.topics = set()
+
+    async def subscribe(self, topic):
+        self.topics.add(topic)
+
+    async def unsubscribe(self, topic):
+        self.topics.discard(topic)
+
+    async def publish(self, topics, frame, critical=True):
+        """Sends one encoded frame to the subscribers of every topic in 'topics'."""
+        raise NotImplementedError
+
+    def elsewhere(self, topic):
+        """Whether another process subscribed 'topic'."""
+        return False
+
+    def topics_elsewhere(self):
+        """Topics subscribed by other processes."""
+        return ()
+
+    async def close(self):
+        pass
+
+
+class InProcessTransport(Transport):
+    """
+    Single process: publishing is delivering. 'deliver' already skips
+    topics nobody subscribed, so no subscription set is kept (it would
+    duplicate the ClientManager's connection registry).
+    """
+
+    async def subscribe(self, topic):
+        pass
+
+    async def unsubscribe(self, topic):
+        pass
+
+    async def publish(self, topics, frame, critical=True):
+        for topic in topics:
+            await self.deliver(topic, frame, critical)
+
+
+class BusTransport(Transport):
+    """
+    Worker processes joined by the Unix socket bus (core/bus.py). Every
+    worker announces its subscriptions, so each one knows which topics live
+    elsewhere and ships only those; the BusClient coalesces everything
+    sent in one event-loop iteration into a single write. Receivers
+    deliver the topics they subscribed and ignore the rest.
+
+    After the bus connection was lost and re-established, this worker's
+    subscriptions are announced again, and remote ones the other workers
+    don't confirm within 'resync_grace' seconds are dropped (we may have
+    missed their unsubscribes).
+    """
+    def __init__(self, bus, deliver, changed=None, resync_grace=BUS_RESYNC_GRACE):
+        super().__init__(deliver, changed)
+        self.bus = bus
+        self.resync_grace = resync_grace
+        # topic -> ids of the other workers subscribed to it
+        self.remote = {}
+        # After a reconnect: topic -> workers not yet confirmed by a sync
+        self.unconfirmed = None
+
+    async def subscribe(self, topic):
+        await super().subscribe(topic)
+        self.bus.send({"op": "subscribe", "topic": topic, "worker": self.bus.worker})
+
+    async def unsubscribe(self, topic):
+        await super().unsubscribe(topic)
+        self.bus.send({"op": "unsubscribe", "topic": topic, "worker": self.bus.worker})
+
+    async def publish(self, topics, frame, critical=True):
+        remote = []
+        for topic in topics:
+            if topic in self.topics:
+                await self.deliver(topic, frame, critical)
+            if topic in self.remote:
+                remote.append(topic)
+        if remote:
+            self.bus.send({"op": "publish", "topics": remote, "frame": frame, "critical": critical})
+            await self.bus.drain()
+
+    def elsewhere(self, topic):
+        return topic in self.remote
+
+    def topics_elsewhere(self):
+        return list(self.remote)
+
+    async def close(self):
+        await self.bus.close()
+
+    async def handle(self, event):
+        """Applies a transport event from another worker. False if 'event' isn't one."""
+        op = event.get("op")
+        if op == "publish":
+            for topic in event["topics"]:
+                if topic in self.topics:
+                    await self.deliver(topic, event["frame"], event["critical"])
+        elif op == "subscribe":
+            self._add(event["topic"], event["worker"])
+        elif op == "unsubscribe":
+            self._discard(event["topic"], event["worker"])
+        elif op == "worker_up":
+            # A (re)started worker: tell it what is subscribed here
+            self.bus.send({"op": "sync", "worker": self.bus.worker, "topics": list(self.topics)})
+        elif op == "sync":
+            # 'initial' is False when the sender reconnected: we had dropped its topics
+            initial = event.get("initial", True)
+            for topic in event["topics"]:
+                self._add(topic, event["worker"], initial=initial)
+        elif op == "reconnected":
+            # This worker's bus connection came back (see BusClient._reconnect)
+            self.bus.send({"op": "sync", "worker": self.bus.worker, "topics": list(self.topics), "initial": False})
+            self.unconfirmed = {topic: set(workers) for topic, workers in self.remote.items()}
+            asyncio.get_running_loop().call_later(self.resync_grace, self._drop_unconfirmed)
+        elif op == "worker_down":
+            logging.warning(f"Worker {event['worker']} left; dropping its subscriptions")
+            for topic in [t for t, workers in self.remote.items() if event["worker"] in workers]:
+                self._discard(topic, event["worker"])
+        else:
+            return False
+        return True
+
+    def _add(self, topic, worker, initial=False):
+        if self.unconfirmed is not None and topic in self.unconfirmed:
+            self.unconfirmed[topic].discard(worker)
+        workers = self.remote.get(topic)
+        if workers is None:
+            workers = self.remote[topic] = set()
+            if self.changed is not None:
+                self.changed(topic, True, initial)
+        workers.add(worker)
+
+    def _discard(self, topic, worker):
+        workers = self.remote.get(topic)
+        if not workers:
+            return
+        workers.discard(worker)
+        if not workers:
+            del self.remote[topic]
+            if self.changed is not None:
+                self.changed(topic, False, False)
+
+    def _drop_unconfirmed(self):
+        unconfirmed, self.unconfirmed = self.unconfirmed or {}, None
+        for topic, workers in unconfirmed.items():
+            for worker in workers:
+                self._discard(topic, worker)
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import logging
+from chat_server.config import (
+    TYPING_THROTTLE_INTERVAL, TYPING_TIMEOUT, TYPING_SUMMARY_MEMBERS, TYPING_SUMMARY_INTERVAL
+)
+
+# Typists named in a summary (the rest are only counted)
+SUMMARY_NAMES = 3
+
+class TypingTracker:
+    """
+    Server-side state of who is typing where, so clients can send 'typing'
+    on every keystroke without every keystroke reaching every member.
+
+    Small chats: one 'typing' fan-out when someone starts, repeated at most
+    every 'interval' while they keep typing, and 'is_typing: false' when
+    they stop or after 'timeout' seconds without a typing event. Starting
+    again within 'interval' of the last fan-out is not passed on, so
+    toggling typing on and off can't get around the throttle.
+
+    Groups with more than 'summary_members' members get a periodic
+    'typing_summary' ("N people typing") instead, sent only when the set
+    of typists changed.
+    """
+    def __init__(self, client_manager, interval=TYPING_THROTTLE_INTERVAL, timeout=TYPING_TIMEOUT,
+                 summary_members=TYPING_SUMMARY_MEMBERS, summary_interval=TYPING_SUMMARY_INTERVAL):
+        self.client_manager = client_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.summary_members = summary_members
+        self.summary_interval = summary_interval
+        # (chat_id, user_id) -> [last fan-out time, expiry TimerHandle, recipients, shown]
+        self.typing = {}
+        # (chat_id, user_id) -> last fan-out time of a stopped indicator, until 'interval' has passed
+        self.recent = {}
+        # chat_id -> { user_id: expiry time } for summarized chats
+        self.typists = {}
+        # chat_id -> [recipients, typists in the last summary sent, summary task]
+        self.summaries = {}
+
+    async def update(self, chat_id, user_id, is_typing, recipients):
+        """
+        Records a typing event of 'user_id' in 'chat_id' and sends whatever
+        fan-out it calls for. 'recipients' are the chat's members, e.g. a
+        group's live 'members' dict (the typist is never notified about
+        themselves).
+        """
+        if len(recipients) > self.summary_members:
+            self._update_summary(chat_id, user_id, is_typing, recipients)
+            return
+        if not is_typing:
+            return await self.stop(chat_id, user_id)
+
+        key = (chat_id, user_id)
+        recipients = list(recipients)
+        state = self.typing.get(key)
+        now = time.monotonic()
+        if state is None:
+            state = self.typing[key] = [self.recent.pop(key, None), None, recipients, False]
+        else:
+            state[1].cancel()
+            state[2] = recipients
+        state[1] = asyncio.get_running_loop().call_later(self.timeout, self._expire, key)
+
+        if state[0] is not None and now - state[0] < self.interval:
+            return  # Throttled
+        state[0] = now
+        state[3] = True
+        await self._send(chat_id, user_id, True, recipients)
+
+    async def stop(self, chat_id, user_id):
+        """Ends a user's indicator in a chat (they stopped, or sent their message)."""
+        typists = self.typists.get(chat_id)
+        if typists is not None:
+            # Summarized chat: picked up by the next summary
+            typists.pop(user_id, None)
+            return
+        state = self.typing.get((chat_id, user_id))
+        if state is not None:
+            self._forget((chat_id, user_id))
+            if state[3]:
+                await self._send(chat_id, user_id, False, state[2])
+
+    # ==========================================
+    # SMALL CHATS
+    # ==========================================
+
+    def _expire(self, key):
+        state = self.typing.get(key)
+        if state is None:
+            return
+        self._forget(key)
+        if state[3]:
+            asyncio.ensure_future(self._send(key[0], key[1], False, state[2]))
+
+    def _forget(self, key):
+        state = self.typing.pop(key, None)
+        if state is None:
+            return
+        if state[1] is not None:
+            state[1].cancel()
+        # Remember the last fan-out until the throttle window is over
+        sent = state[0]
+        remaining = sent + self.interval - time.monotonic() if sent is not None else 0
+        if remaining > 0:
+            self.recent[key] = sent
+            asyncio.get_running_loop().call_later(remaining, self._release, key, sent)
+
+    def _release(self, key, sent):
+        if self.recent.get(key) == sent:
+            del self.recent[key]
+
+    async def _send(self, chat_id, user_id, is_typing, recipients):
+        payload = {
+            "from": user_id,
+            "chat_id": chat_id,
+            "is_typing": is_typing
+        }
+        await self.client_manager.send_to_users(recipients, "typing", payload, exclude_user=user_id)
+
+    # ==========================================
+    # LARGE GROUPS
+    # ==========================================
+
+    def _update_summary(self, chat_id, user_id, is_typing, recipients):
+        typists = self.typists.setdefault(chat_id, {})
+        if is_typing:
+            typists[user_id] = time.monotonic() + self.timeout
+        else:
+            typists.pop(user_id, None)
+            if not typists and chat_id not in self.summaries:
+                # Nobody was typing: nothing to report
+                del self.typists[chat_id]
+                return
+
+        summary = self.summaries.get(chat_id)
+        if summary is None:
+            task = asyncio.get_running_loop().create_task(self._summarize(chat_id))
+            self.summaries[chat_id] = [recipients, None, task]
+        else:
+            summary[0] = recipients
+
+    async def _summarize(self, chat_id):
+        """Sends the chat's typing summary (when it changed) every summary_interval while anyone types."""
+        try:
+            while True:
+                now = time.monotonic()
+                typists = self.typists.get(chat_id, {})
+                for user_id in [u for u, expires in typists.items() if expires <= now]:
+                    del typists[user_id]
+
+                summary = self.summaries[chat_id]
+                current = sorted(typists)
+                if current != summary[1]:
+                    summary[1] = current
+                    payload = {"chat_id": chat_id, "count": len(current), "user_ids": current[:SUMMARY_NAMES]}
+                    # A copy: the members of a live group can change while sending
+                    await self.client_manager.send_to_users(list(summary[0]), "typing_summary", payload)
+                if not current:
+                    break
+                await asyncio.sleep(self.summary_interval)
+        except Exception as e:
+            logging.error(f"Typing summary for {chat_id} failed: {e}")
+        finally:
+            self.summaries.pop(chat_id, None)
+            if not self.typists.get(chat_id):
+                self.typists.pop(chat_id, None)
@@ -0,0 +1,94 @@
+"""
+Multi-process mode: python -m chat_server.server --workers N
+
+The parent process runs the bus Broker (core/bus.py) and supervises N
+worker processes. Each worker is a complete server listening on the same
+port with SO_REUSEPORT, so the kernel spreads new connections across
+them, and connects to the bus to reach the users of the other workers:
+
+    - frames published for users connected elsewhere ("publish")
+    - who is connected where ("subscribe", "unsubscribe", "sync"), so
+      presence and is_online() cover every worker
+    - committed message appends and edits ("chat"), so every worker's
+      cached history and search index stay current
+
+Deliveries and who-is-connected-where are the BusTransport's job
+(core/transport.py); this module adds the message replication.
+
+Storage must be the shared SQLite database (STORAGE_BACKEND = "sqlite").
+"""
+import asyncio
+import logging
+import multiprocessing
+from chat_server.core.bus import Broker, BusClient
+from chat_server.core.transport import BusTransport
+from chat_server.utils.store import registry
+from chat_server.utils.async_store import run_io
+from chat_server.config import (
+    STORAGE_BACKEND, MESSAGES_DB, MESSAGES_DIR, WORKER_BUS_PATH, WORKER_RESTART_DELAY
+)
+
+
+def check_backend():
+    if STORAGE_BACKEND != "sqlite":
+        raise RuntimeError(
+            f'Running several workers needs STORAGE_BACKEND = "sqlite" (it is "{STORAGE_BACKEND}"): '
+            "the JSON databases can only be written by one process"
+        )
+
+
+async def join_bus(worker_id, client_manager, path=WORKER_BUS_PATH, stores=registry):
+    """Connects this worker to the bus and routes its events. Returns the BusClient."""
+    # Opening the message store reads from disk (see Dispatcher.load_handler)
+    message_store = await run_io(stores.get_messages, MESSAGES_DIR, MESSAGES_DB)
+
+    async def on_event(event):
+        if event.get("op") == "chat":
+            await message_store.apply_remote(event["action"], event["chat_key"], event["value"])
+            return
+        if event.get("op") == "reconnected":
+            # Chat events may have been missed while disconnected: reload chats from the database
+            message_store.drop_cache()
+        if not await transport.handle(event):
+            logging.warning(f"Unknown bus event: {event.get('op')}")
+
+    bus = BusClient(path, worker_id, on_event)
+    transport = BusTransport(bus, client_manager.deliver_local, client_manager.remote_changed)
+    await bus.connect()
+    await client_manager.set_transport(transport)
+    message_store.replicate = lambda action, chat_key, value: bus.send(
+        {"op": "chat", "action": action, "chat_key": chat_key, "value": value}
+    )
+    logging.info(f"Worker {worker_id} connected to the bus at {path}")
+    return bus
+
+
+async def supervise(count, target, path=WORKER_BUS_PATH):
+    """
+    Runs the Broker and 'count' processes of target(worker_id), starting
+    any that exits again. Runs until cancelled, then stops the workers.
+    """
+    check_backend()
+    broker = Broker(path)
+    await broker.start()
+    # "spawn": a worker must not inherit the parent's event loop or open files
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    try:
+        while True:
+            for worker_id in range(count):
+                process = processes.get(worker_id)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logging.error(f"Worker {worker_id} exited with code {process.exitcode}; restarting")
+                process = context.Process(target=target, args=(worker_id,), name=f"chat-worker-{worker_id}")
+                process.start()
+                processes[worker_id] = process
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+        await broker.close()
@@ -1,5 +1,5 @@
 import json
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
 from chat_server.config import GROUPS_DB
 # Ensure these are defined in chat_server/core/permissions.py
 from chat_server.core.permissions import (
@@ -8,9 +8,9 @@ from chat_server.core.permissions import (
 )
 
 class AdminHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.groups_io = FileIO(GROUPS_DB)
+        self.groups_io = stores.get(GROUPS_DB)
 
     async def handle_admin_action(self, wrapper, data):
         """
@@ -34,7 +34,7 @@ class AdminHandler:
             return await wrapper.send_error("admin", "Missing required fields")
 
         # 2. Load Groups DB
-        groups = self.groups_io.read_json()
+        groups = await self.groups_io.read_json()
         
         if group_id not in groups:
             return await wrapper.send_error("admin", "Group not found")
@@ -103,7 +103,7 @@ class AdminHandler:
         if error_msg:
             await wrapper.send_error("admin", error_msg)
         elif updated:
-            self.groups_io.write_json(groups)
+            await self.groups_io.write_json(groups, changed=[group_id])
 
             payload = {
                 "group_id": group_id,
@@ -119,7 +119,6 @@ class AdminHandler:
             if action == "kick":
                 recipients.add(target_id)
 
-            for member_id in recipients:
-                await self.client_manager.send_to_user(member_id, "group_update", payload)
+            await self.client_manager.send_to_users(recipients, "group_update", payload)
         else:
             await wrapper.send_json("admin", {"status": "no_change", "message": "Action had no effect"})
\ No newline at end of file
@@ -5,14 +5,15 @@ import time
 import logging
 import base64
 import os
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
+from chat_server.utils.indexes import USER_BY_HANDLE, USER_BY_USERNAME
 from chat_server.utils.encryption import hash_password, verify_password, generate_token
 from chat_server.config import USERS_DB, AVATARS_DIR
 
 class AuthHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.users_io = FileIO(USERS_DB)
+        self.users_io = stores.get(USERS_DB)
 
     def _generate_user_tag(self):
         return f"{random.randint(0, 9999):04d}"
@@ -32,15 +33,15 @@ class AuthHandler:
         if not username or not password:
             return await wrapper.send_error("register", "Missing fields")
 
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
 
         # 1. Generate Unique Handle
         tag = self._generate_user_tag()
         handle = self._create_handle(username, tag)
         
-        # Simple collision check
+        # Collision check (index lookup, not a scan)
         attempts = 0
-        while any(u.get("handle") == handle for u in users.values()) and attempts < 5:
+        while self.users_io.lookup(USER_BY_HANDLE, handle) and attempts < 5:
             tag = self._generate_user_tag()
             handle = self._create_handle(username, tag)
             attempts += 1
@@ -90,7 +91,7 @@ class AuthHandler:
         
         # 5. Save to DB
         users[user_id] = new_user
-        self.users_io.write_json(users)
+        await self.users_io.write_json(users, changed=[user_id])
         
         # 6. Auto Login
         await self.client_manager.register_client(user_id, wrapper)
@@ -116,21 +117,19 @@ class AuthHandler:
         if not identifier or not password:
             return await wrapper.send_error("login", "Missing credentials")
 
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         
-        user = None
-        # Search by Handle OR Username
-        for u in users.values():
-            if (u.get("handle") == identifier or u.get("username") == identifier):
-                user = u
-                break
+        # Search by Handle, then Username (oldest account wins)
+        user_id = (self.users_io.lookup_one(USER_BY_HANDLE, identifier)
+                   or self.users_io.lookup_one(USER_BY_USERNAME, identifier))
+        user = users.get(user_id) if user_id else None
             
         if user and verify_password(password, user["password"]):
             # Update FCM token
             if fcm_token:
                 user["fcm_token"] = fcm_token
                 users[user["id"]] = user
-                self.users_io.write_json(users)
+                await self.users_io.write_json(users, changed=[user["id"]])
 
             # Register connection
             await self.client_manager.register_client(user["id"], wrapper)
@@ -157,7 +156,7 @@ class AuthHandler:
         if not user_id:
             return await wrapper.send_error("reconnect", "Missing User ID")
 
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         
         # Verify user exists
         if user_id in users:
@@ -2,19 +2,21 @@ import time
 import json
 import uuid
 import random
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
+from chat_server.utils.indexes import GROUP_BY_JOIN_CODE, GROUP_BY_MEMBER
+from chat_server.utils.generate_code import generate_join_code
 from chat_server.utils.response import success, error
-from chat_server.config import GROUPS_DB, USERS_DB  # <--- Added USERS_DB
+from chat_server.config import GROUPS_DB, USERS_DB, MAX_JOIN_CODE_LENGTH, JOIN_CODE_ATTEMPTS  # <--- Added USERS_DB
 
 # Define constants
 ROLE_OWNER = "owner"
 ROLE_MEMBER = "member"
 
 class GroupHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.groups_io = FileIO(GROUPS_DB)
-        self.users_io = FileIO(USERS_DB)  # <--- Load Users DB to look up names
+        self.groups_io = stores.get(GROUPS_DB)
+        self.users_io = stores.get(USERS_DB)  # <--- Load Users DB to look up names
 
     async def handle_get_chats(self, wrapper, data):
         """
@@ -25,13 +27,10 @@ class GroupHandler:
         if not user_id: 
             return await wrapper.send_error("get_chats", "Unauthorized")
 
-        groups_db = self.groups_io.read_json()
-        my_chats = []
+        groups_db = await self.groups_io.read_json()
 
-        # Filter groups where user is a member
-        for group in groups_db.values():
-            if user_id in group.get("members", {}):
-                my_chats.append(group)
+        # Groups the user is a member of (membership index)
+        my_chats = [groups_db[group_id] for group_id in self.groups_io.lookup(GROUP_BY_MEMBER, user_id)]
 
         # Send list back to Flutter
         await wrapper.send_json("chat_list", my_chats)
@@ -50,14 +49,14 @@ class GroupHandler:
             return await wrapper.send_error("create_group", "Missing group name")
 
         # 1. Fetch Creator's Username
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         creator_name = users.get(user_id, {}).get("username", "Unknown")
 
-        groups_db = self.groups_io.read_json()
+        groups_db = await self.groups_io.read_json()
 
         # 2. Generate IDs
         group_id = str(uuid.uuid4())
-        join_code = str(uuid.uuid4())[:6].upper()
+        join_code = self._allocate_join_code()
 
         new_group = {
             "id": group_id,
@@ -76,8 +75,9 @@ class GroupHandler:
         }
 
         # 3. Save to DB
+        # (No await between allocating the code and filing it in the index)
         groups_db[group_id] = new_group
-        self.groups_io.write_json(groups_db)
+        await self.groups_io.write_json(groups_db, changed=[group_id])
 
         # 4. Send Success
         await wrapper.send_json("create_group", new_group)
@@ -91,19 +91,18 @@ class GroupHandler:
         if not user_id: 
             return await wrapper.send_error("join_group", "Unauthorized")
 
-        code = data.get("join_code")
+        code = data.get("join_code") or ""
+        if not isinstance(code, str):
+            return await wrapper.send_error("join_group", "'join_code' must be a string")
+        code = code.strip().upper()
         if not code:
             return await wrapper.send_error("join_group", "Missing join code")
 
-        groups_db = self.groups_io.read_json()
+        groups_db = await self.groups_io.read_json()
 
-        target_group = None
-        
-        # Find group by code
-        for group in groups_db.values():
-            if group.get("join_code") == code:
-                target_group = group
-                break
+        # Find group by code (index lookup)
+        group_id = self.groups_io.lookup_one(GROUP_BY_JOIN_CODE, code)
+        target_group = groups_db.get(group_id) if group_id else None
 
         if not target_group:
             return await wrapper.send_error("join_group", "Invalid Join Code")
@@ -113,7 +112,7 @@ class GroupHandler:
             return await wrapper.send_error("join_group", "Already a member")
 
         # 1. Fetch Joiner's Username
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         joiner_name = users.get(user_id, {}).get("username", "Unknown")
 
         # 2. Add member with Username
@@ -126,7 +125,7 @@ class GroupHandler:
         target_group["members"][user_id] = new_member_data
 
         # 3. Save DB
-        self.groups_io.write_json(groups_db)
+        await self.groups_io.write_json(groups_db, changed=[group_id])
 
         # 4. Notify the joiner (Success)
         await wrapper.send_json("join_group", target_group)
@@ -138,7 +137,23 @@ class GroupHandler:
             "user_data": new_member_data
         }
 
-        # Broadcast loop
-        for member_id in target_group["members"]:
-            if member_id != user_id:
-                await self.client_manager.send_to_user(member_id, "group_member_joined", notification_payload)
\ No newline at end of file
+        # Broadcast to the other members
+        await self.client_manager.send_to_users(
+            target_group["members"], "group_member_joined", notification_payload, exclude_user=user_id
+        )
+
+    # --- Helper Methods ---
+
+    def _allocate_join_code(self):
+        """
+        Returns a join code no group uses yet, checked against the join-code
+        index. If a length is crowded, the next code is one character longer.
+        Call after groups_io.read_json().
+        """
+        length = MAX_JOIN_CODE_LENGTH
+        while True:
+            for _ in range(JOIN_CODE_ATTEMPTS):
+                code = generate_join_code(length)
+                if not self.groups_io.lookup(GROUP_BY_JOIN_CODE, code):
+                    return code
+            length += 1
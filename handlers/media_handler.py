@@ -3,7 +3,7 @@ import time
 import os
 import uuid
 import base64
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
 from chat_server.config import MEDIA_DB, IMAGES_DIR, VIDEOS_DIR
 
 # Try importing MediaUtils, fallback if missing
@@ -14,10 +14,10 @@ except ImportError:
     HAS_UTILS = False
 
 class MediaHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.media_io = FileIO(MEDIA_DB)
-        # Directories are already created by config.py on startup
+        self.media_io = stores.get(MEDIA_DB)
+        # Directories are created by config.ensure_dirs() when the server starts
 
     async def handle_media_ref(self, wrapper, data):
         """
@@ -46,9 +46,9 @@ class MediaHandler:
             "created_at": time.time()
         }
 
-        media_db = self.media_io.read_json()
+        media_db = await self.media_io.read_json()
         media_db[ref_id] = entry
-        self.media_io.write_json(media_db)
+        await self.media_io.write_json(media_db, changed=[ref_id])
 
         await wrapper.send_json("media_uploaded", entry)
 
@@ -112,9 +112,9 @@ class MediaHandler:
                 "created_at": time.time()
             }
 
-            media_db = self.media_io.read_json()
+            media_db = await self.media_io.read_json()
             media_db[file_id] = entry
-            self.media_io.write_json(media_db)
+            await self.media_io.write_json(media_db, changed=[file_id])
 
             # 6. Respond
             await wrapper.send_json("media_uploaded", entry)
@@ -130,7 +130,7 @@ class MediaHandler:
         Payload: { 'media_id': str }
         """
         media_id = data.get("media_id")
-        media_db = self.media_io.read_json()
+        media_db = await self.media_io.read_json()
         
         if media_id not in media_db:
              return await wrapper.send_error("get_media", "File not found")
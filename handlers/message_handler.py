@@ -1,14 +1,21 @@
 import time
 import uuid
 import logging
-from chat_server.utils.file_io import FileIO
-from chat_server.config import MESSAGES_DB, GROUPS_DB
+from chat_server.utils.store import registry
+from chat_server.utils.indexes import GROUP_BY_MEMBER
+from chat_server.utils.message_search import snippet
+from chat_server.core.typing_indicators import TypingTracker
+from chat_server.config import (
+    MESSAGES_DB, MESSAGES_DIR, GROUPS_DB, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, REPLY_PREVIEW_LENGTH,
+    MESSAGE_SEARCH_PAGE_SIZE, MESSAGE_SEARCH_MAX_PAGE_SIZE, MESSAGE_SEARCH_MAX_RESULTS
+)
 
 class MessageHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.messages_io = FileIO(MESSAGES_DB)
-        self.groups_io = FileIO(GROUPS_DB)
+        self.message_store = stores.get_messages(MESSAGES_DIR, legacy_path=MESSAGES_DB)
+        self.groups_io = stores.get(GROUPS_DB)
+        self.typing = TypingTracker(client_manager)
 
     async def handle_send(self, wrapper, data):
         """
@@ -27,9 +34,8 @@ class MessageHandler:
         if not target_id or not content:
             return await wrapper.send_error("message", "Missing 'to' or 'content'")
 
-        # 1. Load DBs Fresh
-        messages_db = self.messages_io.read_json()
-        groups_db = self.groups_io.read_json()
+        # 1. Load Groups DB (messages are appended, never re-read on send)
+        groups_db = await self.groups_io.read_json()
 
         # 2. Determine Chat Key
         is_group = target_id in groups_db
@@ -49,18 +55,15 @@ class MessageHandler:
             "type": msg_type,
             "timestamp": int(time.time() * 1000), 
             "reply_to": reply_to,
+            "reply_preview": await self._reply_preview(chat_key, reply_to),
             "is_deleted": False,
             "reactions": {}
         }
 
-        # 4. Save to DB
-        if chat_key not in messages_db:
-            messages_db[chat_key] = []
-        
+        # 4. Save to DB (single log record)
         msg_obj['chat_id'] = target_id if is_group else chat_key
 
-        messages_db[chat_key].append(msg_obj)
-        self.messages_io.write_json(messages_db)
+        await self.message_store.append(chat_key, msg_obj)
 
         # 5. Broadcast
         response_chat_id = target_id if is_group else sender_id 
@@ -70,20 +73,32 @@ class MessageHandler:
         }
         
         await self._broadcast_to_target(target_id, "message", response_payload, groups_db, sender_id, is_group)
+        # The message is out, so the sender has stopped typing
+        await self.typing.stop(target_id, sender_id)
 
     async def handle_get_history(self, wrapper, data):
         """
         Action: 'get_chat_history'
-        Payload: { 'chat_id': str }
+        Payload: { 'chat_id': str, 'before': id|timestamp, 'after': id|timestamp, 'limit': int }
+        
+        Returns one page (oldest first). Without a cursor the latest 'limit'
+        messages are sent; 'has_more' tells the client whether to keep scrolling.
         """
         user_id = self.client_manager.get_user_id(wrapper)
         target_id = data.get("chat_id")
         
         if not user_id or not target_id: return
 
-        # 1. Load DBs Fresh
-        messages_db = self.messages_io.read_json()
-        groups_db = self.groups_io.read_json()
+        before = data.get("before")
+        after = data.get("after")
+        try:
+            limit = int(data.get("limit") or HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return await wrapper.send_error("chat_history", "Invalid limit")
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+        # 1. Load Groups DB
+        groups_db = await self.groups_io.read_json()
         
         # 2. Determine Chat Key
         is_group = target_id in groups_db
@@ -100,25 +115,27 @@ class MessageHandler:
             # --- FIX: Check for Pinned Message ---
             pinned_id = group_data.get("pinned_message_id")
             if pinned_id:
-                chat_msgs = messages_db.get(chat_key, [])
-                for m in chat_msgs:
-                    if m["id"] == pinned_id:
-                        pinned_info = {
-                            "id": pinned_id,
-                            "content": m["content"]
-                        }
-                        break
+                m = await self._find_in_chat(chat_key, pinned_id)
+                if m:
+                    pinned_info = {
+                        "id": pinned_id,
+                        "content": m["content"]
+                    }
         else:
             # Private: Sort IDs
             chat_key = "_".join(sorted([user_id, target_id]))
 
-        # 3. Retrieve Messages
-        history = messages_db.get(chat_key, [])
+        # 3. Retrieve one page of messages (loads this chat's shard only)
+        try:
+            history, has_more = await self.message_store.get_page(chat_key, before=before, after=after, limit=limit)
+        except KeyError:
+            return await wrapper.send_error("chat_history", "Invalid cursor")
         
         # 4. Send back (With Pinned Info)
         await wrapper.send_json("chat_history", {
             "chat_id": target_id,
             "messages": history,
+            "has_more": has_more,
             "pinned_message": pinned_info 
         })
 
@@ -133,8 +150,7 @@ class MessageHandler:
 
         if not chat_id or not message_id: return
 
-        messages_db = self.messages_io.read_json()
-        groups_db = self.groups_io.read_json()
+        groups_db = await self.groups_io.read_json()
 
         is_group = chat_id in groups_db
         if is_group:
@@ -142,22 +158,19 @@ class MessageHandler:
         else:
             chat_key = "_".join(sorted([user_id, chat_id]))
 
-        if chat_key not in messages_db:
-            return await wrapper.send_error("delete_message", "Chat not found")
-
-        # Find and Update
-        found = False
-        for msg in messages_db[chat_key]:
-            if msg["id"] == message_id:
-                if msg["sender_id"] == user_id:
-                    msg["is_deleted"] = True
-                    msg["content"] = "🚫 This message was deleted"
-                    msg["type"] = "deleted"
-                    found = True
-                break
+        # Index lookup: no scan of the chat's history
+        msg = await self._find_in_chat(chat_key, message_id)
+        if msg is None:
+            return await wrapper.send_error("delete_message", "Message not found")
+
+        found = msg["sender_id"] == user_id
         
         if found:
-            self.messages_io.write_json(messages_db)
+            await self.message_store.update(chat_key, message_id, {
+                "is_deleted": True,
+                "content": "🚫 This message was deleted",
+                "type": "deleted"
+            })
             
             payload = {
                 "chat_id": chat_id,
@@ -169,19 +182,27 @@ class MessageHandler:
         """
         Action: 'typing'
         Payload: { 'to': str, 'is_typing': bool }
+
+        Clients may send this on every keystroke; see TypingTracker for
+        what actually reaches the other members.
         """
         user_id = self.client_manager.get_user_id(wrapper)
         target_id = data.get("to")
-        groups_db = self.groups_io.read_json()
-        is_group = target_id in groups_db
+        if not user_id or not target_id or not isinstance(target_id, str):
+            return
 
-        payload = {
-            "from": user_id,
-            "chat_id": target_id,
-            "is_typing": data.get("is_typing", True)
-        }
+        # Sent on every keystroke: membership comes from the in-memory groups, no file check
+        groups_db = await self.groups_io.read_cached()
+        group = groups_db.get(target_id)
+        if group is not None:
+            recipients = group.get("members", {})
+            if user_id not in recipients:
+                return
+        else:
+            recipients = (target_id,)
 
-        await self._broadcast_to_target(target_id, "typing", payload, groups_db, user_id, is_group, exclude_sender=True)
+        # Throttled, expired and (in large groups) summarized by the tracker
+        await self.typing.update(target_id, user_id, bool(data.get("is_typing", True)), recipients)
 
     async def handle_pin(self, wrapper, data):
         """
@@ -193,7 +214,7 @@ class MessageHandler:
         user_id = self.client_manager.get_user_id(wrapper)
         
         # 1. Load Group DB
-        groups_db = self.groups_io.read_json()
+        groups_db = await self.groups_io.read_json()
         
         # 2. Validate
         if chat_id not in groups_db:
@@ -201,17 +222,14 @@ class MessageHandler:
 
         # 3. Save Pin State to Group Data
         groups_db[chat_id]["pinned_message_id"] = message_id
-        self.groups_io.write_json(groups_db)
+        await self.groups_io.write_json(groups_db, changed=[chat_id])
         
         # 4. Get the actual message content
-        messages_db = self.messages_io.read_json()
         pinned_content = "Pinned Message" 
         
-        chat_msgs = messages_db.get(chat_id, [])
-        for m in chat_msgs:
-            if m["id"] == message_id:
-                pinned_content = m["content"]
-                break
+        m = await self._find_in_chat(chat_id, message_id)
+        if m:
+            pinned_content = m["content"]
 
         # 5. Broadcast to Group
         payload = {
@@ -223,8 +241,103 @@ class MessageHandler:
         
         await self._broadcast_to_target(chat_id, "message_pinned", payload, groups_db, user_id, is_group=True)
 
+    async def handle_search(self, wrapper, data):
+        """
+        Action: 'search_messages'
+        Payload: { 'query': str, 'chat_id': str (optional), 'limit': int, 'offset': int }
+
+        Full-text search over the chats the user belongs to (or just 'chat_id').
+        Returns messages containing every word of the query, newest first,
+        each with a short 'snippet'. 'next_offset' is null on the last page.
+        """
+        user_id = self.client_manager.get_user_id(wrapper)
+        if not user_id:
+            return await wrapper.send_error("search_messages", "Unauthorized")
+
+        query = data.get("query", "")
+        if not isinstance(query, str) or not query.strip():
+            return await wrapper.send_error("search_messages", "Please enter a search term")
+
+        try:
+            limit = int(data.get("limit") or MESSAGE_SEARCH_PAGE_SIZE)
+            offset = int(data.get("offset") or 0)
+        except (TypeError, ValueError):
+            return await wrapper.send_error("search_messages", "Invalid limit or offset")
+        limit = max(1, min(limit, MESSAGE_SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        if offset >= MESSAGE_SEARCH_MAX_RESULTS:
+            return await wrapper.send_error("search_messages", "Offset too large, refine the query")
+        limit = min(limit, MESSAGE_SEARCH_MAX_RESULTS - offset)
+
+        groups_db = await self.groups_io.read_json()
+        chat_id = data.get("chat_id")
+
+        if chat_id:
+            # One chat: same access rules as get_chat_history
+            if chat_id in groups_db:
+                if user_id not in groups_db[chat_id].get("members", {}):
+                    return await wrapper.send_error("search_messages", "Not a member")
+                chat_key = chat_id
+            else:
+                chat_key = "_".join(sorted([user_id, chat_id]))
+            chat_keys = [chat_key]
+        else:
+            # The user's groups and private chats; the index is only read for those
+            chat_keys = set(self.groups_io.lookup(GROUP_BY_MEMBER, user_id))
+            for peer_id in await self.message_store.private_peers(user_id):
+                key = "_".join(sorted([user_id, peer_id]))
+                if key not in groups_db:
+                    chat_keys.add(key)
+
+        hits, has_more = await self.message_store.search_messages(query, chat_keys, limit, offset=offset)
+
+        results = []
+        for chat_key, msg in hits:
+            results.append({
+                # Same chat_id the client uses for this chat elsewhere
+                "chat_id": chat_key if chat_key in groups_db else self._peer_id(chat_key, user_id),
+                "message": msg,
+                "snippet": snippet(msg.get("content"), query)
+            })
+
+        await wrapper.send_json("search_messages", {
+            "query": query,
+            "results": results,
+            "offset": offset,
+            "next_offset": offset + limit if has_more and offset + limit < MESSAGE_SEARCH_MAX_RESULTS else None
+        })
+
     # --- Helper Methods ---
 
+    @staticmethod
+    def _peer_id(chat_key, user_id):
+        """The other participant of a private chat key."""
+        ids = chat_key.split("_")
+        others = [uid for uid in ids if uid != user_id]
+        return others[0] if others else user_id
+
+    async def _find_in_chat(self, chat_key, message_id):
+        """Looks a message up through the message-id index; None if it isn't in this chat."""
+        found_key, msg = await self.message_store.get_message(message_id)
+        return msg if found_key == chat_key else None
+
+    async def _reply_preview(self, chat_key, reply_to):
+        """Snapshot of the replied-to message, so clients can render it without fetching."""
+        if not reply_to:
+            return None
+        original = await self._find_in_chat(chat_key, reply_to)
+        if original is None:
+            return None
+        content = original.get("content")
+        if isinstance(content, str):
+            content = content[:REPLY_PREVIEW_LENGTH]
+        return {
+            "id": reply_to,
+            "sender_id": original.get("sender_id"),
+            "content": content,
+            "type": original.get("type")
+        }
+
     async def _broadcast_to_target(self, target_id, event_type, data, groups_db, sender_id, is_group, exclude_sender=False):
         """
         Routes the message to a group list or private pair.
@@ -239,7 +352,5 @@ class MessageHandler:
             recipients.add(target_id)
             recipients.add(sender_id)
 
-        for uid in recipients:
-            if exclude_sender and uid == sender_id:
-                continue
-            await self.client_manager.send_to_user(uid, event_type, data)
\ No newline at end of file
+        exclude_user = sender_id if exclude_sender else None
+        await self.client_manager.send_to_users(recipients, event_type, data, exclude_user=exclude_user)
\ No newline at end of file
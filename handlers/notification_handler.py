@@ -2,7 +2,7 @@ import os
 import time
 import uuid
 import json
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
 from chat_server.utils.response import success, error
 from chat_server.utils.push_service import PushService
 from chat_server.config import DB_DIR
@@ -11,16 +11,16 @@ from chat_server.config import DB_DIR
 NOTIFICATIONS_DB = os.path.join(DB_DIR, "notifications.json")
 
 class NotificationHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.file_io = FileIO(NOTIFICATIONS_DB)
+        self.file_io = stores.get(NOTIFICATIONS_DB)
 
     async def create_notification(self, user_id, title, message, type="info"):
         """
         Internal method to generate a notification. 
         Can be called by other handlers (e.g., when a group invite is sent).
         """
-        notifications = self.file_io.read_json()
+        notifications = await self.file_io.read_json()
         
         if user_id not in notifications:
             notifications[user_id] = []
@@ -35,7 +35,7 @@ class NotificationHandler:
         }
         
         notifications[user_id].append(notification)
-        self.file_io.write_json(notifications)
+        await self.file_io.write_json(notifications)
         
         # 1. Send Real-time Push (if applicable)
         await PushService.send_push_notification(user_id, title, message)
@@ -51,7 +51,7 @@ class NotificationHandler:
         if not user_id:
             return await websocket.send(json.dumps(error("auth", "Authentication required")))
 
-        notifications_db = self.file_io.read_json()
+        notifications_db = await self.file_io.read_json()
         user_notifications = notifications_db.get(user_id, [])
 
         # Sort by newest first
@@ -67,13 +67,13 @@ class NotificationHandler:
         if not user_id: return
 
         notification_id = data.get("notification_id")
-        notifications_db = self.file_io.read_json()
+        notifications_db = await self.file_io.read_json()
         
         if user_id in notifications_db:
             for notif in notifications_db[user_id]:
                 if notif["id"] == notification_id:
                     notif["read"] = True
-                    self.file_io.write_json(notifications_db)
+                    await self.file_io.write_json(notifications_db)
                     
                     await websocket.send(json.dumps(success("notification_read", {"id": notification_id})))
                     return
@@ -0,0 +1,58 @@
+from chat_server.utils.store import registry
+from chat_server.config import USERS_DB, PRESENCE_MAX_SUBSCRIPTIONS
+
+class PresenceHandler:
+    def __init__(self, client_manager, stores=registry):
+        self.client_manager = client_manager
+        self.users_io = stores.get(USERS_DB)
+
+    async def handle_subscribe(self, wrapper, data):
+        """
+        Action: 'subscribe_presence'
+        Payload: { 'user_ids': [str] }
+
+        Follows the online status of users outside the caller's groups and
+        private chats (e.g. a profile being viewed) until the caller goes
+        offline. Replies with their current status; unknown ids are ignored.
+        """
+        user_id = self.client_manager.get_user_id(wrapper)
+        if not user_id:
+            return await wrapper.send_error("subscribe_presence", "Unauthorized")
+
+        subjects = self._user_ids(data)
+        if subjects is None:
+            return await wrapper.send_error("subscribe_presence", "'user_ids' must be a list of user ids")
+
+        # Only real users can be followed (no subscriber entries for made-up ids)
+        users = await self.users_io.read_json()
+        subjects = [s for s in subjects if s in users]
+
+        statuses = self.client_manager.presence.subscribe(user_id, subjects)
+        await wrapper.send_json("subscribe_presence", {"statuses": statuses})
+
+    async def handle_unsubscribe(self, wrapper, data):
+        """
+        Action: 'unsubscribe_presence'
+        Payload: { 'user_ids': [str] } (all subscriptions if omitted)
+        """
+        user_id = self.client_manager.get_user_id(wrapper)
+        if not user_id:
+            return await wrapper.send_error("unsubscribe_presence", "Unauthorized")
+
+        subjects = None
+        if "user_ids" in data:
+            subjects = self._user_ids(data)
+            if subjects is None:
+                return await wrapper.send_error("unsubscribe_presence", "'user_ids' must be a list of user ids")
+
+        self.client_manager.presence.unsubscribe(user_id, subjects)
+        await wrapper.send_json("unsubscribe_presence", {"status": "ok"})
+
+    # --- Helper Methods ---
+
+    @staticmethod
+    def _user_ids(data):
+        user_ids = data.get("user_ids")
+        if not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids):
+            return None
+        return list(dict.fromkeys(user_ids))[:PRESENCE_MAX_SUBSCRIPTIONS]
@@ -1,13 +1,13 @@
 import json
 import os
 import base64
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
 from chat_server.config import USERS_DB, AVATARS_DIR
 
 class ProfileHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.users_io = FileIO(USERS_DB)
+        self.users_io = stores.get(USERS_DB)
 
     async def handle_update_profile(self, wrapper, data):
         """
@@ -19,7 +19,7 @@ class ProfileHandler:
             return await wrapper.send_error("auth", "Authentication required")
 
         # 1. Load User DB
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         
         if user_id not in users:
             return await wrapper.send_error("profile", "User not found")
@@ -50,7 +50,7 @@ class ProfileHandler:
             users[user_id]["bio"] = data["bio"]
 
         # 4. Save Changes
-        self.users_io.write_json(users)
+        await self.users_io.write_json(users, changed=[user_id])
         
         # 5. Send Response
         clean_user = {k: v for k, v in users[user_id].items() if k != "password"}
@@ -67,7 +67,7 @@ class ProfileHandler:
             return await wrapper.send_error("avatar", "Missing target_id")
 
         # 1. Check DB for avatar filename
-        users = self.users_io.read_json()
+        users = await self.users_io.read_json()
         user = users.get(target_id)
         
         base64_img = None
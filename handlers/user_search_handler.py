@@ -1,59 +1,90 @@
 import json
-from chat_server.utils.file_io import FileIO
-from chat_server.config import USERS_DB
+from chat_server.utils.store import registry
+from chat_server.utils.indexes import USER_BY_HANDLE, USER_BY_USERNAME
+from chat_server.utils.search_index import USER_SEARCH
+from chat_server.config import USERS_DB, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_MAX_RESULTS
+
+RANKED_MODES = ("prefix", "fuzzy")
+
+def public_profile(user):
+    """Safe Public Profile (No Passwords!)"""
+    return {
+        "id": user["id"],
+        "username": user["username"],
+        "handle": user.get("handle", "Unknown"),
+        "avatar": user.get("avatar") # Base64 string or URL
+    }
 
 class UserSearchHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.users_io = FileIO(USERS_DB)
+        self.users_io = stores.get(USERS_DB)
 
     async def handle_search(self, wrapper, data):
         """
         Action: 'search_user'
-        Payload: { 'query': 'username_or_handle' }
+        Payload: { 'query': 'username_or_handle', 'mode': 'exact' | 'prefix' | 'fuzzy' }
+
+        'exact' (default) returns the one matching user as 'search_result'.
+        The ranked modes are described in handle_ranked_search().
         """
         query = data.get("query", "").strip()
         
         if not query:
             return await wrapper.send_error("search_result", "Please enter a username or handle")
 
-        users = self.users_io.read_json()
-        found_user = None
+        if data.get("mode") in RANKED_MODES:
+            return await self.handle_ranked_search(wrapper, data, query)
 
-        # Logic: Priority Search
+        users = await self.users_io.read_json()
+
+        # Logic: Priority Search (index lookups, no scan)
         # 1. Exact Handle Match (e.g. "User#1234")
         # 2. Exact Username Match (e.g. "User")
-        
-        # Search Loop
-        for u in users.values():
-            handle = u.get("handle", "")
-            username = u.get("username", "")
-            
-            if query == handle:
-                found_user = u
-                break
-            elif query == username:
-                found_user = u
-                # Don't break yet, in case there's a better handle match later? 
-                # Actually, strictly breaking on first exact match is usually safer for performance.
-                break
+        user_id = (self.users_io.lookup_one(USER_BY_HANDLE, query)
+                   or self.users_io.lookup_one(USER_BY_USERNAME, query))
+        found_user = users.get(user_id) if user_id else None
 
         if found_user:
-            # Construct Safe Public Profile (No Passwords!)
-            public_profile = {
-                "id": found_user["id"],
-                "username": found_user["username"],
-                "handle": found_user.get("handle", "Unknown"),
-                "avatar": found_user.get("avatar") # Base64 string or URL
-            }
-            
             # Send 'search_result' (Singular) to match Flutter logic
             await wrapper.send_json("search_result", {
                 "status": "success",
-                "data": public_profile
+                "data": public_profile(found_user)
             })
         else:
             await wrapper.send_json("search_result", {
                 "status": "error",
                 "message": "User not found"
-            })
\ No newline at end of file
+            })
+
+    async def handle_ranked_search(self, wrapper, data, query):
+        """
+        Type-ahead search.
+        Payload: { 'query': str, 'mode': 'prefix' | 'fuzzy', 'limit': int, 'offset': int }
+
+        Returns up to 'limit' users as 'search_results': names starting with
+        the query first (exact, then shortest), then for 'fuzzy' names that
+        are merely similar. 'next_offset' is null on the last page.
+        """
+        try:
+            limit = int(data.get("limit") or SEARCH_PAGE_SIZE)
+            offset = int(data.get("offset") or 0)
+        except (TypeError, ValueError):
+            return await wrapper.send_error("search_results", "Invalid limit or offset")
+        limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        if offset >= SEARCH_MAX_RESULTS:
+            return await wrapper.send_error("search_results", "Offset too large, refine the query")
+        limit = min(limit, SEARCH_MAX_RESULTS - offset)
+
+        users = await self.users_io.read_json()
+        user_ids, has_more = await self.users_io.search(
+            USER_SEARCH, query, limit=limit, offset=offset, fuzzy=data.get("mode") == "fuzzy"
+        )
+
+        await wrapper.send_json("search_results", {
+            "query": query,
+            "results": [public_profile(users[uid]) for uid in user_ids if uid in users],
+            "offset": offset,
+            "next_offset": offset + len(user_ids) if has_more and offset + limit < SEARCH_MAX_RESULTS else None
+        })
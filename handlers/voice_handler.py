@@ -1,13 +1,13 @@
 import time
 import logging
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import registry
 from chat_server.config import VOICE_DB, USERS_DB
 
 class VoiceHandler:
-    def __init__(self, client_manager):
+    def __init__(self, client_manager, stores=registry):
         self.client_manager = client_manager
-        self.voice_io = FileIO(VOICE_DB)
-        self.users_io = FileIO(USERS_DB)
+        self.voice_io = stores.get(VOICE_DB)
+        self.users_io = stores.get(USERS_DB)
 
     async def handle_join_voice(self, wrapper, data):
         """
@@ -21,8 +21,8 @@ class VoiceHandler:
         if not group_id:
             return await wrapper.send_error("voice", "Missing group_id")
 
-        voice_db = self.voice_io.read_json()
-        users_db = self.users_io.read_json()
+        voice_db = await self.voice_io.read_json()
+        users_db = await self.users_io.read_json()
 
         # 1. Get User Details (Upgrade: Include Username/Avatar)
         user_info = users_db.get(user_id, {})
@@ -45,7 +45,7 @@ class VoiceHandler:
         }
         
         voice_db[group_id]["participants"][user_id] = participant_data
-        self.voice_io.write_json(voice_db)
+        await self.voice_io.write_json(voice_db)
 
         # 4. Send Success to Joiner (with list of existing peers)
         current_participants = voice_db[group_id]["participants"]
@@ -73,7 +73,7 @@ class VoiceHandler:
         
         if not group_id: return
 
-        voice_db = self.voice_io.read_json()
+        voice_db = await self.voice_io.read_json()
 
         if group_id in voice_db and user_id in voice_db[group_id]["participants"]:
             # Remove user
@@ -83,7 +83,7 @@ class VoiceHandler:
             if not voice_db[group_id]["participants"]:
                 del voice_db[group_id]
             
-            self.voice_io.write_json(voice_db)
+            await self.voice_io.write_json(voice_db)
 
             # Notify others
             notify_payload = {
@@ -103,7 +103,7 @@ class VoiceHandler:
         user_id = self.client_manager.get_user_id(wrapper)
         group_id = data.get("group_id")
         
-        voice_db = self.voice_io.read_json()
+        voice_db = await self.voice_io.read_json()
         
         if group_id in voice_db and user_id in voice_db[group_id]["participants"]:
             user_state = voice_db[group_id]["participants"][user_id]
@@ -113,7 +113,7 @@ class VoiceHandler:
             if "is_speaking" in data: user_state["is_speaking"] = data["is_speaking"]
             if "raised_hand" in data: user_state["raised_hand"] = data["raised_hand"]
 
-            self.voice_io.write_json(voice_db)
+            await self.voice_io.write_json(voice_db)
 
             # Prepare the state payload (only send necessary fields)
             state_payload = {
@@ -161,13 +161,10 @@ class VoiceHandler:
     # --- Helper ---
     async def _broadcast_to_channel(self, group_id, event_type, data, exclude_user=None):
         """Sends event to all participants in the voice channel."""
-        voice_db = self.voice_io.read_json()
+        voice_db = await self.voice_io.read_json()
         if group_id not in voice_db: return
 
         participants = voice_db[group_id]["participants"]
         
-        for pid in participants:
-            # If exclude_user is None, this condition is skipped.
-            if pid == exclude_user: continue
-            
-            await self.client_manager.send_to_user(pid, event_type, data)
\ No newline at end of file
+        # If exclude_user is None, everyone in the channel gets it
+        await self.client_manager.send_to_users(participants, event_type, data, exclude_user=exclude_user)
\ No newline at end of file
@@ -3,7 +3,7 @@ import websockets
 import logging
 import os
 import traceback
-from chat_server.config import HOST, PORT, BASE_DIR
+from chat_server.config import HOST, PORT, BASE_DIR, WORKERS, ensure_dirs
 from chat_server.core.client_manager import manager
 from chat_server.core.dispatcher import Dispatcher
 from chat_server.core.connection import ConnectionWrapper
@@ -46,7 +46,7 @@ async def connection_handler(websocket):
         async for message in websocket:
             # Lookup user ID associated with this specific wrapper instance
             # The AuthHandler registers this wrapper in the manager upon login.
-            current_user_id = manager.ws_to_user.get(ws_wrapper)
+            current_user_id = ws_wrapper.user_id
             
             try:
                 # Dispatch message to the appropriate handler
@@ -66,20 +66,59 @@ async def connection_handler(websocket):
         # Cleanup connection
         if ws_wrapper:
             await manager.remove_client(ws_wrapper)
+            # Ends the connection's writer task; nothing queued can be delivered anymore
+            ws_wrapper.stop()
 
-async def main():
+async def serve(worker_id=None):
+    """Accepts connections until cancelled. A worker (see core/workers.py) shares the port with the others."""
+    if worker_id is not None:
+        from chat_server.core.workers import join_bus
+        await join_bus(worker_id, manager)
+
+    # 'ping_interval' and 'ping_timeout' keep connections alive
+    async with websockets.serve(connection_handler, HOST, PORT, ping_interval=20, ping_timeout=20,
+                                reuse_port=worker_id is not None):
+        if worker_id is None:
+            start_snapshots()
+        # Handlers are imported on first use; load the rest (off the loop) now that clients can connect
+        await dispatcher.warm_up()
+        await asyncio.Future()  # Run forever
+
+def start_snapshots():
+    """Periodic database snapshots (backups are not taken on the write path)."""
+    from chat_server.utils.snapshot_service import snapshot_service
+    snapshot_service.start()
+
+def run_worker(worker_id):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(serve(worker_id))
+    except KeyboardInterrupt:
+        pass
+
+async def main(workers=WORKERS):
     logging.info("------------------------------------------------")
-    logging.info(f"🚀 Chat Server starting on {HOST}:{PORT}")
+    logging.info(f"🚀 Chat Server starting on {HOST}:{PORT}" + (f" ({workers} workers)" if workers > 1 else ""))
     logging.info(f"📂 Database Path: {BASE_DIR}/database")
     logging.info("------------------------------------------------")
-    
-    # Start WebSocket Server
-    # 'ping_interval' and 'ping_timeout' keep connections alive
-    async with websockets.serve(connection_handler, HOST, PORT, ping_interval=20, ping_timeout=20):
-        await asyncio.Future()  # Run forever
+
+    ensure_dirs()
+
+    if workers > 1:
+        from chat_server.core.workers import supervise
+        # Run by the parent; a single process starts them once it is listening
+        start_snapshots()
+        await supervise(workers, run_worker)
+    else:
+        await serve()
 
 if __name__ == "__main__":
+    import argparse  # Only the command line needs it, not the workers importing this module
+    parser = argparse.ArgumentParser(description="Chat server")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="server processes sharing the port (needs the sqlite storage backend)")
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.workers))
     except KeyboardInterrupt:
-        logging.info("\n🛑 Server stopped by user.")
\ No newline at end of file
+        logging.info("\n🛑 Server stopped by user.")
@@ -9,7 +9,7 @@ import sys
 sys.path.append(os.getcwd())
 
 from chat_server.handlers.auth_handler import AuthHandler
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import StoreRegistry
 
 # Define a temporary path for testing
 TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
@@ -38,7 +38,7 @@ class TestAuthHandler(unittest.IsolatedAsyncioTestCase):
         with patch("chat_server.handlers.auth_handler.USERS_DB", TEST_USERS_DB):
             self.auth_handler = AuthHandler(self.mock_client_manager)
             # Force the IO to use our test DB (double safety)
-            self.auth_handler.users_io = FileIO(TEST_USERS_DB)
+            self.auth_handler.users_io = StoreRegistry().get(TEST_USERS_DB)
 
         # 4. Mock Websocket
         self.mock_ws = AsyncMock()
@@ -0,0 +1,155 @@
+import unittest
+import os
+import sys
+import json
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+# Adjust import paths to find the module
+sys.path.append(os.getcwd())
+
+from chat_server.utils import codec
+from chat_server.core.client_manager import ClientManager
+from chat_server.core.connection import ConnectionWrapper, ConnectionClosed, SLOW_CONSUMER_CLOSE_CODE
+
+
+class FakeSocket:
+    """Records sent frames; a 'stalled' socket blocks in send() until released."""
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.release = asyncio.Event()
+        if not stalled:
+            self.release.set()
+        self.close = AsyncMock()
+
+    async def send(self, frame):
+        await self.release.wait()
+        self.sent.append(json.loads(frame))
+
+
+class TestClientManager(unittest.IsolatedAsyncioTestCase):
+
+    async def connect(self, manager, user_id, socket, **queue):
+        wrapper = ConnectionWrapper(socket, **queue)
+        await manager.register_client(user_id, wrapper)
+        return wrapper
+
+    async def test_group_fan_out_encodes_once(self):
+        """Every socket of every recipient gets the same frame, encoded a single time."""
+        manager = ClientManager()
+        sockets = {f"user_{i}": [FakeSocket(), FakeSocket()] for i in range(5)}
+        conns = []
+        for user_id, pair in sockets.items():
+            for socket in pair:
+                conns.append(await self.connect(manager, user_id, socket))
+
+        members = list(sockets) + ["offline_user"]
+        with patch("chat_server.core.client_manager.codec.dumps", wraps=codec.dumps) as dumps:
+            await manager.send_to_users(members, "message", {"text": "hi"}, exclude_user="user_0")
+        self.assertEqual(dumps.call_count, 1)
+
+        frames = {id(frame) for conn in conns for frame in conn.queue or () if "hi" in frame}
+        self.assertEqual(len(frames), 1)
+        for conn in conns:
+            await conn.drain()
+        received = [user_id for user_id, pair in sockets.items() for socket in pair
+                    if any(f["type"] == "message" for f in socket.sent)]
+        self.assertEqual(received, [u for u in sockets for _ in range(2) if u != "user_0"])
+
+    async def test_slow_client_does_not_delay_others(self):
+        manager = ClientManager()
+        slow = FakeSocket(stalled=True)
+        fast = FakeSocket()
+        slow_conn = await self.connect(manager, "slow", slow)
+        fast_conn = await self.connect(manager, "fast", fast)
+
+        for i in range(3):
+            await manager.broadcast({"type": "message", "data": {"n": i}})
+        await fast_conn.drain()
+
+        self.assertEqual([f["data"]["n"] for f in fast.sent if f["type"] == "message"], [0, 1, 2])
+        self.assertEqual(slow.sent, [])
+
+        # Once the client catches up it gets everything, in order
+        slow.release.set()
+        await slow_conn.drain()
+        self.assertEqual([f["data"]["n"] for f in slow.sent if f["type"] == "message"], [0, 1, 2])
+
+    async def test_slow_consumer_policy(self):
+        manager = ClientManager()
+        socket = FakeSocket(stalled=True)
+        conn = await self.connect(manager, "user_a", socket, drop_at=2, high_watermark=4, policy="disconnect")
+        await manager.send_to_user("user_a", "message", {"n": -1})
+        await asyncio.sleep(0)  # The writer picks that up and stalls on it
+
+        # Past the soft limit, typing events are skipped but messages still queue
+        for i in range(2):
+            await manager.send_to_user("user_a", "message", {"n": i})
+        await manager.send_to_user("user_a", "typing", {"is_typing": True})
+        self.assertEqual(conn.dropped, 1)
+        self.assertEqual(len(conn.queue), 2)
+
+        # At the high watermark the connection is closed
+        for i in range(2, 5):
+            await manager.send_to_user("user_a", "message", {"n": i})
+        await asyncio.sleep(0)
+        self.assertTrue(conn.closed)
+        socket.close.assert_awaited_with(SLOW_CONSUMER_CLOSE_CODE, "Too slow")
+
+    async def test_drop_policy_keeps_connection(self):
+        socket = FakeSocket(stalled=True)
+        conn = ConnectionWrapper(socket, drop_at=1, high_watermark=2, policy="drop")
+        results = [conn.enqueue(json.dumps({"n": i})) for i in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertFalse(conn.closed)
+
+        socket.release.set()
+        await conn.drain()
+        self.assertEqual(socket.sent, [{"n": 0}, {"n": 1}])
+        conn.stop()
+
+    async def test_idle_connection_holds_no_queue(self):
+        socket = FakeSocket()
+        conn = ConnectionWrapper(socket)
+        self.assertFalse(hasattr(conn, "__dict__"))
+        conn.enqueue(json.dumps({"n": 1}))
+        await conn.drain()
+        self.assertEqual(socket.sent, [{"n": 1}])
+        self.assertEqual(conn.sent, 1)
+        self.assertIsNone(conn.queue)
+
+    async def test_closed_socket_stops_the_writer(self):
+        """Frames still queued when the peer disconnects are dropped, not sent and logged one by one."""
+        socket = FakeSocket(stalled=True)
+        conn = ConnectionWrapper(socket)
+        for i in range(3):
+            conn.enqueue(json.dumps({"n": i}))
+
+        socket.send = AsyncMock(side_effect=ConnectionClosed(None, None))
+        socket.release.set()
+        with self.assertNoLogs(level="ERROR"):
+            await conn.drain()
+
+        socket.send.assert_awaited_once()
+        self.assertTrue(conn.closed)
+        self.assertIsNone(conn.queue)
+        self.assertFalse(conn.enqueue(json.dumps({"n": 3})))
+
+    async def test_multi_device_registry(self):
+        manager = ClientManager()
+        phone = await self.connect(manager, "user_a", FakeSocket())
+        laptop = await self.connect(manager, "user_a", FakeSocket())
+        self.assertEqual(manager.get_user_sockets("user_a"), (phone, laptop))
+        self.assertEqual(manager.connections.count, 2)
+
+        await manager.remove_client(phone)
+        self.assertEqual(manager.get_user_sockets("user_a"), (laptop,))
+        self.assertIsNone(manager.get_user_id(phone))
+        self.assertEqual(manager.get_user_id(laptop), "user_a")
+
+        await manager.remove_client(laptop)
+        self.assertFalse(manager.is_online("user_a"))
+        self.assertEqual(manager.connections.count, 0)
+
+if __name__ == "__main__":
+    unittest.main()
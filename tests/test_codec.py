@@ -0,0 +1,67 @@
+import unittest
+import os
+import json
+import shutil
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils import codec
+from chat_server.utils.file_io import FileIO
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+
+SAMPLE = {"u1": {"id": "u1", "username": "zoë", "tags": [1, 2.5, None, True], "big": 2 ** 70}}
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_compact_json_round_trip(self):
+        """Output is compact, unescaped UTF-8 and parses back identically."""
+        text = codec.dumps(SAMPLE)
+        self.assertNotIn(" ", text.replace("zoë", ""))
+        self.assertIn("zoë", text)
+        self.assertEqual(json.loads(text), SAMPLE)
+        self.assertEqual(codec.loads(codec.dumps_bytes(SAMPLE)), SAMPLE)
+
+    def test_invalid_json_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            codec.loads("{not json")
+
+    def test_files_are_compact_json_by_default(self):
+        io = FileIO(TEST_USERS_DB)
+        self.assertTrue(io.write_json(SAMPLE))
+
+        with open(TEST_USERS_DB, 'rb') as f:
+            raw = f.read()
+        self.assertNotIn(b"\n", raw)
+        self.assertEqual(io.read_json(), SAMPLE)
+
+    def test_old_pretty_printed_files_still_load(self):
+        with open(TEST_USERS_DB, 'w', encoding='utf-8') as f:
+            json.dump(SAMPLE, f, indent=4)
+        self.assertEqual(FileIO(TEST_USERS_DB).read_json(), SAMPLE)
+
+    @unittest.skipUnless(codec.msgpack, "msgpack not installed")
+    def test_msgpack_files_are_read_by_any_codec(self):
+        """Switching STORAGE_CODEC never strands files written with the other one."""
+        data = {"u1": {"id": "u1", "username": "zoë"}}
+        FileIO(TEST_USERS_DB, storage_codec=codec.MsgpackCodec).write_json(data)
+
+        with open(TEST_USERS_DB, 'rb') as f:
+            self.assertFalse(codec.is_json(f.read()))
+        self.assertEqual(FileIO(TEST_USERS_DB, storage_codec=codec.JSONCodec).read_json(), data)
+
+if __name__ == "__main__":
+    unittest.main()
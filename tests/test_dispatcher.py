@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+import json
+import asyncio
+import threading
+from unittest.mock import AsyncMock, patch
+
+# Adjust import paths to find the module
+sys.path.append(os.getcwd())
+
+from chat_server.core.dispatcher import Dispatcher, HANDLERS, ROUTES
+from chat_server.utils.store import StoreRegistry
+
+
+class EchoHandler:
+    """Stand-in handler that counts how often it was created."""
+    created = 0
+    thread = None
+
+    def __init__(self, client_manager, stores):
+        EchoHandler.created += 1
+        EchoHandler.thread = threading.get_ident()
+        self.handle_echo = AsyncMock()
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        EchoHandler.created = 0
+        self.wrapper = AsyncMock()
+        self.dispatcher = Dispatcher(client_manager=None, stores=StoreRegistry())
+
+    def test_every_route_has_a_handler(self):
+        for msg_type, (handler, method) in ROUTES.items():
+            self.assertIn(handler, HANDLERS, msg_type)
+
+    @patch.dict(HANDLERS, {"echo": (__name__, "EchoHandler")})
+    @patch.dict(ROUTES, {"echo": ("echo", "handle_echo")})
+    async def test_handlers_load_on_first_use(self):
+        """Nothing is created up front; one instance serves every later message."""
+        self.assertEqual(EchoHandler.created, 0)
+
+        for _ in range(3):
+            await self.dispatcher.dispatch(self.wrapper, json.dumps({"type": "echo", "data": {"n": 1}}))
+
+        self.assertEqual(EchoHandler.created, 1)
+        self.dispatcher.handlers["echo"].handle_echo.assert_awaited_with(self.wrapper, {"n": 1})
+
+    @patch.dict(HANDLERS, {"echo": (__name__, "EchoHandler")}, clear=True)
+    @patch.dict(ROUTES, {"echo": ("echo", "handle_echo")})
+    async def test_handlers_are_created_off_the_loop(self):
+        """Creating a handler opens its stores: that happens on the I/O executor, once."""
+        message = json.dumps({"type": "echo", "data": {}})
+        await asyncio.gather(*(self.dispatcher.dispatch(self.wrapper, message) for _ in range(5)))
+
+        self.assertEqual(EchoHandler.created, 1)
+        self.assertNotEqual(EchoHandler.thread, threading.get_ident())
+        self.assertEqual(self.dispatcher.handlers["echo"].handle_echo.await_count, 5)
+
+        await self.dispatcher.warm_up()
+        self.assertEqual(EchoHandler.created, 1)
+
+    async def test_unknown_and_invalid_messages(self):
+        await self.dispatcher.dispatch(self.wrapper, json.dumps({"type": "no_such_type"}))
+        await self.dispatcher.dispatch(self.wrapper, json.dumps({"type": ["not", "a", "string"]}))
+        await self.dispatcher.dispatch(self.wrapper, "{not json")
+        self.assertEqual(self.wrapper.send_error.await_count, 3)
+        self.assertEqual(self.dispatcher.handlers, {})
+
+if __name__ == "__main__":
+    unittest.main()
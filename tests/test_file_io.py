@@ -0,0 +1,263 @@
+import unittest
+import os
+import json
+import shutil
+import time
+import asyncio
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.file_io import FileIO, LogFileIO
+from chat_server.utils.message_store import MessageStore
+from chat_server.utils.store import StoreRegistry
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_MESSAGES_DB = os.path.join(TEST_DB_DIR, "messages.json")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
+
+class TestLogFileIO(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_MESSAGES_DB, 'w') as f:
+            json.dump({"chat_1": [{"id": "m1", "content": "old"}]}, f)
+
+        self.io = LogFileIO(TEST_MESSAGES_DB, compact_every=3)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_append_does_not_rewrite_snapshot(self):
+        """Appends go to the log; the snapshot stays untouched until compaction."""
+        self.io.append("chat_1", {"id": "m2", "content": "new"})
+
+        with open(TEST_MESSAGES_DB, 'r') as f:
+            snapshot = json.load(f)
+        self.assertEqual(len(snapshot["chat_1"]), 1)
+
+        data = self.io.read_json()
+        self.assertEqual([m["id"] for m in data["chat_1"]], ["m1", "m2"])
+
+    def test_update_replays_over_snapshot(self):
+        """Updates merge fields into the matching item."""
+        self.io.update("chat_1", "m1", {"content": "edited", "is_deleted": True})
+
+        msg = self.io.read_json()["chat_1"][0]
+        self.assertEqual(msg["content"], "edited")
+        self.assertTrue(msg["is_deleted"])
+
+    def test_compaction_folds_log_into_snapshot(self):
+        """Reaching the threshold rewrites the snapshot and empties the log."""
+        for i in range(3):
+            self.io.append("chat_2", {"id": f"x{i}"})
+
+        self.assertEqual(self.io.log_records, 0)
+        self.assertEqual(os.path.getsize(self.io.log_path), 0)
+
+        with open(TEST_MESSAGES_DB, 'r') as f:
+            snapshot = json.load(f)
+        self.assertEqual(len(snapshot["chat_2"]), 3)
+
+    def test_torn_log_line_is_ignored(self):
+        """A partial trailing record (crash mid-append) must not break reads."""
+        self.io.append("chat_1", {"id": "m2"})
+        with open(self.io.log_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "append", "key": "chat_1", "val')
+
+        data = LogFileIO(TEST_MESSAGES_DB).read_json()
+        self.assertEqual([m["id"] for m in data["chat_1"]], ["m1", "m2"])
+
+    def test_append_after_torn_line_survives(self):
+        """A record appended after a crash mid-append must not be glued to the torn line."""
+        self.io.append("chat_1", {"id": "1"})
+        with open(self.io.log_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "append", "key": "chat_1", "val')
+
+        # Restart: the next appends start on a fresh line
+        reopened = LogFileIO(TEST_MESSAGES_DB, compact_every=100)
+        reopened.append("chat_1", {"id": "2"})
+        reopened.append("chat_1", {"id": "3"})
+
+        data = LogFileIO(TEST_MESSAGES_DB).read_json()
+        self.assertEqual([m["id"] for m in data["chat_1"]], ["m1", "1", "2", "3"])
+
+    def test_crash_before_log_truncate_does_not_replay_twice(self):
+        """A snapshot renamed into place without the log being truncated already holds that log."""
+        self.io.append("chat_1", {"id": "m2"})
+        with patch.object(LogFileIO, "_truncate_log", return_value=True):
+            self.assertTrue(self.io.compact())
+        self.assertGreater(os.path.getsize(self.io.log_path), 0)
+
+        reopened = LogFileIO(TEST_MESSAGES_DB, compact_every=100)
+        self.assertEqual([m["id"] for m in reopened.read_json()["chat_1"]], ["m1", "m2"])
+
+        # The stale log is dropped before anything is appended to it
+        reopened.append("chat_1", {"id": "m3"})
+        data = LogFileIO(TEST_MESSAGES_DB).read_json()
+        self.assertEqual([m["id"] for m in data["chat_1"]], ["m1", "m2", "m3"])
+
+    def test_failed_truncate_is_reported_and_retried(self):
+        self.io.append("chat_1", {"id": "m2"})
+        real_open = open
+        def failing_open(path, mode='r', *args, **kwargs):
+            if path == self.io.log_path and mode == 'w':
+                raise OSError("read-only")
+            return real_open(path, mode, *args, **kwargs)
+
+        with patch("builtins.open", failing_open):
+            self.assertFalse(self.io.compact())
+            # Appending to the log the snapshot already holds would lose the record
+            self.assertFalse(self.io.append("chat_1", {"id": "m3"}))
+
+        self.assertTrue(self.io.append("chat_1", {"id": "m3"}))
+        data = LogFileIO(TEST_MESSAGES_DB).read_json()
+        self.assertEqual([m["id"] for m in data["chat_1"]], ["m1", "m2", "m3"])
+
+class TestDurability(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": {"id": "u1"}}, f)
+
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_failed_write_keeps_previous_file(self):
+        """A crash before the rename leaves the old file intact and no temp files behind."""
+        io = FileIO(TEST_USERS_DB, durability="os")
+        with patch("chat_server.utils.file_io.os.replace", side_effect=OSError("disk full")):
+            self.assertFalse(io.write_json({"u2": {"id": "u2"}}))
+
+        self.assertEqual(io.read_json(), {"u1": {"id": "u1"}})
+        self.assertFalse([f for f in os.listdir(TEST_DB_DIR) if f.endswith(".tmp")])
+
+    def test_always_mode_fsyncs_every_write(self):
+        io = FileIO(TEST_USERS_DB, durability="always")
+        with patch("chat_server.utils.file_io.os.fsync") as fsync:
+            io.write_json({"a": 1})
+            io.write_json({"b": 2})
+        # File + directory for each write
+        self.assertEqual(fsync.call_count, 4)
+
+    def test_os_mode_never_fsyncs(self):
+        io = LogFileIO(TEST_MESSAGES_DB, durability="os")
+        with patch("chat_server.utils.file_io.os.fsync") as fsync:
+            for i in range(10):
+                io.append("chat_1", {"id": f"m{i}"})
+        fsync.assert_not_called()
+
+    def test_batch_mode_fsyncs_every_n_writes(self):
+        io = LogFileIO(TEST_MESSAGES_DB, durability="batch")
+        with patch("chat_server.utils.file_io.FSYNC_BATCH_WRITES", 5), \
+             patch("chat_server.utils.file_io.FSYNC_BATCH_INTERVAL_MS", 60000), \
+             patch("chat_server.utils.file_io.os.fsync") as fsync:
+            io.fsync.last_sync = time.monotonic()
+            for i in range(4):
+                io.append("chat_1", {"id": f"m{i}"})
+            self.assertEqual(fsync.call_count, 0)
+            self.assertEqual(io.fsync.unsynced, {io.log_path})
+
+            io.append("chat_1", {"id": "m4"})
+            self.assertEqual(fsync.call_count, 1)
+            self.assertEqual(io.fsync.unsynced, set())
+
+class TestSharedStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB and a private registry."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": {"id": "u1", "username": "alice"}}, f)
+
+        self.registry = StoreRegistry()
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_registry_shares_one_store_per_path(self):
+        """Every caller asking for the same file gets the same cached data."""
+        store_a = self.registry.get(TEST_USERS_DB)
+        store_b = self.registry.get(os.path.join(TEST_DB_DIR, ".", "users.json"))
+
+        self.assertIs(store_a, store_b)
+        self.assertIs(await store_a.read_json(), await store_b.read_json())
+
+    async def test_write_through(self):
+        """Writes reach the disk and stay cached."""
+        store = self.registry.get(TEST_USERS_DB)
+        users = await store.read_json()
+        users["u2"] = {"id": "u2", "username": "bob"}
+        self.assertTrue(await store.write_json(users))
+
+        with open(TEST_USERS_DB, 'r') as f:
+            self.assertIn("u2", json.load(f))
+        self.assertIs(await store.read_json(), users)
+
+    async def test_external_change_invalidates_cache(self):
+        """Editing the file behind the store's back forces a reload."""
+        store = self.registry.get(TEST_USERS_DB)
+        await store.read_json()
+        version = store.store.version
+
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u9": {"id": "u9", "username": "zed"}}, f)
+
+        self.assertIn("u9", await store.read_json())
+        self.assertGreater(store.store.version, version)
+
+    async def test_concurrent_writes_are_group_committed(self):
+        """A burst of writes to one file is flushed in far fewer disk writes."""
+        store = self.registry.get(TEST_USERS_DB)
+        users = await store.read_json()
+
+        flushes = []
+        original = store.store.file_io.write_encoded
+        def counting_write(text):
+            flushes.append(text)
+            return original(text)
+        store.store.file_io.write_encoded = counting_write
+
+        async def add_user(i):
+            users[f"n{i}"] = {"id": f"n{i}"}
+            return await store.write_json(users)
+
+        results = await asyncio.gather(*(add_user(i) for i in range(20)))
+
+        self.assertTrue(all(results))
+        self.assertLessEqual(len(flushes), 2)
+        with open(TEST_USERS_DB, 'r') as f:
+            self.assertEqual(len(json.load(f)), 21)
+
+    async def test_message_appends_are_group_committed(self):
+        """Concurrent appends across chats share log flushes and survive a reload."""
+        messages = self.registry.get_messages(TEST_MESSAGES_DIR)
+
+        await asyncio.gather(*(
+            messages.append(f"chat_{i % 2}", {"id": f"m{i}", "timestamp": i})
+            for i in range(30)
+        ))
+
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(len(reopened.get_history("chat_0")), 15)
+        self.assertEqual(reopened.get_history("chat_1")[-1]["id"], "m29")
+        with open(os.path.join(TEST_MESSAGES_DIR, "chat_0.json.log")) as f:
+            # The records plus the header naming their snapshot
+            self.assertEqual(len(f.readlines()), 16)
+
+if __name__ == "__main__":
+    unittest.main()
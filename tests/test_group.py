@@ -9,7 +9,7 @@ import sys
 sys.path.append(os.getcwd())
 
 from chat_server.handlers.group_handler import GroupHandler
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import StoreRegistry
 
 # Define a temporary path for testing
 TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
@@ -38,7 +38,7 @@ class TestGroupHandler(unittest.IsolatedAsyncioTestCase):
         with patch("chat_server.handlers.group_handler.GROUPS_DB", TEST_GROUPS_DB):
             self.group_handler = GroupHandler(self.mock_client_manager)
             # Force the IO to use our test DB
-            self.group_handler.groups_io = FileIO(TEST_GROUPS_DB)
+            self.group_handler.groups_io = StoreRegistry().get(TEST_GROUPS_DB)
 
         # 4. Mock Websocket
         self.mock_ws = AsyncMock()
@@ -196,5 +196,14 @@ class TestGroupHandler(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(response["status"], "error")
         self.assertEqual(response["message"], "Already a member")
 
+    async def test_join_group_non_string_code(self):
+        """A join code that isn't a string is rejected, not crashed on."""
+        self.mock_client_manager.get_user_id = lambda ws: "user_1"
+
+        for code in (123456, ["ABC123"], {"code": "ABC123"}):
+            self.mock_ws.send_error.reset_mock()
+            await self.group_handler.handle_join_group(self.mock_ws, {"join_code": code})
+            self.mock_ws.send_error.assert_awaited_once_with("join_group", "'join_code' must be a string")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import unittest
+import os
+import json
+import shutil
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.indexes import SecondaryIndex, USER_BY_HANDLE, USER_BY_USERNAME, GROUP_BY_JOIN_CODE, GROUP_BY_MEMBER
+from chat_server.handlers.group_handler import GroupHandler
+from chat_server.utils.store import StoreRegistry
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+TEST_GROUPS_DB = os.path.join(TEST_DB_DIR, "groups.json")
+
+def user(uid, username, tag):
+    return {"id": uid, "username": username, "tag": tag, "handle": f"{username}#{tag}"}
+
+class TestSecondaryIndex(unittest.TestCase):
+
+    def test_update_after_in_place_mutation(self):
+        """Re-filing works even though the record was already changed."""
+        users = {"u1": user("u1", "alice", "0001"), "u2": user("u2", "alice", "0002")}
+        index = SecondaryIndex(USER_BY_USERNAME)
+        index.rebuild(users, generation=1)
+        self.assertEqual(index.get("alice"), ["u1", "u2"])
+
+        users["u1"]["username"] = "alicia"
+        index.update("u1", users["u1"])
+        self.assertEqual(index.get("alice"), ["u2"])
+        self.assertEqual(index.get("alicia"), ["u1"])
+
+        del users["u2"]
+        index.sync(users)
+        self.assertEqual(index.get("alice"), [])
+
+class TestStoreIndexes(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB and a private registry."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": user("u1", "alice", "0001")}, f)
+        self.store = StoreRegistry().get(TEST_USERS_DB)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_lookup_follows_writes(self):
+        users = await self.store.read_json()
+        self.assertEqual(self.store.lookup_one(USER_BY_HANDLE, "alice#0001"), "u1")
+
+        users["u2"] = user("u2", "bob", "0002")
+        await self.store.write_json(users, changed=["u2"])
+        self.assertEqual(self.store.lookup_one(USER_BY_HANDLE, "bob#0002"), "u2")
+
+        # Without 'changed' every record is compared
+        del users["u1"]
+        await self.store.write_json(users)
+        self.assertIsNone(self.store.lookup_one(USER_BY_HANDLE, "alice#0001"))
+
+    async def test_lookup_rebuilds_after_external_change(self):
+        await self.store.read_json()
+        self.assertEqual(self.store.lookup(USER_BY_USERNAME, "alice"), ["u1"])
+
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u9": user("u9", "alice", "0009")}, f, indent=2)
+
+        await self.store.read_json()
+        self.assertEqual(self.store.lookup(USER_BY_USERNAME, "alice"), ["u9"])
+
+class TestGroupIndexes(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup a groups DB and a handler on a private registry."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_GROUPS_DB, 'w') as f:
+            json.dump({"g1": {"id": "g1", "join_code": "AAAAAA", "members": {}}}, f)
+        self.store = StoreRegistry().get(TEST_GROUPS_DB)
+        self.handler = GroupHandler(client_manager=None)
+        self.handler.groups_io = self.store
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_allocation_skips_codes_in_use(self):
+        await self.store.read_json()
+        codes = iter(["AAAAAA", "BBBBBB"])
+        with patch("chat_server.handlers.group_handler.generate_join_code", lambda length: next(codes)):
+            self.assertEqual(self.handler._allocate_join_code(), "BBBBBB")
+
+    async def test_allocation_grows_when_crowded(self):
+        await self.store.read_json()
+        lengths = []
+        def generate(length):
+            lengths.append(length)
+            return "AAAAAA" if length == 6 else "A" * length
+        with patch("chat_server.handlers.group_handler.generate_join_code", generate):
+            self.assertEqual(self.handler._allocate_join_code(), "AAAAAAA")
+        self.assertEqual(lengths[-1], 7)
+
+    async def test_lookup_follows_group_writes(self):
+        groups = await self.store.read_json()
+        self.assertEqual(self.store.lookup_one(GROUP_BY_JOIN_CODE, "AAAAAA"), "g1")
+
+        groups["g2"] = {"id": "g2", "join_code": "CCCCCC", "members": {}}
+        await self.store.write_json(groups, changed=["g2"])
+        self.assertEqual(self.store.lookup_one(GROUP_BY_JOIN_CODE, "CCCCCC"), "g2")
+
+    async def test_membership_follows_joins_and_kicks(self):
+        groups = await self.store.read_json()
+        self.assertEqual(self.store.lookup(GROUP_BY_MEMBER, "u1"), [])
+
+        groups["g1"]["members"]["u1"] = {"role": "member"}
+        groups["g2"] = {"id": "g2", "join_code": "CCCCCC", "members": {"u1": {"role": "owner"}}}
+        await self.store.write_json(groups, changed=["g1"])
+        await self.store.write_json(groups, changed=["g2"])
+        self.assertEqual(self.store.lookup(GROUP_BY_MEMBER, "u1"), ["g1", "g2"])
+
+        # Kick mutates the members dict in place
+        del groups["g1"]["members"]["u1"]
+        await self.store.write_json(groups, changed=["g1"])
+        self.assertEqual(self.store.lookup(GROUP_BY_MEMBER, "u1"), ["g2"])
+
+if __name__ == "__main__":
+    unittest.main()
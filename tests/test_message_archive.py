@@ -0,0 +1,174 @@
+import unittest
+import os
+import json
+import zlib
+import shutil
+import asyncio
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.message_store import MessageStore
+from chat_server.utils.message_archive import ARCHIVE_DIR, MessageArchive, build_segment, open_segment, SegmentReader
+from chat_server.utils.async_store import AsyncMessageStore
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
+
+DAY_MS = 24 * 3600 * 1000
+NOW_MS = 100 * DAY_MS
+
+def message(i, day=0):
+    return {"id": f"m{i}", "content": f"message number {i}", "timestamp": day * DAY_MS + i}
+
+# Small windows so a handful of messages exercise the cold tier
+@patch("chat_server.utils.message_store.RETENTION_HOT_MESSAGES", 3)
+@patch("chat_server.utils.message_store.RETENTION_HOT_DAYS", 30)
+@patch("chat_server.utils.message_store.ARCHIVE_SEGMENT_MESSAGES", 4)
+class TestMessageArchive(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def make_store(self, count, day=0):
+        store = MessageStore(TEST_MESSAGES_DIR)
+        for i in range(count):
+            store.append("chat_a", message(i, day))
+        return store
+
+    def test_archives_whole_segments_outside_hot_window(self):
+        """Only old messages beyond the newest N move, in whole segments."""
+        store = self.make_store(12)
+        self.assertEqual(store.archive_chat("chat_a", now_ms=NOW_MS), 8)
+        self.assertEqual(len(store.get_history("chat_a")), 4)
+        self.assertEqual(len(os.listdir(os.path.join(TEST_MESSAGES_DIR, ARCHIVE_DIR, "chat_a"))), 2)
+
+        # Recent messages stay hot however many there are
+        recent = MessageStore(os.path.join(TEST_DB_DIR, "recent"))
+        for i in range(12):
+            recent.append("chat_a", message(i, day=90))
+        self.assertEqual(recent.archive_chat("chat_a", now_ms=NOW_MS), 0)
+
+    def test_paging_reads_archive_transparently(self):
+        """Scrolling back crosses from the hot shard into the segments, after a restart too."""
+        self.make_store(12).archive_chat("chat_a", now_ms=NOW_MS)
+        store = MessageStore(TEST_MESSAGES_DIR)
+
+        latest, has_more = store.get_page("chat_a", limit=3)
+        self.assertEqual([m["id"] for m in latest], ["m9", "m10", "m11"])
+        self.assertTrue(has_more)
+
+        older, has_more = store.get_page("chat_a", before="m9", limit=5)
+        self.assertEqual([m["id"] for m in older], ["m4", "m5", "m6", "m7", "m8"])
+        self.assertTrue(has_more)
+
+        oldest, has_more = store.get_page("chat_a", before="m4", limit=10)
+        self.assertEqual([m["id"] for m in oldest], ["m0", "m1", "m2", "m3"])
+        self.assertFalse(has_more)
+
+        newer, _ = store.get_page("chat_a", after="m2", limit=3)
+        self.assertEqual([m["id"] for m in newer], ["m3", "m4", "m5"])
+
+        by_time, _ = store.get_page("chat_a", before=6, limit=2)
+        self.assertEqual([m["id"] for m in by_time], ["m4", "m5"])
+
+    def test_archived_messages_stay_addressable(self):
+        """Lookups, deletes and search still work once a message is archived."""
+        store = self.make_store(12)
+        store.archive_chat("chat_a", now_ms=NOW_MS)
+
+        self.assertEqual(store.get_message("m1")[1]["content"], "message number 1")
+        self.assertTrue(store.update("chat_a", "m1", {"is_deleted": True, "content": "deleted", "type": "deleted"}))
+
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertTrue(reopened.get_message("m1")[1]["is_deleted"])
+        hits, _ = reopened.search_messages("number 2", None, limit=10)
+        self.assertEqual([m["id"] for _, m in hits], ["m2"])
+        self.assertEqual(reopened.search_messages("number 1", None, limit=10), ([], False))
+
+    def test_crash_before_trim_is_repaired(self):
+        """Messages still in the shard after being archived are dropped on load."""
+        store = self.make_store(12)
+        entry = store._entry("chat_a")
+        plan = store.plan_archive(entry, now_ms=NOW_MS)
+        store.write_index_lines(store.commit_archive(entry, plan, store.write_archive(entry, plan)))
+        # ...and the shard trim never happens
+
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(len(reopened.get_history("chat_a")), 4)
+        page, _ = reopened.get_page("chat_a", limit=20)
+        self.assertEqual([m["id"] for m in page], [f"m{i}" for i in range(12)])
+
+class TestSegmentFiles(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def write(self, name, payload):
+        path = os.path.join(TEST_DB_DIR, name)
+        with open(path, 'wb') as f:
+            f.write(payload)
+        return path
+
+    def test_slices_across_blocks(self):
+        """Any range of messages is cut out of the mapped blocks, for every compression."""
+        messages = [message(i) for i in range(10)]
+        lines = MessageArchive.encode_messages(messages)
+        timestamps = [float(m["timestamp"]) for m in messages]
+        for method in ("none", "zlib", "lzma"):
+            reader = open_segment(self.write(method, build_segment(timestamps, lines, method, block_messages=3)))
+            self.assertIsInstance(reader, SegmentReader)
+            self.assertEqual(list(reader.timestamps), timestamps)
+            self.assertEqual(reader.slice(2, 7), messages[2:7])
+            self.assertEqual(reader.slice(9, 20), messages[9:])
+            self.assertEqual(reader.slice(0, 10), messages)
+
+    def test_reads_whole_file_segments(self):
+        """Segments from before the block format are still readable."""
+        messages = [message(i) for i in range(3)]
+        payload = zlib.compress(json.dumps({"timestamps": [0, 1, 2], "messages": messages}).encode())
+        reader = open_segment(self.write("legacy.seg", payload))
+        self.assertEqual(reader.slice(1, 3), messages[1:])
+
+@patch("chat_server.utils.message_store.RETENTION_HOT_MESSAGES", 3)
+@patch("chat_server.utils.message_store.ARCHIVE_SEGMENT_MESSAGES", 4)
+class TestAsyncArchive(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_appends_trigger_archiving(self):
+        store = AsyncMessageStore(MessageStore(TEST_MESSAGES_DIR))
+        for i in range(10):
+            await store.append("chat_a", message(i))
+        while store._archiving:
+            await asyncio.gather(*store._archiving.values())
+
+        self.assertEqual(len(await store.get_history("chat_a")), 6)
+        page, has_more = await store.get_page("chat_a", before="m5", limit=3)
+        self.assertEqual([m["id"] for m in page], ["m2", "m3", "m4"])
+        self.assertTrue(has_more)
+
+        # The shard log was trimmed in order with the appends
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual([m["id"] for m in reopened.get_history("chat_a")], [f"m{i}" for i in range(4, 10)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+import unittest
+import os
+import json
+import shutil
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.message_store import MessageStore, INDEX_FILE
+from chat_server.utils.message_search import SEARCH_FILE, snippet
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_MESSAGES_DB = os.path.join(TEST_DB_DIR, "messages.json")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
+
+class TestMessageStore(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_one_shard_per_chat(self):
+        """Each chat key is persisted to its own file."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "a"})
+        store.append("chat_b", {"id": "m2", "content": "b"})
+
+        files = sorted(f for f in os.listdir(TEST_MESSAGES_DIR) if not f.startswith("."))
+        self.assertEqual(files, ["chat_a.json.log", "chat_b.json.log"])
+
+        # A fresh store only sees what is on disk
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(reopened.get_history("chat_a"), [{"id": "m1", "content": "a"}])
+
+    def test_unsafe_chat_key_is_hashed(self):
+        """Chat keys built from client input never escape the shard directory."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("../../evil", {"id": "m1"})
+
+        files = [f for f in os.listdir(TEST_MESSAGES_DIR) if not f.startswith(".")]
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith("h_"))
+
+    def test_lru_respects_budget(self):
+        """Least recently used chats are evicted once the budget is exceeded."""
+        store = MessageStore(TEST_MESSAGES_DIR, budget=200)
+        for key in ("c1", "c2", "c3"):
+            store.append(key, {"id": key, "content": "x" * 80})
+
+        self.assertLessEqual(store.cached_bytes, 200)
+        self.assertNotIn("c1", store._cache)
+        self.assertIn("c3", store._cache)
+
+        # Evicted chats are transparently reloaded from disk
+        self.assertEqual(store.get_history("c1")[0]["id"], "c1")
+
+    def test_update_and_find(self):
+        """Updates are persisted and visible through find()."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "hello"})
+
+        self.assertTrue(store.update("chat_a", "m1", {"content": "edited"}))
+        self.assertFalse(store.update("chat_a", "missing", {"content": "x"}))
+
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(reopened.find("chat_a", "m1")["content"], "edited")
+
+    def test_apply_remote(self):
+        """Changes committed by another process reach the cache without being written again."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "hello"})
+        other = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(len(other.get_history("chat_a")), 1)
+
+        message = {"id": "m2", "content": "remote words", "timestamp": 2}
+        store.append("chat_a", message)
+        other.apply_remote("append", "chat_a", message)
+        other.apply_remote("append", "chat_a", message)  # Delivered twice: kept once
+        other.apply_remote("update", "chat_a", ("m1", {"content": "edited"}))
+
+        self.assertEqual([m["id"] for m in other.get_history("chat_a")], ["m1", "m2"])
+        self.assertEqual(other.find("chat_a", "m1")["content"], "edited")
+        hits, _ = other.search_messages("remote", None, 10)
+        self.assertEqual([m["id"] for _, m in hits], ["m2"])
+        # Only the originating store wrote the message
+        self.assertEqual(len(MessageStore(TEST_MESSAGES_DIR).get_history("chat_a")), 2)
+
+    def test_late_remote_append_reloads_the_chat(self):
+        """A remote append older than the cached messages is read back in order from disk."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        other = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "timestamp": 1})
+        other.get_history("chat_a")
+
+        second, third = {"id": "m2", "timestamp": 2}, {"id": "m3", "timestamp": 3}
+        store.append("chat_a", second)
+        store.append("chat_a", third)
+        other.apply_remote("append", "chat_a", third)
+        other.apply_remote("append", "chat_a", second)
+
+        self.assertEqual([m["id"] for m in other.get_history("chat_a")], ["m1", "m2", "m3"])
+
+    def test_legacy_messages_json_is_migrated(self):
+        """The old single-file database is split into shards once."""
+        with open(TEST_MESSAGES_DB, 'w') as f:
+            json.dump({"chat_a": [{"id": "m1"}], "chat_b": [{"id": "m2"}]}, f)
+
+        store = MessageStore(TEST_MESSAGES_DIR, legacy_path=TEST_MESSAGES_DB)
+
+        self.assertFalse(os.path.exists(TEST_MESSAGES_DB))
+        self.assertTrue(os.path.exists(TEST_MESSAGES_DB + ".migrated"))
+        self.assertEqual(store.get_history("chat_b"), [{"id": "m2"}])
+
+    def test_interrupted_migration_runs_again_without_duplicates(self):
+        """Shards written before a crash (legacy file not yet renamed) are not filled twice."""
+        with open(TEST_MESSAGES_DB, 'w') as f:
+            json.dump({"chat_a": [{"id": "m1"}, {"id": "m2"}], "chat_b": [{"id": "m3"}]}, f)
+        MessageStore(TEST_MESSAGES_DIR, legacy_path=TEST_MESSAGES_DB)
+
+        # As if the process died before the rename
+        os.replace(TEST_MESSAGES_DB + ".migrated", TEST_MESSAGES_DB)
+        store = MessageStore(TEST_MESSAGES_DIR, legacy_path=TEST_MESSAGES_DB)
+
+        self.assertEqual([m["id"] for m in store.get_history("chat_a")], ["m1", "m2"])
+        self.assertEqual([m["id"] for m in store.get_history("chat_b")], ["m3"])
+        self.assertTrue(os.path.exists(TEST_MESSAGES_DB + ".migrated"))
+
+    def test_paging_by_message_id(self):
+        """Pages walk backwards and forwards from a message id cursor."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        for i in range(10):
+            store.append("chat_a", {"id": f"m{i}", "timestamp": 1000 + i})
+
+        latest, has_more = store.get_page("chat_a", limit=3)
+        self.assertEqual([m["id"] for m in latest], ["m7", "m8", "m9"])
+        self.assertTrue(has_more)
+
+        older, has_more = store.get_page("chat_a", before="m7", limit=5)
+        self.assertEqual([m["id"] for m in older], ["m2", "m3", "m4", "m5", "m6"])
+        self.assertTrue(has_more)
+
+        oldest, has_more = store.get_page("chat_a", before="m2", limit=5)
+        self.assertEqual([m["id"] for m in oldest], ["m0", "m1"])
+        self.assertFalse(has_more)
+
+        newer, has_more = store.get_page("chat_a", after="m6", limit=5)
+        self.assertEqual([m["id"] for m in newer], ["m7", "m8", "m9"])
+        self.assertFalse(has_more)
+
+    def test_paging_by_timestamp(self):
+        """Timestamp cursors work across legacy (seconds) and new (ms) messages."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "old", "timestamp": 1765790125.28})
+        store.append("chat_a", {"id": "new1", "timestamp": 1765790200000})
+        store.append("chat_a", {"id": "new2", "timestamp": 1765790300000})
+
+        page, _ = store.get_page("chat_a", before=1765790200000, limit=10)
+        self.assertEqual([m["id"] for m in page], ["old"])
+
+        page, _ = store.get_page("chat_a", after="1765790200000", limit=10)
+        self.assertEqual([m["id"] for m in page], ["new2"])
+
+    def test_unknown_cursor(self):
+        """An unknown message id is rejected rather than silently paging from the end."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "timestamp": 1})
+
+        with self.assertRaises(KeyError):
+            store.get_page("chat_a", before="nope")
+
+    def test_message_index_finds_any_chat(self):
+        """A message id alone resolves to its chat and position."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        for i in range(5):
+            store.append(f"chat_{i % 2}", {"id": f"m{i}", "content": str(i)})
+
+        self.assertEqual(store.locate("m3"), ("chat_1", 1))
+        self.assertEqual(store.get_message("m4"), ("chat_0", {"id": "m4", "content": "4"}))
+        self.assertEqual(store.get_message("nope"), (None, None))
+
+        # Persisted: a fresh store answers without loading any chat
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(reopened.locate("m3"), ("chat_1", 1))
+        self.assertEqual(reopened.cached_bytes, 0)
+
+    def test_message_index_is_rebuilt(self):
+        """Deployments without an index get one built from the shards; lost entries are repaired on load."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1"})
+        store.append("chat_b", {"id": "m2"})
+        for name in os.listdir(TEST_MESSAGES_DIR):
+            if name.startswith(INDEX_FILE):
+                os.remove(os.path.join(TEST_MESSAGES_DIR, name))
+
+        rebuilt = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(rebuilt.locate("m2"), ("chat_b", 0))
+
+        # Simulate an index entry lost in a crash
+        with rebuilt.index.db.transaction() as cur:
+            cur.execute("DELETE FROM message_locations WHERE id = 'm1'")
+        self.assertIsNone(rebuilt.locate("m1"))
+        rebuilt.get_history("chat_a")
+        self.assertEqual(rebuilt.locate("m1"), ("chat_a", 0))
+
+    def test_search_messages(self):
+        """Every query word must match; results are newest first and scoped by chat."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "Lunch at noon?", "timestamp": 1000})
+        store.append("chat_b", {"id": "m2", "content": "lunch is ready", "timestamp": 2000})
+        store.append("chat_a", {"id": "m3", "content": "no lunch today", "timestamp": 3000})
+        store.append("chat_a", {"id": "m4", "content": "lunch.png", "type": "image", "timestamp": 4000})
+        everywhere = None
+
+        hits, has_more = store.search_messages("LUNCH", everywhere, limit=2)
+        self.assertEqual([m["id"] for _, m in hits], ["m3", "m2"])
+        self.assertTrue(has_more)
+
+        hits, _ = store.search_messages("lunch", ["chat_a"], limit=10)
+        self.assertEqual([m["id"] for _, m in hits], ["m3", "m1"])
+
+        hits, _ = store.search_messages("lunch noon", everywhere, limit=10)
+        self.assertEqual(hits, [("chat_a", store.find("chat_a", "m1"))])
+
+    def test_search_reads_only_the_searched_chats(self):
+        """Postings of other chats are skipped in SQL, and pages are read in batches."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        for i in range(20):
+            store.append("chat_busy", {"id": f"b{i}", "content": "standup notes", "timestamp": 1000 + i})
+        for i in range(5):
+            store.append("chat_mine", {"id": f"m{i}", "content": "standup", "timestamp": i})
+
+        plan = store.search.db.query(
+            "EXPLAIN QUERY PLAN SELECT 1 FROM message_terms AS p WHERE p.term = ? AND p.chat_key IN (?, ?)",
+            ("standup", "a", "b")
+        )
+        self.assertIn("idx_message_terms_chat", " ".join(row[-1] for row in plan))
+
+        with patch("chat_server.utils.message_search.FETCH_BATCH", 2):
+            hits, has_more = store.search_messages("standup", ["chat_mine", "chat_gone"], limit=3, offset=1)
+        self.assertEqual([m["id"] for _, m in hits], ["m3", "m2", "m1"])
+        self.assertTrue(has_more)
+        self.assertEqual(store.search_messages("notes", ["chat_mine"], limit=10), ([], False))
+        self.assertEqual(store.search_messages("standup", [], limit=10), ([], False))
+
+    def test_search_follows_deletes_and_restarts(self):
+        """Deleted messages leave the index; the index is persisted and rebuilt if missing."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "secret plan"})
+        store.append("chat_a", {"id": "m2", "content": "public plan"})
+        store.update("chat_a", "m1", {"is_deleted": True, "content": "deleted", "type": "deleted"})
+
+        reopened = MessageStore(TEST_MESSAGES_DIR)
+        self.assertEqual(reopened.search_messages("secret", None, limit=10), ([], False))
+        self.assertEqual(len(reopened.search_messages("plan", None, limit=10)[0]), 1)
+
+        for name in os.listdir(TEST_MESSAGES_DIR):
+            if name.startswith(SEARCH_FILE):
+                os.remove(os.path.join(TEST_MESSAGES_DIR, name))
+        rebuilt = MessageStore(TEST_MESSAGES_DIR)
+        hits, _ = rebuilt.search_messages("plan", None, limit=10)
+        self.assertEqual([m["id"] for _, m in hits], ["m2"])
+
+    def test_search_index_lives_on_disk(self):
+        """Postings are read per query, so a store sees what another one indexed."""
+        store = MessageStore(TEST_MESSAGES_DIR)
+        other = MessageStore(TEST_MESSAGES_DIR)
+        store.append("chat_a", {"id": "m1", "content": "shared notes", "timestamp": 1000})
+
+        hits, _ = other.search_messages("notes", None, limit=10)
+        self.assertEqual([m["id"] for _, m in hits], ["m1"])
+
+    def test_snippet(self):
+        """Long messages are cut around the first matching word."""
+        text = "x" * 200 + " needle " + "y" * 200
+        cut = snippet(text, "NEEDLE", length=40)
+        self.assertIn("needle", cut)
+        self.assertTrue(cut.startswith("…") and cut.endswith("…"))
+        self.assertEqual(snippet("short", "needle"), "short")
+
+if __name__ == "__main__":
+    unittest.main()
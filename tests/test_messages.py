@@ -9,28 +9,30 @@ import sys
 sys.path.append(os.getcwd())
 
 from chat_server.handlers.message_handler import MessageHandler
-from chat_server.utils.file_io import FileIO
+from chat_server.utils.store import StoreRegistry
 
 # Define a temporary path for testing
 TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
 TEST_MESSAGES_DB = os.path.join(TEST_DB_DIR, "messages.json")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
 TEST_GROUPS_DB = os.path.join(TEST_DB_DIR, "groups.json")
 
 class MockClientManager:
-    """Mocks the ClientManager."""
+    """Mocks the ClientManager: fan-out goes through send_to_users(user_ids, msg_type, data)."""
     def __init__(self):
-        self.send_personal_message = AsyncMock()
+        self.send_to_users = AsyncMock()
         # Mock connection map to simulate logged-in users
         self.connection_map = {}
 
+    def get_user_id(self, wrapper):
+        return self.connection_map.get(wrapper)
+
 class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
         """Runs before each test: Setup temp DB and Mocks."""
         # 1. Setup temporary test directory and empty JSON files
         os.makedirs(TEST_DB_DIR, exist_ok=True)
-        with open(TEST_MESSAGES_DB, 'w') as f:
-            json.dump({}, f)
         with open(TEST_GROUPS_DB, 'w') as f:
             json.dump({}, f)
 
@@ -40,12 +42,14 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         # 3. Initialize Handler
         # We patch the config paths to point to our test DBs
         with patch("chat_server.handlers.message_handler.MESSAGES_DB", TEST_MESSAGES_DB), \
+             patch("chat_server.handlers.message_handler.MESSAGES_DIR", TEST_MESSAGES_DIR), \
              patch("chat_server.handlers.message_handler.GROUPS_DB", TEST_GROUPS_DB):
             
             self.message_handler = MessageHandler(self.mock_client_manager)
             # Force the IO instances to use our test DBs
-            self.message_handler.messages_io = FileIO(TEST_MESSAGES_DB)
-            self.message_handler.groups_io = FileIO(TEST_GROUPS_DB)
+            stores = StoreRegistry()
+            self.message_handler.message_store = stores.get_messages(TEST_MESSAGES_DIR)
+            self.message_handler.groups_io = stores.get(TEST_GROUPS_DB)
 
         # 4. Mock Websocket and authorize a user
         self.mock_ws = AsyncMock()
@@ -72,27 +76,22 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         await self.message_handler.handle_send(self.mock_ws, payload)
 
         # 1. Verify Message Saved to DB
-        with open(TEST_MESSAGES_DB, 'r') as f:
-            db_data = json.load(f)
-        
         # Key should be sorted: user_A + user_B -> "user_A_user_B"
         chat_key = "_".join(sorted([self.sender_id, target_id]))
-        self.assertIn(chat_key, db_data)
+        history = await self.message_handler.message_store.get_history(chat_key)
+        self.assertEqual(len(history), 1)
         
-        message = db_data[chat_key][0]
+        message = history[0]
         self.assertEqual(message["content"], "Hello World")
         self.assertEqual(message["sender_id"], self.sender_id)
         self.assertFalse(message["is_deleted"])
 
-        # 2. Verify Broadcast (Target AND Sender should receive it)
-        # We expect 2 calls to send_personal_message
-        self.assertEqual(self.mock_client_manager.send_personal_message.call_count, 2)
-        
-        # Check logic: it calls send_personal_message(payload, uid)
-        call_args_list = self.mock_client_manager.send_personal_message.call_args_list
-        recipients = [call.args[1] for call in call_args_list]
-        self.assertIn(target_id, recipients)
-        self.assertIn(self.sender_id, recipients)
+        # 2. Verify Broadcast (Target AND Sender should receive it, in one fan-out)
+        self.mock_client_manager.send_to_users.assert_awaited_once()
+        user_ids, msg_type, data = self.mock_client_manager.send_to_users.call_args.args
+        self.assertEqual(set(user_ids), {target_id, self.sender_id})
+        self.assertEqual(msg_type, "message")
+        self.assertEqual(data, {"chat_id": self.sender_id, "message": message})
 
     async def test_send_group_message(self):
         """Test sending a message to a group."""
@@ -103,7 +102,7 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         group_data = {
             group_id: {
                 "id": group_id,
-                "members": [self.sender_id, member_id]
+                "members": {self.sender_id: {"role": "owner"}, member_id: {"role": "member"}}
             }
         }
         with open(TEST_GROUPS_DB, 'w') as f:
@@ -118,18 +117,15 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         await self.message_handler.handle_send(self.mock_ws, payload)
 
         # 3. Verify Message Saved under Group ID
-        with open(TEST_MESSAGES_DB, 'r') as f:
-            db_data = json.load(f)
-        
-        self.assertIn(group_id, db_data)
-        self.assertEqual(db_data[group_id][0]["content"], "Hi Group!")
+        history = await self.message_handler.message_store.get_history(group_id)
+        self.assertEqual(history[0]["content"], "Hi Group!")
 
         # 4. Verify Broadcast to all members
-        call_args_list = self.mock_client_manager.send_personal_message.call_args_list
-        recipients = [call.args[1] for call in call_args_list]
-        
-        self.assertIn(member_id, recipients)
-        self.assertIn(self.sender_id, recipients)
+        self.mock_client_manager.send_to_users.assert_awaited_once()
+        user_ids, msg_type, data = self.mock_client_manager.send_to_users.call_args.args
+        self.assertEqual(set(user_ids), {member_id, self.sender_id})
+        self.assertEqual(msg_type, "message")
+        self.assertEqual(data, {"chat_id": group_id, "message": history[0]})
 
     async def test_delete_message(self):
         """Test deleting a message."""
@@ -145,8 +141,7 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
             "type": "text",
             "is_deleted": False
         }
-        with open(TEST_MESSAGES_DB, 'w') as f:
-            json.dump({chat_key: [initial_msg]}, f)
+        await self.message_handler.message_store.append(chat_key, initial_msg)
 
         # 2. Send Delete Request
         payload = {
@@ -156,16 +151,17 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         await self.message_handler.handle_delete(self.mock_ws, payload)
 
         # 3. Verify DB Update
-        with open(TEST_MESSAGES_DB, 'r') as f:
-            db_data = json.load(f)
-        
-        updated_msg = db_data[chat_key][0]
+        updated_msg = await self.message_handler.message_store.find(chat_key, message_id)
         self.assertTrue(updated_msg["is_deleted"])
         self.assertEqual(updated_msg["type"], "deleted")
         self.assertIn("deleted", updated_msg["content"]) # Content should be masked
 
         # 4. Verify Broadcast
-        self.mock_client_manager.send_personal_message.assert_called()
+        self.mock_client_manager.send_to_users.assert_awaited_once()
+        user_ids, msg_type, data = self.mock_client_manager.send_to_users.call_args.args
+        self.assertEqual(set(user_ids), {target_id, self.sender_id})
+        self.assertEqual(msg_type, "message_deleted")
+        self.assertEqual(data, {"chat_id": target_id, "message_id": message_id})
 
     async def test_typing_indicator(self):
         """Test typing status broadcast."""
@@ -178,15 +174,15 @@ class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
         await self.message_handler.handle_typing(self.mock_ws, payload)
 
         # Verify broadcast is sent ONLY to the target, NOT echoed to sender
-        self.mock_client_manager.send_personal_message.assert_called_once()
-        args, _ = self.mock_client_manager.send_personal_message.call_args
-        
-        sent_payload = args[0]
-        recipient = args[1]
-        
-        self.assertEqual(recipient, target_id)
-        self.assertEqual(sent_payload["data"]["from"], self.sender_id)
-        self.assertTrue(sent_payload["data"]["is_typing"])
+        self.mock_client_manager.send_to_users.assert_awaited_once()
+        call = self.mock_client_manager.send_to_users.call_args
+        user_ids, msg_type, data = call.args
+
+        self.assertEqual(list(user_ids), [target_id])
+        self.assertEqual(call.kwargs.get("exclude_user"), self.sender_id)
+        self.assertEqual(msg_type, "typing")
+        self.assertEqual(data["from"], self.sender_id)
+        self.assertTrue(data["is_typing"])
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
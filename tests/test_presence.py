@@ -0,0 +1,147 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import asyncio
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+sys.path.append(os.getcwd())
+
+from chat_server.core.client_manager import ClientManager
+from chat_server.core.connection import ConnectionWrapper
+from chat_server.core.presence import PresenceService
+from chat_server.utils.store import StoreRegistry
+from chat_server.handlers.presence_handler import PresenceHandler
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_GROUPS_DB = os.path.join(TEST_DB_DIR, "groups.json")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(json.loads(frame))
+
+
+class TestPresence(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        """Runs before each test: a group (alice, bob) and a private chat (alice, carol)."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_GROUPS_DB, 'w') as f:
+            json.dump({"group_1": {"id": "group_1", "members": {"alice": "owner", "bob": "member"}}}, f)
+
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({user_id: {"id": user_id} for user_id in ("alice", "bob", "carol", "dave")}, f)
+
+        self.stores = stores = StoreRegistry()
+        self.manager = ClientManager()
+        self.manager.presence = PresenceService(self.manager, window=0.01)
+        self.manager.presence.groups_io = stores.get(TEST_GROUPS_DB)
+        self.manager.presence.message_store = stores.get_messages(TEST_MESSAGES_DIR)
+        await self.manager.presence.message_store.append("alice_carol", {"id": "m1", "timestamp": 1})
+
+        self.sockets = {}
+        self.wrappers = {}
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def connect(self, *user_ids):
+        for user_id in user_ids:
+            self.sockets[user_id] = FakeSocket()
+            self.wrappers[user_id] = ConnectionWrapper(self.sockets[user_id])
+            await self.manager.register_client(user_id, self.wrappers[user_id])
+
+    async def settle(self):
+        """Lets the batch window pass and the queues drain; returns and clears what arrived."""
+        await asyncio.sleep(0.05)
+        received = {}
+        for user_id, wrapper in self.wrappers.items():
+            await wrapper.drain()
+            received[user_id] = [u for f in self.sockets[user_id].sent if f["type"] == "presence"
+                                 for u in f["data"]["updates"]]
+            self.sockets[user_id].sent.clear()
+        return received
+
+    async def test_only_contacts_hear_about_a_user(self):
+        await self.connect("bob", "carol", "dave")
+        await self.settle()
+
+        await self.connect("alice")
+        received = await self.settle()
+        self.assertEqual(received["bob"], [{"user_id": "alice", "status": "online"}])
+        self.assertEqual(received["carol"], [{"user_id": "alice", "status": "online"}])
+        self.assertEqual(received["dave"], [])
+
+    async def test_changes_are_batched_and_flapping_is_silent(self):
+        await self.connect("alice")
+        await self.settle()
+
+        # Both contacts arrive in one window: alice gets a single frame
+        await self.connect("bob", "carol")
+        await asyncio.sleep(0.05)
+        await self.wrappers["alice"].drain()
+        frames = [f for f in self.sockets["alice"].sent if f["type"] == "presence"]
+        self.assertEqual(len(frames), 1)
+        self.assertEqual({u["user_id"] for u in frames[0]["data"]["updates"]}, {"bob", "carol"})
+        await self.settle()
+
+        # bob drops and reconnects within the window: nothing is sent
+        await self.manager.remove_client(self.wrappers.pop("bob"))
+        await self.connect("bob")
+        received = await self.settle()
+        self.assertEqual(received["alice"], [])
+
+    async def test_audience_is_cached_until_contacts_change(self):
+        presence = self.manager.presence
+        self.assertEqual(await presence.audience("alice"), {"alice", "bob", "carol"})
+
+        with patch.object(presence.message_store, "private_peers", wraps=presence.message_store.private_peers) as peers:
+            self.assertEqual(await presence.audience("alice"), {"alice", "bob", "carol"})
+            peers.assert_not_called()
+
+            # A group change (the groups store's version) and a new private chat both rebuild it
+            groups = await presence.groups_io.read_json()
+            groups["group_1"]["members"]["dave"] = "member"
+            await presence.groups_io.write_json(groups, changed=["group_1"])
+            self.assertIn("dave", await presence.audience("alice"))
+            await presence.message_store.append("alice_erin", {"id": "m2", "timestamp": 2})
+            self.assertIn("erin", await presence.audience("alice"))
+            self.assertEqual(peers.call_count, 2)
+
+    async def test_subscribers_follow_strangers(self):
+        await self.connect("dave")
+        self.assertEqual(self.manager.presence.subscribe("dave", ["alice"]), {"alice": "offline"})
+
+        await self.connect("alice")
+        received = await self.settle()
+        self.assertEqual(received["dave"], [{"user_id": "alice", "status": "online"}])
+
+        # Subscriptions end when the subscriber goes offline
+        await self.manager.remove_client(self.wrappers.pop("dave"))
+        self.assertNotIn("alice", self.manager.presence.subscribers)
+
+    async def test_subscribe_handler_ignores_unknown_users(self):
+        await self.connect("dave")
+        with patch("chat_server.handlers.presence_handler.USERS_DB", TEST_USERS_DB):
+            handler = PresenceHandler(self.manager, self.stores)
+        wrapper = self.wrappers["dave"]
+
+        await handler.handle_subscribe(wrapper, {"user_ids": ["alice", "nobody"]})
+        await wrapper.drain()
+        replies = [f["data"] for f in self.sockets["dave"].sent if f["type"] == "subscribe_presence"]
+        self.assertEqual(replies, [{"statuses": {"alice": "offline"}}])
+        self.assertNotIn("nobody", self.manager.presence.subscribers)
+
+if __name__ == "__main__":
+    unittest.main()
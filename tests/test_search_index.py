@@ -0,0 +1,157 @@
+import unittest
+import os
+import json
+import shutil
+import asyncio
+import threading
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.search_index import TextSearchIndex, USER_SEARCH
+from chat_server.utils.store import StoreRegistry
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+
+def user(uid, username, tag):
+    return {"id": uid, "username": username, "tag": tag, "handle": f"{username}#{tag}"}
+
+def index_of(users):
+    index = TextSearchIndex(USER_SEARCH)
+    index.rebuild(users, generation=1)
+    return index
+
+class TestTextSearchIndex(unittest.TestCase):
+
+    def test_prefix_ranking(self):
+        """Exact name first, then shorter completions, then alphabetical."""
+        index = index_of({
+            "u1": user("u1", "Alexander", "0001"),
+            "u2": user("u2", "alex", "0002"),
+            "u3": user("u3", "alexa", "0003"),
+            "u4": user("u4", "bob", "0004"),
+        })
+        keys, has_more = index.search("ALEX", limit=10, fuzzy=False)
+        self.assertEqual(keys, ["u2", "u3", "u1"])
+        self.assertFalse(has_more)
+
+        # Handles match by prefix too
+        keys, _ = index.search("alexa#00", limit=10, fuzzy=False)
+        self.assertEqual(keys, ["u3"])
+
+    def test_pagination(self):
+        users = {f"u{i}": user(f"u{i}", f"sam{i}", "0001") for i in range(5)}
+        index = index_of(users)
+        first, has_more = index.search("sam", limit=2)
+        self.assertEqual(first, ["u0", "u1"])
+        self.assertTrue(has_more)
+        last, has_more = index.search("sam", limit=2, offset=4)
+        self.assertEqual(last, ["u4"])
+        self.assertFalse(has_more)
+
+    def test_fuzzy_matches_after_prefix(self):
+        index = index_of({
+            "u1": user("u1", "jonathan", "0001"),
+            "u2": user("u2", "jonny", "0002"),
+            "u3": user("u3", "zed", "0003"),
+        })
+        keys, _ = index.search("jonathon", limit=10, fuzzy=False)
+        self.assertEqual(keys, [])
+        keys, _ = index.search("jonathon", limit=10)
+        self.assertEqual(keys[0], "u1")
+        self.assertNotIn("u3", keys)
+
+    def test_incremental_update(self):
+        users = {"u1": user("u1", "carol", "0001")}
+        index = index_of(users)
+
+        users["u1"].update(username="karen", handle="karen#0001")
+        index.update("u1", users["u1"])
+        self.assertEqual(index.search("car", limit=10)[0], [])
+        self.assertEqual(index.search("kar", limit=10)[0], ["u1"])
+
+        index.update("u1", None)
+        self.assertEqual(index.search("kar", limit=10)[0], [])
+        self.assertEqual(index.by_length, {})
+        self.assertEqual(index.grams, {})
+
+class TestStoreSearch(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB and a private registry."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": user("u1", "alice", "0001")}, f)
+        self.store = StoreRegistry().get(TEST_USERS_DB)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_search_follows_writes(self):
+        users = await self.store.read_json()
+        self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1"])
+
+        users["u2"] = user("u2", "albert", "0002")
+        await self.store.write_json(users, changed=["u2"])
+        self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1", "u2"])
+
+    async def test_index_is_built_off_the_loop_and_updated_on_reload(self):
+        users = {f"z{i}": user(f"z{i}", f"zed{i}", "0001") for i in range(10)}
+        users["u1"] = user("u1", "alice", "0001")
+        await self.store.write_json(users)
+        threads = []
+        rebuild = TextSearchIndex.rebuild
+        def record(index, data, generation):
+            threads.append(threading.current_thread().name)
+            rebuild(index, data, generation)
+
+        with patch.object(TextSearchIndex, "rebuild", record):
+            self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1"])
+            index = self.store._indexes[USER_SEARCH.name]
+
+            # Changed on disk by someone else
+            users = dict(users, u2=user("u2", "albert", "0002"))
+            with open(TEST_USERS_DB, 'w') as f:
+                json.dump(users, f)
+            os.utime(TEST_USERS_DB, ns=(1, 1))
+            await self.store.read_json()
+
+            # The previous generation answers until the update is swapped in
+            self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1"])
+            await self.store._refreshing[USER_SEARCH.name]
+            self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1", "u2"])
+
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("storage-io"))
+        # Updated in place, not rebuilt
+        self.assertIs(self.store._indexes[USER_SEARCH.name], index)
+
+    async def test_failed_background_refresh_is_logged(self):
+        await self.store.read_json()
+        self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1"])
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": user("u1", "alice", "0001"), "u2": user("u2", "albert", "0002")}, f)
+        os.utime(TEST_USERS_DB, ns=(1, 1))
+        await self.store.read_json()
+
+        with patch.object(TextSearchIndex, "changes", side_effect=OSError("disk gone")), \
+             self.assertLogs(level="ERROR") as logs:
+            self.assertEqual((await self.store.search(USER_SEARCH, "al", limit=10))[0], ["u1"])
+            refresh = self.store._refreshing[USER_SEARCH.name]
+            # Queries while it runs share the one refresh
+            await self.store.search(USER_SEARCH, "al", limit=10)
+            self.assertIs(self.store._refreshing[USER_SEARCH.name], refresh)
+            await asyncio.wait([refresh])
+            await asyncio.sleep(0)
+
+        self.assertIn("disk gone", logs.output[0])
+        self.assertNotIn(USER_SEARCH.name, self.store._refreshing)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.snapshot_service import SnapshotService
+from chat_server.utils.file_io import LogFileIO
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_BACKUP_DIR = os.path.join(TEST_DB_DIR, "backups")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+TEST_GROUPS_DB = os.path.join(TEST_DB_DIR, "groups.json")
+
+class TestSnapshotService(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB with two files."""
+        os.makedirs(os.path.join(TEST_DB_DIR, "messages"), exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": {"id": "u1"}}, f)
+        with open(TEST_GROUPS_DB, 'w') as f:
+            json.dump({}, f)
+        with open(os.path.join(TEST_DB_DIR, "messages", "chat_1.json.log"), 'w') as f:
+            f.write('{"op": "append", "key": "chat_1", "value": {"id": "m1"}}\n')
+
+        self.service = SnapshotService(TEST_DB_DIR, TEST_BACKUP_DIR, interval=60, retention=2)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_snapshot_mirrors_database(self):
+        """Every database file (including shards) is copied, backups are not."""
+        snap = self.service.take_snapshot()
+        self.service.take_snapshot()
+
+        with open(os.path.join(snap, "users.json")) as f:
+            self.assertEqual(json.load(f), {"u1": {"id": "u1"}})
+        self.assertTrue(os.path.exists(os.path.join(snap, "messages", "chat_1.json.log")))
+        self.assertFalse(os.path.exists(os.path.join(snap, "backups")))
+
+    def test_sqlite_database_is_backed_up_consistently(self):
+        """Commits still in the -wal file are in the snapshot, as one standalone database."""
+        db = sqlite3.connect(os.path.join(TEST_DB_DIR, "chat.sqlite3"))
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA wal_autocheckpoint=0")
+        db.execute("CREATE TABLE t (v TEXT)")
+        db.execute("INSERT INTO t VALUES ('committed')")
+        db.commit()
+        try:
+            snap = self.service.take_snapshot()
+        finally:
+            db.close()
+
+        self.assertFalse(os.path.exists(os.path.join(snap, "chat.sqlite3-wal")))
+        copy = sqlite3.connect(os.path.join(snap, "chat.sqlite3"))
+        try:
+            self.assertEqual(copy.execute("SELECT v FROM t").fetchall(), [("committed",)])
+        finally:
+            copy.close()
+
+    def test_unchanged_files_are_hard_linked(self):
+        """Only files that changed since the last snapshot take new space."""
+        first = self.service.take_snapshot()
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": {"id": "u1"}, "u2": {"id": "u2"}}, f)
+        second = self.service.take_snapshot()
+
+        def same_inode(name):
+            return os.stat(os.path.join(first, name)).st_ino == os.stat(os.path.join(second, name)).st_ino
+
+        self.assertTrue(same_inode("groups.json"))
+        self.assertFalse(same_inode("users.json"))
+        with open(os.path.join(first, "users.json")) as f:
+            self.assertEqual(len(json.load(f)), 1)
+
+    def test_rewrite_with_same_content_is_linked(self):
+        """A new mtime alone doesn't force a copy when the bytes are identical."""
+        first = self.service.take_snapshot()
+        os.utime(TEST_GROUPS_DB, ns=(0, 0))
+        second = self.service.take_snapshot()
+
+        self.assertEqual(
+            os.stat(os.path.join(first, "groups.json")).st_ino,
+            os.stat(os.path.join(second, "groups.json")).st_ino
+        )
+
+    def test_retention(self):
+        """Only the newest 'retention' snapshots are kept."""
+        snaps = [self.service.take_snapshot() for _ in range(4)]
+
+        self.assertEqual(self.service.list_snapshots(), snaps[-2:])
+        with open(os.path.join(snaps[-1], "users.json")) as f:
+            self.assertIn("u1", json.load(f))
+
+    def test_compaction_between_snapshot_and_log_copies(self):
+        """A shard and its log are copied as a pair, never one compaction apart."""
+        shard = LogFileIO(os.path.join(TEST_DB_DIR, "messages", "chat_2.json"), compact_every=100)
+        shard.append("chat_2", {"id": "m1"})
+        shard.compact()
+        shard.append("chat_2", {"id": "m2"})
+
+        copy = SnapshotService._copy
+        compactions = []
+        def copy_then_compact(src, dst):
+            digest = copy(src, dst)
+            if src == shard.filepath:
+                # Another thread compacts right after the snapshot was copied
+                compactions.append(threading.Thread(target=shard.compact))
+                compactions[-1].start()
+                compactions[-1].join(timeout=0.2)
+            return digest
+
+        with patch.object(SnapshotService, "_copy", staticmethod(copy_then_compact)):
+            snap = self.service.take_snapshot()
+        compactions[0].join()
+
+        backup = LogFileIO(os.path.join(snap, "messages", "chat_2.json"))
+        self.assertEqual([m["id"] for m in backup.read_json()["chat_2"]], ["m1", "m2"])
+
+if __name__ == "__main__":
+    unittest.main()
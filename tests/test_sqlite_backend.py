@@ -0,0 +1,282 @@
+import unittest
+import os
+import json
+import shutil
+from unittest.mock import patch
+
+# Adjust import paths to find the module
+import sys
+sys.path.append(os.getcwd())
+
+from chat_server.utils.sqlite_backend import SQLiteDatabase, SQLiteTableIO, SQLiteMessageStore
+from chat_server.utils.migrate_to_sqlite import migrate, iter_json_object
+from chat_server.utils.store import StoreRegistry
+
+# Define a temporary path for testing
+TEST_DB_DIR = os.path.join(os.getcwd(), "chat_server", "tests", "temp_db")
+TEST_SQLITE_DB = os.path.join(TEST_DB_DIR, "chat.sqlite3")
+TEST_USERS_DB = os.path.join(TEST_DB_DIR, "users.json")
+TEST_GROUPS_DB = os.path.join(TEST_DB_DIR, "groups.json")
+TEST_MESSAGES_DB = os.path.join(TEST_DB_DIR, "messages.json")
+TEST_MESSAGES_DIR = os.path.join(TEST_DB_DIR, "messages")
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        self.db = SQLiteDatabase(TEST_SQLITE_DB)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        self.db.close()
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def test_wal_mode_and_indexes(self):
+        self.assertEqual(self.db.query("PRAGMA journal_mode")[0][0], "wal")
+
+        indexes = {name for name, in self.db.query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for name in ("idx_users_handle", "idx_users_username", "idx_groups_join_code",
+                     "idx_messages_chat_ts", "idx_messages_id", "idx_messages_chat_seq"):
+            self.assertIn(name, indexes)
+
+    def test_table_write_only_touches_changed_rows(self):
+        """write_json() keeps the whole-dict contract but writes a diff."""
+        users_io = SQLiteTableIO(self.db, "users")
+        users = {f"u{i}": {"id": f"u{i}", "username": f"user{i}", "handle": f"user{i}#0001"} for i in range(3)}
+        self.assertTrue(users_io.write_json(users))
+
+        users["u1"]["username"] = "renamed"
+        del users["u2"]
+        changes = self.db.conn.total_changes
+        self.assertTrue(users_io.write_json(users))
+        # The two rows, and their entries in the change log
+        self.assertEqual(self.db.conn.total_changes - changes, 4)
+
+        self.assertEqual(SQLiteTableIO(self.db, "users").read_json(), users)
+        rows = self.db.query("SELECT id FROM users WHERE username = ?", ("renamed",))
+        self.assertEqual(rows, [("u1",)])
+
+    def test_message_store_round_trip(self):
+        store = SQLiteMessageStore(self.db)
+        for i in range(5):
+            store.append("chat_1", {"id": f"m{i}", "timestamp": 1000 + i, "content": str(i)})
+        store.update("chat_1", "m2", {"is_deleted": True})
+
+        reopened = SQLiteMessageStore(self.db)
+        history = reopened.get_history("chat_1")
+        self.assertEqual([m["id"] for m in history], ["m0", "m1", "m2", "m3", "m4"])
+        self.assertTrue(history[2]["is_deleted"])
+
+        page, has_more = reopened.get_page("chat_1", before="m3", limit=2)
+        self.assertEqual([m["id"] for m in page], ["m1", "m2"])
+        self.assertTrue(has_more)
+
+    def test_long_chat_loads_only_its_newest_rows(self):
+        store = SQLiteMessageStore(self.db)
+        for i in range(10):
+            store.append("chat_1", {"id": f"m{i}", "timestamp": 1000 + i, "content": f"word{i}"})
+
+        with patch("chat_server.utils.sqlite_backend.RETENTION_HOT_MESSAGES", 3):
+            reopened = SQLiteMessageStore(self.db)
+            self.assertEqual([m["id"] for m in reopened.get_history("chat_1")], ["m7", "m8", "m9"])
+
+            # Older pages come from the table, by id or time cursor
+            page, has_more = reopened.get_page("chat_1", before="m7", limit=3)
+            self.assertEqual([m["id"] for m in page], ["m4", "m5", "m6"])
+            self.assertTrue(has_more)
+            page, has_more = reopened.get_page("chat_1", before="m4", limit=10)
+            self.assertEqual([m["id"] for m in page], ["m0", "m1", "m2", "m3"])
+            self.assertFalse(has_more)
+            page, _ = reopened.get_page("chat_1", after=1001, limit=2)
+            self.assertEqual([m["id"] for m in page], ["m2", "m3"])
+
+            # Old messages are still found and updated by id
+            self.assertEqual(reopened.get_message("m1")[1]["content"], "word1")
+            self.assertTrue(reopened.update("chat_1", "m1", {"is_deleted": True}))
+            self.assertTrue(reopened.get_message("m1")[1]["is_deleted"])
+        self.assertTrue(SQLiteMessageStore(self.db).find("chat_1", "m1")["is_deleted"])
+
+class TestRegistrySQLite(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp DB and a SQLite-backed registry."""
+        os.makedirs(TEST_DB_DIR, exist_ok=True)
+        self.registry = StoreRegistry(backend="sqlite", sqlite_path=TEST_SQLITE_DB)
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if self.registry._db is not None:
+            self.registry._db.close()
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    async def test_handlers_see_the_same_interface(self):
+        """Mapped databases go to SQLite; awaitable read/write work unchanged."""
+        from chat_server.config import USERS_DB
+        users_io = self.registry.get(USERS_DB)
+        users = await users_io.read_json()
+        users["u1"] = {"id": "u1", "username": "alice", "handle": "alice#0001"}
+        self.assertTrue(await users_io.write_json(users))
+
+        rows = self.registry._db.query("SELECT id FROM users WHERE handle = ?", ("alice#0001",))
+        self.assertEqual(rows, [("u1",)])
+        self.assertIs(await users_io.read_json(), users)
+
+        messages = self.registry.get_messages(TEST_MESSAGES_DIR)
+        await messages.append("chat_1", {"id": "m1", "timestamp": 1})
+        self.assertEqual((await messages.find("chat_1", "m1"))["id"], "m1")
+        self.assertFalse(os.path.exists(TEST_MESSAGES_DIR))
+
+    async def test_workers_refresh_only_the_changed_records(self):
+        """A second registry stands for another worker process with its own connection."""
+        from chat_server.config import USERS_DB
+        from chat_server.utils.indexes import USER_BY_HANDLE
+        other = StoreRegistry(backend="sqlite", sqlite_path=TEST_SQLITE_DB)
+        try:
+            users_io = self.registry.get(USERS_DB)
+            users = await users_io.read_json()
+            users.update({f"u{i}": {"id": f"u{i}", "username": f"user{i}", "handle": f"user{i}#0001"} for i in range(3)})
+            await users_io.write_json(users)
+
+            other_io = other.get(USERS_DB)
+            self.assertEqual(set(await other_io.read_json()), {"u0", "u1", "u2"})
+            self.assertEqual(other_io.lookup_one(USER_BY_HANDLE, "user1#0001"), "u1")
+            generation = other_io.store.generation
+
+            # Messages (and anything else in the file) don't invalidate the users
+            await self.registry.get_messages(TEST_MESSAGES_DIR).append("chat_1", {"id": "m1", "timestamp": 1})
+            version = other_io.store.version
+            await other_io.read_json()
+            self.assertEqual(other_io.store.version, version)
+
+            users["u1"] = dict(users["u1"], handle="renamed#0001")
+            del users["u2"]
+            await users_io.write_json(users)
+            with patch.object(other_io.store.file_io, "read_json") as full_reload:
+                refreshed = await other_io.read_json()
+            full_reload.assert_not_called()
+            self.assertEqual(other_io.store.generation, generation)
+            self.assertEqual(refreshed["u1"]["handle"], "renamed#0001")
+            self.assertNotIn("u2", refreshed)
+            self.assertIsNone(other_io.lookup_one(USER_BY_HANDLE, "user1#0001"))
+            self.assertEqual(other_io.lookup_one(USER_BY_HANDLE, "renamed#0001"), "u1")
+
+            # Too far behind the change log: the table is read again
+            with patch("chat_server.utils.sqlite_backend.SQLITE_CHANGE_LOG_KEEP", 1):
+                users["u0"]["username"] = "x"
+                users["u1"]["username"] = "y"
+                await users_io.write_json(users)
+            self.assertEqual((await other_io.read_json())["u1"]["username"], "y")
+            self.assertEqual(other_io.store.generation, generation + 1)
+        finally:
+            other._db.close()
+
+    async def test_remote_appends_follow_commit_order(self):
+        """Appends delivered out of commit order (same timestamp) leave the chat in commit order."""
+        other = StoreRegistry(backend="sqlite", sqlite_path=TEST_SQLITE_DB)
+        try:
+            messages = self.registry.get_messages(TEST_MESSAGES_DIR)
+            other_messages = other.get_messages(TEST_MESSAGES_DIR)
+            await messages.append("chat_1", {"id": "m1", "timestamp": 1000})
+            self.assertEqual(len(await other_messages.get_history("chat_1")), 1)
+
+            second, third = {"id": "m2", "timestamp": 2000}, {"id": "m3", "timestamp": 2000}
+            await messages.append("chat_1", second)
+            await messages.append("chat_1", third)
+            await other_messages.apply_remote("append", "chat_1", third)
+            await other_messages.apply_remote("append", "chat_1", second)
+
+            history = await other_messages.get_history("chat_1")
+            self.assertEqual([m["id"] for m in history], ["m1", "m2", "m3"])
+        finally:
+            other._db.close()
+
+    async def test_concurrent_changes_to_one_group_are_kept(self):
+        """Two workers add members to the same group from dicts read before the other's write."""
+        from chat_server.config import GROUPS_DB
+        other = StoreRegistry(backend="sqlite", sqlite_path=TEST_SQLITE_DB)
+        try:
+            groups_io = self.registry.get(GROUPS_DB)
+            groups = await groups_io.read_json()
+            groups["g1"] = {"id": "g1", "name": "Group", "members": {"owner": {"role": "owner"}}}
+            await groups_io.write_json(groups, changed=["g1"])
+
+            other_io = other.get(GROUPS_DB)
+            theirs = await other_io.read_json()
+            ours = await groups_io.read_json()
+
+            theirs["g1"]["members"]["alice"] = {"role": "member"}
+            await other_io.write_json(theirs, changed=["g1"])
+            # Written from a dict read before alice joined
+            ours["g1"]["members"]["bob"] = {"role": "member"}
+            await groups_io.write_json(ours, changed=["g1"])
+            self.assertEqual(set((await groups_io.read_json())["g1"]["members"]), {"owner", "alice", "bob"})
+
+            # The other worker refreshes (replacing its cached group), then
+            # writes from the dict it held before the refresh
+            stale = theirs
+            self.assertEqual(set((await other_io.read_json())["g1"]["members"]), {"owner", "alice", "bob"})
+            del stale["g1"]["members"]["owner"]
+            stale["g1"]["name"] = "Renamed"
+            await other_io.write_json(stale, changed=["g1"])
+
+            group = (await groups_io.read_json())["g1"]
+            self.assertEqual(group["name"], "Renamed")
+            self.assertEqual(set(group["members"]), {"alice", "bob"})
+        finally:
+            other._db.close()
+
+class TestMigrateToSQLite(unittest.TestCase):
+
+    def setUp(self):
+        """Runs before each test: Setup temp JSON databases."""
+        os.makedirs(TEST_MESSAGES_DIR, exist_ok=True)
+        with open(TEST_USERS_DB, 'w') as f:
+            json.dump({"u1": {"id": "u1", "username": "alice", "handle": "alice#0001"}}, f, indent=4)
+        with open(TEST_GROUPS_DB, 'w') as f:
+            json.dump({"g1": {"id": "g1", "join_code": "ABC123", "members": {}}}, f, indent=4)
+        with open(TEST_MESSAGES_DB, 'w') as f:
+            json.dump({"g1": [{"id": "m1", "timestamp": 1.5}, {"id": "m2", "timestamp": 2.5}]}, f, indent=4)
+        with open(os.path.join(TEST_MESSAGES_DIR, "u1_u2.json.log"), 'w') as f:
+            f.write('{"op": "append", "key": "u1_u2", "value": {"id": "d1", "timestamp": 3000}}\n')
+        with open(os.path.join(TEST_MESSAGES_DIR, "u1_u2.json"), 'w') as f:
+            json.dump({}, f)
+
+        self.tables = {TEST_USERS_DB: "users", TEST_GROUPS_DB: "groups"}
+
+    def tearDown(self):
+        """Runs after each test: Cleanup temp files."""
+        if os.path.exists(TEST_DB_DIR):
+            shutil.rmtree(TEST_DB_DIR)
+
+    def run_migration(self, force=False):
+        return migrate(TEST_SQLITE_DB, self.tables, TEST_MESSAGES_DIR, TEST_MESSAGES_DB, force=force, log=lambda *_: None)
+
+    def test_streaming_reader_matches_json_load(self):
+        """Tiny chunks force values to straddle reads."""
+        for path in (TEST_USERS_DB, TEST_GROUPS_DB, TEST_MESSAGES_DB):
+            with open(path) as f:
+                expected = json.load(f)
+            self.assertEqual(dict(iter_json_object(path, chunk_size=3)), expected)
+
+    def test_migration_imports_everything_once(self):
+        counts = self.run_migration()
+        self.assertEqual(counts, {"users": 1, "groups": 1, "messages": 3})
+
+        db = SQLiteDatabase(TEST_SQLITE_DB)
+        try:
+            self.assertEqual(db.query("SELECT id FROM groups WHERE join_code = 'ABC123'"), [("g1",)])
+            store = SQLiteMessageStore(db)
+            self.assertEqual([m["id"] for m in store.get_history("g1")], ["m1", "m2"])
+            self.assertEqual(store.get_history("u1_u2")[0]["id"], "d1")
+        finally:
+            db.close()
+
+        with self.assertRaises(RuntimeError):
+            self.run_migration()
+        self.assertEqual(self.run_migration(force=True)["messages"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
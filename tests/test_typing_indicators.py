@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import asyncio
+
+# Adjust import paths to find the module
+sys.path.append(os.getcwd())
+
+from chat_server.core.typing_indicators import TypingTracker
+
+
+class RecordingClientManager:
+    """Records every fan-out as (msg_type, recipients, data)."""
+    def __init__(self):
+        self.sent = []
+
+    async def send_to_users(self, user_ids, msg_type, data, exclude_user=None):
+        self.sent.append((msg_type, [u for u in user_ids if u != exclude_user], data))
+
+
+class TestTypingTracker(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.manager = RecordingClientManager()
+        self.tracker = TypingTracker(self.manager, interval=10, timeout=0.05, summary_members=3, summary_interval=0.01)
+
+    async def test_keystrokes_are_throttled(self):
+        """A burst of typing events reaches the members once."""
+        for _ in range(20):
+            await self.tracker.update("chat_1", "alice", True, {"alice": 1, "bob": 1})
+        self.assertEqual(self.manager.sent, [("typing", ["bob"], {"from": "alice", "chat_id": "chat_1", "is_typing": True})])
+
+        # Stopping is always passed on, once
+        await self.tracker.update("chat_1", "alice", False, {"alice": 1, "bob": 1})
+        await self.tracker.update("chat_1", "alice", False, {"alice": 1, "bob": 1})
+        self.assertEqual(len(self.manager.sent), 2)
+        self.assertFalse(self.manager.sent[-1][2]["is_typing"])
+
+    async def test_toggling_does_not_bypass_the_throttle(self):
+        """Alternating start and stop within the window: one start and one stop reach the members."""
+        for _ in range(10):
+            await self.tracker.update("chat_1", "alice", True, {"alice": 1, "bob": 1})
+            await self.tracker.update("chat_1", "alice", False, {"alice": 1, "bob": 1})
+        self.assertEqual([data["is_typing"] for _, _, data in self.manager.sent], [True, False])
+        self.assertIn(("chat_1", "alice"), self.tracker.recent)
+
+        # Once the window has passed, starting is passed on again
+        tracker = TypingTracker(self.manager, interval=0.02, timeout=1)
+        self.manager.sent.clear()
+        await tracker.update("chat_1", "alice", True, ("bob",))
+        await tracker.update("chat_1", "alice", False, ("bob",))
+        await tracker.update("chat_1", "alice", True, ("bob",))
+        await asyncio.sleep(0.05)
+        self.assertEqual(tracker.recent, {})
+        await tracker.update("chat_1", "alice", True, ("bob",))
+        self.assertEqual([data["is_typing"] for _, _, data in self.manager.sent], [True, False, True])
+        await tracker.stop("chat_1", "alice")
+
+    async def test_indicator_expires(self):
+        """Without further events the server sends 'is_typing: false' itself."""
+        await self.tracker.update("bob", "alice", True, ("bob",))
+        await asyncio.sleep(0.1)
+        self.assertEqual([data["is_typing"] for _, _, data in self.manager.sent], [True, False])
+        self.assertEqual(self.tracker.typing, {})
+
+    async def test_large_groups_get_summaries(self):
+        members = {f"user_{i}": 1 for i in range(10)}
+        for user_id in ("user_1", "user_2", "user_3", "user_4"):
+            for _ in range(5):
+                await self.tracker.update("big", user_id, True, members)
+        await asyncio.sleep(0.005)
+
+        self.assertEqual(len(self.manager.sent), 1)
+        msg_type, recipients, data = self.manager.sent[0]
+        self.assertEqual(msg_type, "typing_summary")
+        self.assertEqual(len(recipients), 10)
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(data["user_ids"], ["user_1", "user_2", "user_3"])
+
+        # Once everyone has stopped (or expired) a final count of 0 is sent and the chat is dropped
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.manager.sent[-1][2]["count"], 0)
+        self.assertEqual(self.tracker.summaries, {})
+        self.assertEqual(self.tracker.typists, {})
+
+if __name__ == "__main__":
+    unittest.main()
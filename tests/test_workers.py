@@ -0,0 +1,262 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import multiprocessing
+
+# Adjust import paths to find the module
+sys.path.append(os.getcwd())
+
+from unittest.mock import patch
+from chat_server.core.bus import Broker, BusClient
+from chat_server.core.client_manager import ClientManager
+from chat_server.core.transport import BusTransport
+from chat_server.core.connection import ConnectionWrapper
+from chat_server.utils.store import StoreRegistry
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(json.loads(frame))
+
+
+def run_worker_process(path, worker_id, user_id, peer_id, results):
+    """
+    A spawned worker process: connects 'user_id', sends 'peer_id' a message
+    once they are online on another worker, and reports what it received.
+    """
+    async def main():
+        manager = ClientManager()
+        bus = BusClient(path, worker_id, lambda event: transport.handle(event))
+        transport = BusTransport(bus, manager.deliver_local, manager.remote_changed)
+        await bus.connect()
+        await manager.set_transport(transport)
+        socket = FakeSocket()
+        await manager.register_client(user_id, ConnectionWrapper(socket))
+
+        while not manager.is_online(peer_id):
+            await asyncio.sleep(0.01)
+        await manager.send_to_user(peer_id, "message", {"from": user_id})
+        while not socket.sent:
+            await asyncio.sleep(0.01)
+        await transport.close()
+        return [f["data"] for f in socket.sent if f["type"] == "message"]
+
+    try:
+        results.put((worker_id, asyncio.run(asyncio.wait_for(main(), 20))))
+    except Exception as e:
+        results.put((worker_id, repr(e)))
+
+
+def write_user_process(sqlite_path, user_id, handle):
+    """A spawned worker process writing one user to the shared SQLite database."""
+    from chat_server.config import USERS_DB
+
+    async def main():
+        stores = StoreRegistry(backend="sqlite", sqlite_path=sqlite_path)
+        users_io = stores.get(USERS_DB)
+        users = await users_io.read_json()
+        users[user_id] = {"id": user_id, "username": user_id, "handle": handle}
+        await users_io.write_json(users, changed=[user_id])
+        stores._db.close()
+
+    asyncio.run(main())
+
+
+class TestWorkerBus(unittest.IsolatedAsyncioTestCase):
+    """Two ClientManagers standing for two worker processes, joined by a real Broker."""
+
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "bus.sock")
+        self.broker = Broker(self.path)
+        await self.broker.start()
+
+        self.workers = []
+        self.changes = []
+        for worker_id in range(2):
+            await self.start_worker(worker_id)
+        await self.settle()
+
+    async def asyncTearDown(self):
+        for manager in self.workers:
+            await manager.transport.close()
+        await self.broker.close()
+        shutil.rmtree(self.temp_dir)
+
+    async def start_worker(self, worker_id):
+        manager = ClientManager()
+        manager.presence.changed = lambda user_id, status: self.changes.append((worker_id, user_id, status))
+        bus = BusClient(self.path, worker_id, lambda event: transport.handle(event), reconnect_delay=0.05)
+        transport = BusTransport(bus, manager.deliver_local, manager.remote_changed, resync_grace=0.1)
+        await bus.connect()
+        await manager.set_transport(transport)
+        self.workers.append(manager)
+        return manager
+
+    async def settle(self):
+        await asyncio.sleep(0.05)
+
+    async def connect(self, worker_id, user_id):
+        socket = FakeSocket()
+        wrapper = ConnectionWrapper(socket)
+        await self.workers[worker_id].register_client(user_id, wrapper)
+        await self.settle()
+        return socket, wrapper
+
+    async def test_delivery_to_a_user_on_another_worker(self):
+        alice, alice_conn = await self.connect(0, "alice")
+        bob, bob_conn = await self.connect(1, "bob")
+        self.assertTrue(self.workers[0].is_online("bob"))
+        self.assertFalse(self.workers[0].is_local("bob"))
+
+        await self.workers[0].send_to_users(["alice", "bob"], "message", {"text": "hi"})
+        await self.settle()
+        await alice_conn.drain()
+        await bob_conn.drain()
+        self.assertEqual([f["data"] for f in alice.sent], [{"text": "hi"}])
+        self.assertEqual([f["data"] for f in bob.sent], [{"text": "hi"}])
+
+    async def test_presence_changes_only_on_global_transitions(self):
+        await self.connect(0, "alice")
+        # Both workers record the transition (each tells its own clients)
+        self.assertEqual(sorted(self.changes), [(0, "alice", "online"), (1, "alice", "online")])
+        self.changes.clear()
+
+        # A second device on the other worker: still the same online user
+        _, second = await self.connect(1, "alice")
+        self.assertEqual(self.changes, [])
+
+        await self.workers[1].remove_client(second)
+        await self.settle()
+        self.assertEqual(self.changes, [])
+        self.assertTrue(self.workers[1].is_online("alice"))
+
+    async def test_worker_down_takes_its_users_offline(self):
+        await self.connect(1, "bob")
+        self.changes.clear()
+
+        await self.workers[1].transport.close()
+        await self.settle()
+        self.assertFalse(self.workers[0].is_online("bob"))
+        self.assertEqual(self.changes, [(0, "bob", "offline")])
+
+    async def test_restarted_worker_learns_who_is_online(self):
+        await self.connect(0, "alice")
+        late = await self.start_worker(2)
+        await self.settle()
+
+        self.assertTrue(late.is_online("alice"))
+        # Known as already announced: no presence change to send
+        self.assertIn("alice", late.presence.announced)
+
+    async def test_publishes_are_batched_into_one_write(self):
+        sockets = {}
+        for i in range(20):
+            sockets[f"user_{i}"] = (await self.connect(1, f"user_{i}"))[0]
+
+        bus = self.workers[0].transport.bus
+        with patch.object(bus.writer, "write", wraps=bus.writer.write) as write:
+            for user_id in sockets:
+                await self.workers[0].send_to_user(user_id, "message", {"to": user_id})
+            await self.settle()
+        self.assertEqual(write.call_count, 1)
+        for user_id, socket in sockets.items():
+            await next(iter(self.workers[1].get_user_sockets(user_id))).drain()
+            self.assertEqual([f["data"] for f in socket.sent], [{"to": user_id}])
+
+    async def test_worker_reconnects_after_losing_the_bus(self):
+        await self.connect(0, "alice")
+        bob, bob_conn = await self.connect(1, "bob")
+        self.changes.clear()
+
+        # The broker drops worker 1: the others see its users leave...
+        self.broker.workers[1].close()
+        await self.settle()
+        self.assertFalse(self.workers[0].is_online("bob"))
+
+        # ...until it is back and has announced them again
+        await asyncio.sleep(0.3)
+        self.assertTrue(self.workers[0].is_online("bob"))
+        self.assertTrue(self.workers[1].is_online("alice"))
+        self.assertEqual([c for c in self.changes if c[0] == 0], [(0, "bob", "offline"), (0, "bob", "online")])
+
+        await self.workers[0].send_to_user("bob", "message", {"text": "still there?"})
+        await self.settle()
+        await bob_conn.drain()
+        self.assertEqual([f["data"] for f in bob.sent if f["type"] == "message"], [{"text": "still there?"}])
+
+    async def test_resync_drops_subscriptions_nobody_confirms(self):
+        await self.connect(0, "alice")
+        transport = self.workers[1].transport
+        self.assertTrue(transport.elsewhere("alice"))
+
+        # An unsubscribe missed while disconnected
+        transport.remote["ghost"] = {0}
+        await transport.handle({"op": "reconnected", "worker": 1})
+        await transport.handle({"op": "sync", "worker": 0, "topics": ["alice"]})
+        await asyncio.sleep(0.2)
+        self.assertTrue(transport.elsewhere("alice"))
+        self.assertFalse(transport.elsewhere("ghost"))
+
+
+class TestWorkerProcesses(unittest.IsolatedAsyncioTestCase):
+    """Real worker processes (spawned, like core/workers.py does) around one Broker."""
+
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "bus.sock")
+        self.broker = Broker(self.path)
+        await self.broker.start()
+        self.context = multiprocessing.get_context("spawn")
+
+    async def asyncTearDown(self):
+        await self.broker.close()
+        shutil.rmtree(self.temp_dir)
+
+    async def run_processes(self, target, *args_list):
+        processes = [self.context.Process(target=target, args=args) for args in args_list]
+        for process in processes:
+            process.start()
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            # Joined off the loop: the broker has to keep serving them
+            await loop.run_in_executor(None, process.join, 30)
+            self.assertEqual(process.exitcode, 0)
+
+    async def test_processes_exchange_messages_over_the_bus(self):
+        results = self.context.Queue()
+        await self.run_processes(
+            run_worker_process,
+            (self.path, 0, "alice", "bob", results),
+            (self.path, 1, "bob", "alice", results),
+        )
+        received = dict(results.get(timeout=5) for _ in range(2))
+        self.assertEqual(received, {0: [{"from": "bob"}], 1: [{"from": "alice"}]})
+
+    async def test_records_written_by_another_process_are_refreshed(self):
+        from chat_server.config import USERS_DB
+        from chat_server.utils.indexes import USER_BY_HANDLE
+        sqlite_path = os.path.join(self.temp_dir, "chat.sqlite3")
+        stores = StoreRegistry(backend="sqlite", sqlite_path=sqlite_path)
+        try:
+            users_io = stores.get(USERS_DB)
+            await users_io.read_json()
+            self.assertIsNone(users_io.lookup_one(USER_BY_HANDLE, "bob#0001"))
+            generation = users_io.store.generation
+
+            await self.run_processes(write_user_process, (sqlite_path, "u2", "bob#0001"))
+            self.assertIn("u2", await users_io.read_json())
+            self.assertEqual(users_io.lookup_one(USER_BY_HANDLE, "bob#0001"), "u2")
+            self.assertEqual(users_io.store.generation, generation)
+        finally:
+            stores._db.close()
+
+if __name__ == "__main__":
+    unittest.main()
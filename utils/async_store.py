@@ -0,0 +1,437 @@
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from chat_server.config import IO_WORKERS, INDEX_REFILE_BATCH
+
+# Dedicated pool for blocking disk work, so file I/O never runs on the event loop
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="storage-io")
+
+async def run_io(func, *args):
+    """Runs a blocking storage call on the I/O executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args))
+
+
+class GroupCommit:
+    """
+    Coalesces concurrent writes into a single flush (group commit).
+
+    Writers submit items and wait. While one flush is running on the I/O
+    executor, new items pile up and are written together by the next one,
+    so a burst of N writes costs a handful of disk writes instead of N.
+
+    'prepare(batch)' runs on the event loop and must turn the items into
+    something the worker thread can safely use (e.g. encoded text), since
+    the cached objects may be mutated again while the flush is in progress.
+    'flush(prepared)' runs on the executor and does the blocking I/O.
+    """
+    def __init__(self, prepare, flush):
+        self._prepare = prepare
+        self._flush = flush
+        self._batch = []
+        self._waiters = []
+        self._idle = None
+
+    async def submit(self, item):
+        """Queues 'item' and returns once it has been written (flush result)."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._batch.append(item)
+        self._waiters.append(fut)
+
+        if self._idle is None:
+            self._idle = loop.create_future()
+            loop.create_task(self._drain())
+        return await fut
+
+    async def wait_idle(self):
+        """Waits until everything submitted so far has been flushed."""
+        if self._idle is not None:
+            await asyncio.shield(self._idle)
+
+    async def _drain(self):
+        try:
+            while self._batch:
+                batch, waiters = self._batch, self._waiters
+                self._batch, self._waiters = [], []
+                try:
+                    result = await run_io(self._flush, self._prepare(batch))
+                except Exception as e:
+                    logging.error(f"Group commit failed: {e}")
+                    result = False
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_result(result)
+        finally:
+            idle, self._idle = self._idle, None
+            if not idle.done():
+                idle.set_result(True)
+
+
+class AsyncStore:
+    """
+    Awaitable facade over a SharedStore (one JSON database).
+
+    Reads and writes run on the I/O executor; concurrent writes to the
+    file are group-committed, so only the latest state is written.
+
+    Secondary indexes (see utils/indexes.py) are built on first lookup and
+    then maintained by write_json(), so lookups by field cost O(1) instead
+    of a scan over every record. Search indexes are larger: they are built
+    on the I/O executor and swapped in when ready (see search()).
+    """
+    def __init__(self, store):
+        self.store = store
+        self.filepath = store.filepath
+        self._commit = GroupCommit(self._encode_latest, self._write)
+        # IndexSpec.name -> index (SecondaryIndex unless the spec says otherwise)
+        self._indexes = {}
+        # IndexSpec.name -> task bringing that index up to date off the loop
+        self._refreshing = {}
+        # IndexSpec.name -> keys written while it is refreshed (None = unknown)
+        self._written = {}
+
+    async def read_json(self):
+        """Returns the shared in-memory data (reloaded from disk if it changed)."""
+        data = await run_io(self.store.read_json)
+        # Records other processes changed were refreshed one by one: re-file just those
+        refreshed = self.store.take_refreshed()
+        if refreshed:
+            self._update_indexes(self.store.data, refreshed)
+        return data
+
+    async def read_cached(self):
+        """
+        The in-memory data as last loaded, without checking the file for
+        changes (no executor hop, no stat). For hot paths that can live with
+        a copy that is current as of the last read_json() or write_json().
+        """
+        if self.store.data is None:
+            return await self.read_json()
+        return self.store.data
+
+    async def write_json(self, data, changed=None):
+        """
+        Persists 'data'; returns True once it is on disk. 'changed' lists the
+        keys that were added, modified or removed, so indexes only re-file
+        those records (without it every record is compared). Backends that
+        write records one by one (SQLite) then persist only those records,
+        so a 'data' read before another process's change can't undo it.
+        """
+        self._update_indexes(data, changed)
+        return await self._commit.submit((data, changed))
+
+    def lookup(self, spec, value):
+        """
+        Keys of the records whose 'spec' index contains 'value', oldest first.
+        Call after read_json(), which makes sure the cached data is current.
+        """
+        return self._index(spec).get(value)
+
+    def lookup_one(self, spec, value):
+        """First key filed under 'value', or None."""
+        keys = self.lookup(spec, value)
+        return keys[0] if keys else None
+
+    async def search(self, spec, query, **options):
+        """
+        Runs 'query' against a search index (see utils/search_index.py).
+
+        The index is built on the I/O executor the first time (this call
+        waits for it), and after a reload from disk it is brought up to
+        date there too; queries are answered by the previous generation
+        until the new one is swapped in.
+        """
+        index = self._indexes.get(spec.name)
+        if index is None or index.generation != self.store.generation:
+            refresh = self._refresh(spec)
+            if index is None:
+                # A cancelled caller must not cancel the build the others wait for
+                index = await asyncio.shield(refresh)
+        return index.search(query, **options)
+
+    def _refresh(self, spec):
+        """The task bringing 'spec's index up to date, started unless one is running."""
+        task = self._refreshing.get(spec.name)
+        if task is None:
+            task = self._refreshing[spec.name] = asyncio.ensure_future(self._catch_up(spec))
+            task.add_done_callback(functools.partial(self._refreshed, spec))
+        return task
+
+    def _refreshed(self, spec, task):
+        self._refreshing.pop(spec.name, None)
+        # Nobody may be waiting (queries kept using the previous generation): report it here
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Refreshing the {spec.name} index of {self.filepath} failed: {task.exception()}")
+
+    async def _catch_up(self, spec):
+        """Builds or updates 'spec's index off the loop until it matches the data."""
+        while True:
+            index = self._indexes.get(spec.name)
+            generation, data = self.store.generation, self.store.data or {}
+            self._written[spec.name] = set()
+            try:
+                changed = None if index is None else await run_io(index.changes, data)
+                # A reload that changed most records is cheaper to index afresh
+                if changed is None or len(changed) * 4 > len(data):
+                    index = spec.create()
+                    await run_io(index.rebuild, data, generation)
+                    changed = ()
+                # Only what the reload touched is re-filed on the loop, a
+                # batch per iteration so requests keep being served
+                for start in range(0, len(changed), INDEX_REFILE_BATCH):
+                    current = self.store.data or {}
+                    for key in changed[start:start + INDEX_REFILE_BATCH]:
+                        index.update(key, current.get(key))
+                    await asyncio.sleep(0)
+            finally:
+                written = self._written.pop(spec.name)
+
+            # Records written while the index was being brought up to date
+            current = self.store.data or {}
+            for key in written or ():
+                index.update(key, current.get(key))
+            index.generation = generation
+            self._indexes[spec.name] = index
+            if written is not None and generation == self.store.generation:
+                return index
+
+    def _index(self, spec):
+        index = self._indexes.get(spec.name)
+        if index is None:
+            index = self._indexes[spec.name] = spec.create()
+        # Built lazily, and rebuilt whenever the data was reloaded from disk
+        if index.generation != self.store.generation:
+            index.rebuild(self.store.data or {}, self.store.generation)
+        return index
+
+    def _update_indexes(self, data, changed):
+        for name, written in self._written.items():
+            # Being refreshed off the loop: re-filed once that is done
+            if changed is None or written is None:
+                self._written[name] = None
+            else:
+                written.update(changed)
+        for name, index in self._indexes.items():
+            if name in self._written or index.generation != self.store.generation:
+                # Stale (data reloaded); it is rebuilt on the next lookup
+                continue
+            if changed is None:
+                index.sync(data)
+            else:
+                for key in changed:
+                    index.update(key, data.get(key))
+
+    def _encode_latest(self, batch):
+        file_io = self.store.file_io
+        if hasattr(file_io, "write_records") and all(changed is not None for _, changed in batch):
+            # Only the records named by the writes (the last write of each wins)
+            records = {key: data.get(key) for data, changed in batch for key in changed}
+            return None, records, file_io.encode_records(records)
+        # Every write carries the full state, so the newest one wins
+        data = batch[-1][0]
+        return data, None, file_io.encode(data)
+
+    def _write(self, prepared):
+        data, records, encoded = prepared
+        if records is not None:
+            return self.store.write_records(records, encoded)
+        return self.store.write_encoded(data, encoded)
+
+
+class AsyncMessageStore:
+    """
+    Awaitable facade over the sharded MessageStore.
+
+    Cached chats are served straight from memory; cache misses load the
+    shard on the I/O executor. Appends and updates are applied to the cache
+    immediately and their log records (and message-index and search-index
+    entries) are group-committed across chats.
+
+    Chats that outgrow their hot window are archived in the background;
+    anything touching archived messages runs on the I/O executor.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._commit = GroupCommit(self._encode_records, self._write_records)
+        # chat_key -> in-flight load, so concurrent misses share one disk read
+        self._loading = {}
+        # chat_key -> in-flight archiving task
+        self._archiving = {}
+        # Multi-worker mode: called with (op, chat_key, value) once an append or
+        # update is committed, so the other workers can apply it (see core/workers.py)
+        self.replicate = None
+
+    async def get_history(self, chat_key):
+        return (await self._entry(chat_key)).messages
+
+    async def get_page(self, chat_key, before=None, after=None, limit=50):
+        entry = await self._entry(chat_key)
+        if entry.base:
+            # The page may reach into the archive (segment reads)
+            return await run_io(self.store.get_page, chat_key, before, after, limit)
+        return entry.page(before=before, after=after, limit=limit)
+
+    async def find(self, chat_key, message_id):
+        return (await self._entry(chat_key)).find(message_id)
+
+    async def get_message(self, message_id):
+        """(chat_key, message) for a message id in any chat, or (None, None)."""
+        # The message index is on disk: the lookup is a query
+        located = await run_io(self.store.locate, message_id)
+        if located is None:
+            return None, None
+        chat_key, pos = located
+        entry = await self._entry(chat_key)
+        if entry.is_archived(pos):
+            msg = await run_io(entry.at, message_id, pos)
+        else:
+            msg = entry.at(message_id, pos)
+        return (chat_key, msg) if msg is not None else (None, None)
+
+    async def append(self, chat_key, message):
+        entry = await self._entry(chat_key)
+        index_lines = self.store.add_cached(entry, message)
+        self._schedule_archive(entry)
+        ok = await self._commit.submit((entry.shard, "append", chat_key, message, index_lines))
+        if self.replicate is not None:
+            self.replicate("append", chat_key, message)
+        return ok
+
+    async def update(self, chat_key, message_id, fields):
+        entry = await self._entry(chat_key)
+        msg = entry.find(message_id)
+        if msg is None:
+            index_lines = await run_io(self.store.update_archived, entry, message_id, fields)
+            if index_lines is None:
+                return False
+            ok = await self._commit.submit((None, "update", chat_key, (message_id, fields), index_lines))
+        else:
+            index_lines = self.store.update_cached(entry, msg, fields)
+            ok = await self._commit.submit((entry.shard, "update", chat_key, (message_id, fields), index_lines))
+        if self.replicate is not None:
+            self.replicate("update", chat_key, (message_id, fields))
+        return ok
+
+    async def apply_remote(self, op, chat_key, value):
+        """Applies an append or update committed by another worker (see MessageStore.apply_remote)."""
+        loading = self._loading.get(chat_key)
+        if loading is not None:
+            # A load that read the chat before that commit must not miss it
+            await asyncio.shield(loading)
+        committed_after = None
+        if op == "append" and self.store.cached(chat_key) is not None:
+            # Where the commit falls among the cached messages (bus order isn't commit order)
+            committed_after = await run_io(self.store.committed_after, chat_key, value.get("id"))
+        self.store.apply_remote(op, chat_key, value, committed_after)
+
+    def drop_cache(self):
+        """See MessageStore.drop_cache (e.g. after missing other workers' commits)."""
+        self.store.drop_cache()
+
+    async def search_messages(self, query, chat_keys, limit, offset=0):
+        """
+        (hits, has_more) for one page of full-text results, newest first:
+        hits are (chat_key, message). The index is queried on the I/O
+        executor; only the chats holding the page's messages may need loading.
+        """
+        found, has_more = await run_io(self.store.search.search, query, chat_keys, limit, offset)
+        hits = []
+        for chat_key, message_id in found:
+            found_key, msg = await self.get_message(message_id)
+            if found_key == chat_key and not msg.get("is_deleted"):
+                hits.append((chat_key, msg))
+        return hits, has_more
+
+    async def private_peers(self, user_id):
+        """Ids of the users 'user_id' has a private chat with."""
+        return await run_io(self.store.private_peers, user_id)
+
+    @property
+    def peers_version(self):
+        """Changes whenever private_peers() may answer differently (see MessageStore)."""
+        return self.store.peers_version
+
+    async def archive(self, chat_key):
+        """
+        Moves a chat's messages beyond the hot window into the archive
+        (see MessageStore.archive_chat). Returns how many were moved.
+        """
+        entry = await self._entry(chat_key)
+        plan = self.store.plan_archive(entry)
+        if plan is None:
+            return 0
+        segments = await run_io(self.store.write_archive, entry, plan)
+        lines = self.store.commit_archive(entry, plan, segments) if segments else None
+        if lines is None:
+            return 0
+        # Catalog first: if the trim is lost in a crash, load() drops the copies
+        await run_io(self.store.write_index_lines, lines)
+        # The trim goes through the group commit, after the appends it covers
+        await self._commit.submit((entry.shard, "trim", chat_key, plan["count"], []))
+        logging.info(f"Archived {plan['count']} messages of chat {chat_key}")
+        return plan["count"]
+
+    def _schedule_archive(self, entry):
+        if entry.chat_key in self._archiving or not self.store.due_for_archive(entry):
+            return
+        self._archiving[entry.chat_key] = asyncio.ensure_future(self._archive_task(entry.chat_key))
+
+    async def _archive_task(self, chat_key):
+        try:
+            await self.archive(chat_key)
+        except Exception as e:
+            logging.error(f"Archiving chat {chat_key} failed: {e}")
+        finally:
+            self._archiving.pop(chat_key, None)
+
+    async def _entry(self, chat_key):
+        entry = self.store.cached(chat_key)
+        if entry is not None:
+            return entry
+
+        loading = self._loading.get(chat_key)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(chat_key))
+            self._loading[chat_key] = loading
+        # Waiters resume in arrival order, which keeps concurrent appends ordered
+        return await asyncio.shield(loading)
+
+    async def _load(self, chat_key):
+        try:
+            # Pending records must reach the log before the shard is re-read
+            await self._commit.wait_idle()
+            entry = await run_io(self.store.load, chat_key)
+            self._schedule_archive(entry)
+            return entry
+        finally:
+            self._loading.pop(chat_key, None)
+
+    @staticmethod
+    def _encode_records(batch):
+        # Encode on the loop: cached messages may change while the flush runs
+        lines_by_shard = {}
+        index_lines = []
+        for shard, op, chat_key, value, record_index_lines in batch:
+            index_lines.extend(record_index_lines)
+            if shard is None:
+                # Archived message: the change lives in the archive catalog only
+                continue
+            if op == "append":
+                line = shard.encode_append(chat_key, value)
+            elif op == "trim":
+                line = shard.encode_trim(chat_key, value)
+            else:
+                line = shard.encode_update(chat_key, *value)
+            lines_by_shard.setdefault(shard, []).append(line)
+        return lines_by_shard, index_lines
+
+    def _write_records(self, prepared):
+        lines_by_shard, index_lines = prepared
+        ok = True
+        for shard, lines in lines_by_shard.items():
+            ok = shard.write_lines(lines) and ok
+        # Indexes last, so they never point at a message that isn't on disk yet
+        self.store.write_index_lines(index_lines)
+        return ok
@@ -0,0 +1,112 @@
+import json
+import logging
+from chat_server.config import STORAGE_CODEC
+
+# Optional accelerators: everything works without them, just slower
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# ==========================================
+# JSON (wire + text files)
+# ==========================================
+
+# Stdlib fallback, built once: json.dumps() with any option set builds a new encoder per call
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+def dumps(obj):
+    """Compact JSON text. Uses orjson when installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # e.g. integers beyond 64 bits; the stdlib encoder handles them
+            pass
+    return _encode(obj)
+
+
+def dumps_bytes(obj):
+    """Compact JSON as UTF-8 bytes (what gets written to disk)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return _encode(obj).encode("utf-8")
+
+
+def loads(data):
+    """Parses JSON text or bytes. Raises ValueError on invalid input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# ==========================================
+# STORAGE CODECS
+# ==========================================
+
+class JSONCodec:
+    """Compact JSON files (readable, diffable)."""
+    name = "json"
+
+    @staticmethod
+    def encode(data):
+        return dumps_bytes(data)
+
+    @staticmethod
+    def decode(raw):
+        return loads(raw)
+
+
+class MsgpackCodec:
+    """MessagePack files: smaller and faster to parse, but binary."""
+    name = "msgpack"
+
+    @staticmethod
+    def encode(data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def decode(raw):
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+CODECS = {"json": JSONCodec, "msgpack": MsgpackCodec}
+
+
+def get_codec(name=STORAGE_CODEC):
+    """Returns the storage codec called 'name' (JSON if it isn't available)."""
+    if name == "msgpack" and msgpack is None:
+        logging.warning("STORAGE_CODEC is 'msgpack' but msgpack is not installed; using JSON")
+        name = "json"
+    if name not in CODECS:
+        raise ValueError(f"Unknown storage codec: {name}")
+    return CODECS[name]
+
+
+def is_json(raw):
+    """True if stored bytes are JSON. Any JSON document we write starts with '{' or '['."""
+    head = raw.lstrip()[:1]
+    return head in (b"{", b"[")
+
+
+def decode_stored(raw):
+    """
+    Decodes a database file whatever codec wrote it, so switching
+    STORAGE_CODEC never strands existing files.
+    """
+    if not raw.strip():
+        return {}
+    if is_json(raw):
+        return loads(raw)
+    if msgpack is None:
+        raise ValueError("File is not JSON and msgpack is not installed")
+    return MsgpackCodec.decode(raw)
@@ -1,14 +1,16 @@
-import bcrypt
-import jwt
 import datetime
 import logging
 from chat_server.config import SECRET_KEY, BCRYPT_ROUNDS
 
+# bcrypt and jwt are imported inside the functions: together they add
+# noticeably to server start-up and are only needed once a client logs in.
+
 def hash_password(password: str) -> str:
     """
     Hashes a password using bcrypt.
     Returns the hash as a string for storage.
     """
+    import bcrypt
     try:
         salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
@@ -22,6 +24,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Checks a plain password against its stored hash.
     Handles encoding to ensure bytes are passed to bcrypt.
     """
+    import bcrypt
     try:
         # bcrypt requires bytes, so we encode both
         return bcrypt.checkpw(
@@ -37,6 +40,7 @@ def generate_token(user_id: str) -> str:
     Generates a JWT token for session management.
     Token expires in 7 days.
     """
+    import jwt
     try:
         payload = {
             "user_id": user_id,
@@ -53,6 +57,7 @@ def verify_token(token: str) -> str:
     Decodes a JWT token.
     Returns user_id if valid, otherwise None.
     """
+    import jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         return payload.get("user_id")
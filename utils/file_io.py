@@ -1,22 +1,172 @@
-import json
 import os
-import shutil
+import time
+import weakref
 import threading
-from datetime import datetime
-from chat_server.config import BACKUP_DIR
+from chat_server.utils import codec
+from chat_server.config import (
+    LOG_COMPACT_THRESHOLD,
+    DURABILITY, DEFAULT_DURABILITY, FSYNC_BATCH_WRITES, FSYNC_BATCH_INTERVAL_MS
+)
+
+# Durability modes
+DURABILITY_ALWAYS = "always"  # fsync before every write returns
+DURABILITY_BATCH = "batch"    # fsync every FSYNC_BATCH_WRITES writes or FSYNC_BATCH_INTERVAL_MS
+DURABILITY_OS = "os"          # leave flushing to the OS page cache
+
+
+def durability_for(filepath):
+    """
+    Returns (config key, mode) for a database file. Shards inside a
+    configured directory (e.g. database/messages/) share its entry.
+    """
+    path = os.path.abspath(filepath)
+    for candidate in (path, os.path.dirname(path)):
+        if candidate in DURABILITY:
+            return candidate, DURABILITY[candidate]
+    return path, DEFAULT_DURABILITY
+
+
+def fsync_path(path):
+    """Flushes a file (or directory entry) that was written through another handle."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FsyncPolicy:
+    """
+    Decides when written data must be fsync'ed.
+
+    In 'batch' mode writes that don't hit the threshold are remembered and
+    synced by a timer once the interval has passed, so nothing stays
+    unsynced for longer than FSYNC_BATCH_INTERVAL_MS.
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.unsynced = set()
+        self.pending_writes = 0
+        self.last_sync = time.monotonic()
+        self.timer = None
+
+    def should_sync(self, path):
+        """
+        Called after writing 'path'. Returns True if the caller must fsync
+        it now; otherwise the write is synced later (or never, in 'os' mode).
+        """
+        if self.mode == DURABILITY_ALWAYS:
+            return True
+        if self.mode != DURABILITY_BATCH:
+            return False
+
+        with self.lock:
+            self.pending_writes += 1
+            elapsed_ms = (time.monotonic() - self.last_sync) * 1000
+            if self.pending_writes < FSYNC_BATCH_WRITES and elapsed_ms < FSYNC_BATCH_INTERVAL_MS:
+                self.unsynced.add(path)
+                if self.timer is None:
+                    self.timer = threading.Timer(FSYNC_BATCH_INTERVAL_MS / 1000, self.sync_pending)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return False
+
+            others = self.unsynced - {path}
+            self._reset()
+
+        # The caller syncs its own file; flush the rest of the batch alongside it
+        self._sync_paths(others)
+        return True
+
+    def sync_pending(self):
+        """Fsyncs every file written since the last sync."""
+        with self.lock:
+            paths = self.unsynced
+            self._reset()
+        self._sync_paths(paths)
+
+    @staticmethod
+    def _sync_paths(paths):
+        # Files first, then the directories holding them (makes renames durable)
+        for path in list(paths) + list({os.path.dirname(p) for p in paths}):
+            try:
+                fsync_path(path)
+            except OSError:
+                # File was replaced or removed since; its successor is synced on its own write
+                pass
+
+    def _reset(self):
+        # Caller holds the lock. Anything written so far is covered by the sync about to happen.
+        self.pending_writes = 0
+        self.last_sync = time.monotonic()
+        self.unsynced = set()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+# One policy per configured database, so e.g. all message shards share one batch window
+_policies = {}
+_policies_lock = threading.Lock()
+
+def fsync_policy_for(filepath, durability=None):
+    """Returns the shared FsyncPolicy for a file (a private one if 'durability' is forced)."""
+    if durability:
+        return FsyncPolicy(durability)
+    key, mode = durability_for(filepath)
+    with _policies_lock:
+        if key not in _policies:
+            _policies[key] = FsyncPolicy(mode)
+        return _policies[key]
+
+
+# One lock per file, shared by every FileIO opened on it (a chat shard reopened
+# after eviction, or the snapshot service copying a snapshot with its log)
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_lock = threading.Lock()
+
+def file_lock(filepath):
+    """The lock guarding a database file (and its log) across FileIO instances."""
+    key = os.path.abspath(filepath)
+    with _file_locks_lock:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = threading.Lock()
+        return lock
+
+
+_UNKNOWN = object()
+
+def snapshot_digest(payload):
+    """Identifies a snapshot's contents (None if there is no snapshot)."""
+    if payload is None:
+        return None
+    import hashlib  # Only needed once a log is written or replayed
+    return hashlib.sha1(payload).hexdigest()
+
 
 class FileIO:
     """
-    Handles thread-safe JSON file operations and automatic backups.
-    Instantiated per file to manage specific locks.
+    Handles thread-safe JSON file operations.
+    Instantiated per file to manage specific locks. Backups are taken in the
+    background by utils/snapshot_service.py, never on the write path.
+
+    Writes are atomic (temp file + rename), so a crash mid-write leaves the
+    previous version intact. How soon a write is forced to disk depends on
+    the durability mode configured for the file (see config.DURABILITY).
+
+    Files are written with the storage codec (config.STORAGE_CODEC: compact
+    JSON or msgpack) and read back with whichever codec wrote them.
     """
-    def __init__(self, filepath):
+    def __init__(self, filepath, durability=None, storage_codec=None):
         self.filepath = filepath
-        self.lock = threading.Lock()
+        self.lock = file_lock(filepath)
+        self.fsync = fsync_policy_for(filepath, durability)
+        self.codec = storage_codec or codec.get_codec()
         
         # Ensure directories exist immediately upon initialization
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        os.makedirs(BACKUP_DIR, exist_ok=True)
 
     def read_json(self):
         """
@@ -24,60 +174,327 @@ class FileIO:
         Returns empty dict/list if file doesn't exist or is corrupted.
         """
         with self.lock:
-            if not os.path.exists(self.filepath):
-                return {}
-            try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                # Return empty dict on corruption or read error to prevent crashes
-                return {}
+            return self._load()
 
     def write_json(self, data):
         """
-        Saves JSON data and creates a backup copy.
+        Saves JSON data.
         """
         with self.lock:
-            try:
-                # 1. Create Backup (if file exists)
-                if os.path.exists(self.filepath):
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = os.path.basename(self.filepath)
-                    backup_path = os.path.join(BACKUP_DIR, f"{filename}_{timestamp}.bak")
-                    
-                    # Copy file to backup folder
-                    shutil.copy2(self.filepath, backup_path)
-                    
-                    # Optional: Prune old backups (keep last 5)
-                    self._prune_backups(filename)
-
-                # 2. Write New Data
-                with open(self.filepath, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4, ensure_ascii=False)
-                return True
-            except Exception as e:
-                print(f"Error writing/backing up {self.filepath}: {e}")
+            return self._dump(data)
+
+    def encode(self, data):
+        """Serializes 'data' (to bytes) exactly as write_json() would store it."""
+        return self.codec.encode(data)
+
+    def write_encoded(self, payload):
+        """
+        Saves bytes produced by encode(). Lets callers serialize on one
+        thread (e.g. the event loop) and do the disk I/O on another.
+        """
+        with self.lock:
+            return self._write_payload(payload)
+
+    def _load(self):
+        """Reads the file without taking the lock (caller must hold it)."""
+        payload = self._read_payload()
+        if payload is None:
+            return {}
+        try:
+            return codec.decode_stored(payload)
+        except ValueError:
+            # Return empty dict on corruption to prevent crashes
+            return {}
+
+    def _read_payload(self):
+        """The file's bytes, or None if it doesn't exist (caller holds the lock)."""
+        try:
+            with open(self.filepath, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _dump(self, data):
+        """Writes the file without taking the lock (caller must hold it)."""
+        return self._write_payload(self.encode(data))
+
+    def _write_payload(self, payload):
+        try:
+            self._atomic_write(payload)
+            return True
+        except Exception as e:
+            print(f"Error writing {self.filepath}: {e}")
+            return False
+
+    def _atomic_write(self, payload):
+        """Writes to a temp file in the same directory, then renames it over the target."""
+        import tempfile  # Only needed once something is written (it pulls in shutil and random)
+        directory = os.path.dirname(self.filepath)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.filepath)}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                sync_now = self.fsync.should_sync(self.filepath)
+                if sync_now:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if sync_now:
+            # Make the rename itself durable
+            fsync_path(directory)
+
+
+class LogFileIO(FileIO):
+    """
+    Write-ahead log engine for dict-of-lists databases (e.g. messages.json).
+
+    Every mutation is appended as a single JSON line to '<file>.log', so a
+    write costs O(record size) instead of rewriting the whole file. The file
+    itself is the snapshot (in the storage codec; the log is always JSON
+    lines); the log is folded into it (compacted) once it holds
+    'compact_every' records, or whenever write_json() is called.
+
+    Log record formats:
+        { "op": "append", "key": str, "value": dict }
+        { "op": "update", "key": str, "id": str, "fields": dict }
+        { "op": "trim", "key": str, "count": int }   (drops the oldest 'count' items)
+
+    A log starts with { "op": "base", "snapshot": str or None }, naming (by
+    digest) the snapshot its records apply to. A crash after a new snapshot
+    is renamed into place but before the log is truncated leaves a log
+    naming the old one; its records are already in the snapshot, so it is
+    skipped instead of replayed twice.
+    """
+    def __init__(self, filepath, compact_every=LOG_COMPACT_THRESHOLD, durability=None):
+        super().__init__(filepath, durability=durability)
+        self.log_path = f"{filepath}.log"
+        self.compact_every = compact_every
+        # Digest of the snapshot on disk (_UNKNOWN until it is read or written)
+        self._snapshot_digest = _UNKNOWN
+        # False until the log is known to belong to that snapshot
+        self._log_checked = False
+        self._repair_log()
+        self.log_records = self._count_log_records()
+
+    def read_json(self):
+        """Loads the snapshot and replays the pending log on top of it."""
+        with self.lock:
+            data = self._load()
+            self._replay_log(data)
+            return data
+
+    def write_json(self, data):
+        """Replaces the snapshot with 'data' and discards the log."""
+        with self.lock:
+            return self._write_snapshot(data)
+
+    def write_encoded(self, payload):
+        """Replaces the snapshot with pre-encoded bytes and discards the log."""
+        with self.lock:
+            if not self._write_payload(payload):
                 return False
+            return self._truncate_log()
+
+    def append(self, key, value):
+        """Appends 'value' to the list stored under 'key'."""
+        return self.write_lines([self.encode_append(key, value)])
+
+    def update(self, key, item_id, fields):
+        """Merges 'fields' into the item with id 'item_id' under 'key'."""
+        return self.write_lines([self.encode_update(key, item_id, fields)])
+
+    @staticmethod
+    def encode_append(key, value):
+        """Log line for append()."""
+        return codec.dumps({"op": "append", "key": key, "value": value})
+
+    @staticmethod
+    def encode_update(key, item_id, fields):
+        """Log line for update()."""
+        return codec.dumps({"op": "update", "key": key, "id": item_id, "fields": fields})
+
+    @staticmethod
+    def encode_trim(key, count):
+        """Log line dropping the first 'count' items under 'key' (e.g. once archived)."""
+        return codec.dumps({"op": "trim", "key": key, "count": count})
+
+    def write_lines(self, lines):
+        """Appends pre-encoded log lines with a single write call."""
+        try:
+            with self.lock:
+                if not self._log_checked and not self._check_log():
+                    return False
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    header = ""
+                    if f.tell() == 0:
+                        header = codec.dumps({"op": "base", "snapshot": self._snapshot_id()}) + "\n"
+                    f.write(header + "".join(line + "\n" for line in lines))
+                    if self.fsync.should_sync(self.log_path):
+                        f.flush()
+                        os.fsync(f.fileno())
+                self.log_records += len(lines)
+                needs_compaction = self.log_records >= self.compact_every
+        except Exception as e:
+            print(f"Error appending to {self.log_path}: {e}")
+            # Part of the batch may have reached the file
+            with self.lock:
+                self._repair_log()
+            return False
 
-    def _prune_backups(self, filename):
+        if needs_compaction:
+            self.compact()
+        return True
+
+    def compact(self):
+        """Folds the log into a fresh snapshot."""
+        with self.lock:
+            data = self._load()
+            self._replay_log(data)
+            return self._write_snapshot(data)
+
+    # --- Internal ---
+
+    def _write_snapshot(self, data):
+        if not self._dump(data):
+            return False
+        return self._truncate_log()
+
+    def _truncate_log(self):
+        try:
+            # Snapshot now contains everything, start a fresh log
+            open(self.log_path, 'w', encoding='utf-8').close()
+            self.log_records = 0
+            self._log_checked = True
+            return True
+        except OSError as e:
+            print(f"Error truncating {self.log_path}: {e}")
+            # Whatever is appended to the stale log would be skipped: retried before the next append
+            self._log_checked = False
+            return False
+
+    def _read_payload(self):
+        payload = super()._read_payload()
+        self._snapshot_digest = snapshot_digest(payload)
+        return payload
+
+    def _write_payload(self, payload):
+        ok = super()._write_payload(payload)
+        self._snapshot_digest = snapshot_digest(payload) if ok else _UNKNOWN
+        return ok
+
+    def _snapshot_id(self):
+        if self._snapshot_digest is _UNKNOWN:
+            self._read_payload()
+        return self._snapshot_digest
+
+    def _check_log(self):
+        """Truncates a log left behind by an interrupted compaction (caller holds the lock)."""
+        header = self._read_log_header()
+        if header is not None and header.get("snapshot") != self._snapshot_id():
+            return self._truncate_log()
+        self._log_checked = True
+        return True
+
+    def _read_log_header(self):
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                record = codec.loads(f.readline())
+        except (FileNotFoundError, ValueError):
+            return None
+        return record if isinstance(record, dict) and record.get("op") == "base" else None
+
+    def _repair_log(self):
         """
-        Helper to keep only the 5 most recent backups for this file.
+        Cuts a torn trailing record (a write interrupted by a crash) off the
+        log. Left in place, the next append would continue that line and be
+        unreadable too.
         """
         try:
-            # Find all backups for this specific file
-            all_backups = [
-                os.path.join(BACKUP_DIR, f) 
-                for f in os.listdir(BACKUP_DIR) 
-                if f.startswith(filename) and f.endswith(".bak")
-            ]
-            
-            # Sort by modification time (newest last)
-            all_backups.sort(key=os.path.getmtime)
-            
-            # Remove old ones if we have more than 5
-            while len(all_backups) > 5:
-                oldest = all_backups.pop(0)
-                os.remove(oldest)
-        except Exception:
-            # Pruning failure shouldn't stop the main write operation
-            pass
\ No newline at end of file
+            with open(self.log_path, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                end = 0
+                pos = size
+                while pos > 0:
+                    step = min(4096, pos)
+                    pos -= step
+                    f.seek(pos)
+                    newline = f.read(step).rfind(b"\n")
+                    if newline != -1:
+                        end = pos + newline + 1
+                        break
+                if end < size:
+                    f.truncate(end)
+                    print(f"Discarded a torn record ({size - end} bytes) at the end of {self.log_path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error repairing {self.log_path}: {e}")
+
+    def _replay_log(self, data):
+        if not os.path.exists(self.log_path):
+            return data
+
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    # Torn trailing write from a crash; everything before it is intact
+                    continue
+                if record.get("op") == "base":
+                    if record.get("snapshot") != self._snapshot_digest:
+                        # Written before the current snapshot, which already holds it
+                        return data
+                    continue
+                self._apply(data, record)
+        return data
+
+    @staticmethod
+    def _apply(data, record):
+        op = record.get("op")
+        key = record.get("key")
+
+        if op == "append":
+            data.setdefault(key, []).append(record["value"])
+        elif op == "update":
+            for item in data.get(key, []):
+                if item.get("id") == record.get("id"):
+                    item.update(record.get("fields", {}))
+                    break
+        elif op == "trim" and key in data:
+            data[key] = data[key][record.get("count", 0):]
+
+    def _count_log_records(self):
+        if not os.path.exists(self.log_path):
+            return 0
+        with open(self.log_path, 'rb') as f:
+            count = sum(1 for _ in f)
+        return count - 1 if self._read_log_header() is not None else count
+
+
+class IndexLogFileIO(LogFileIO):
+    """
+    LogFileIO for a flat { key: value } map (e.g. a lookup index): each
+    log record sets one key, so keeping a large index current costs one
+    short line per change.
+
+    Log record format:
+        { "op": "set", "key": str, "value": any }
+    """
+    def set(self, key, value):
+        return self.write_lines([self.encode_set(key, value)])
+
+    @staticmethod
+    def encode_set(key, value):
+        """Log line for set()."""
+        return codec.dumps({"op": "set", "key": key, "value": value})
+
+    @staticmethod
+    def _apply(data, record):
+        if record.get("op") == "set":
+            data[record.get("key")] = record.get("value")
@@ -0,0 +1,96 @@
+class IndexSpec:
+    """
+    Describes a secondary index over a { key: record } database:
+    'extract(record)' returns the values the record is filed under.
+    'index_class' builds the index (SecondaryIndex unless given).
+    """
+    def __init__(self, name, extract, index_class=None):
+        self.name = name
+        self.extract = extract
+        self.index_class = index_class
+
+    def create(self):
+        return (self.index_class or SecondaryIndex)(self)
+
+
+def field_index(field):
+    """Index on one field of each record (records without it are left out)."""
+    def extract(record):
+        value = record.get(field) if isinstance(record, dict) else None
+        return (value,) if value is not None else ()
+    return IndexSpec(field, extract)
+
+
+def keys_index(field, name=None):
+    """Index on the keys of a dict field: a record is filed under each of them."""
+    def extract(record):
+        value = record.get(field) if isinstance(record, dict) else None
+        return tuple(value) if isinstance(value, dict) else ()
+    return IndexSpec(name or field, extract)
+
+
+class SecondaryIndex:
+    """
+    value -> record keys, kept in step with the data it was built from.
+
+    Keys for a value are kept in insertion order (oldest record first),
+    so lookups are deterministic. 'values_by_key' remembers what each
+    record was filed under, which lets update() work after the record
+    has already been mutated in place.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self.keys_by_value = {}
+        self.values_by_key = {}
+        # SharedStore.generation this index was built for
+        self.generation = None
+
+    def rebuild(self, data, generation):
+        self.keys_by_value = {}
+        self.values_by_key = {}
+        for key, record in data.items():
+            self.update(key, record)
+        self.generation = generation
+
+    def update(self, key, record):
+        """Re-files one record (None = removed)."""
+        new = tuple(self.spec.extract(record)) if record is not None else ()
+        old = self.values_by_key.get(key, ())
+        if new == old:
+            return
+
+        for value in old:
+            keys = self.keys_by_value.get(value)
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del self.keys_by_value[value]
+        for value in new:
+            self.keys_by_value.setdefault(value, {})[key] = None
+
+        if new:
+            self.values_by_key[key] = new
+        else:
+            self.values_by_key.pop(key, None)
+
+    def sync(self, data):
+        """Re-files every record and drops the ones that are gone (full diff)."""
+        for key, record in data.items():
+            self.update(key, record)
+        for key in [k for k in self.values_by_key if k not in data]:
+            self.update(key, None)
+
+    def get(self, value):
+        """Keys of the records filed under 'value', oldest first."""
+        return list(self.keys_by_value.get(value, ()))
+
+
+# ==========================================
+# INDEXES USED BY THE HANDLERS
+# ==========================================
+
+USER_BY_HANDLE = field_index("handle")
+USER_BY_USERNAME = field_index("username")
+GROUP_BY_JOIN_CODE = field_index("join_code")
+# user_id -> ids of the groups they are a member of
+GROUP_BY_MEMBER = keys_index("members", name="member")
@@ -3,7 +3,6 @@ import base64
 import subprocess
 import uuid
 import logging
-from PIL import Image
 from chat_server.config import IMAGES_DIR, VIDEOS_DIR, TEMP_DIR
 
 class MediaUtils:
@@ -31,6 +30,9 @@ class MediaUtils:
     def compress_image(temp_path, file_id):
         """Compresses image using Pillow."""
         try:
+            # Imported on first use: Pillow is slow to load and most servers never see an image
+            from PIL import Image
+
             output_filename = f"{file_id}.jpg" # Standardize to JPG
             output_path = os.path.join(IMAGES_DIR, output_filename)
             
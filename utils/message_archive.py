@@ -0,0 +1,318 @@
+import os
+import sys
+import lzma
+import mmap
+import zlib
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from chat_server.utils import codec
+from chat_server.utils.file_io import FileIO, IndexLogFileIO
+from chat_server.config import ARCHIVE_COMPRESSION, ARCHIVE_CACHE_SEGMENTS, ARCHIVE_BLOCK_MESSAGES
+
+# Both live next to the shards; the leading dot keeps them from ever matching a chat key
+ARCHIVE_DIR = ".archive"
+CATALOG_FILE = ".archive.json"
+
+# Segment file layout (little endian):
+#   header      magic, message count, messages per block, compression method
+#   timestamps  count x float64
+#   offsets     (blocks + 1) x uint64, file offsets of the blocks (last = end of file)
+#   blocks      each one compressed on its own: the block's messages as JSON lines
+SEGMENT_MAGIC = b"CHATSEG2"
+HEADER = struct.Struct("<8sIIB")
+METHODS = {"none": 0, "zlib": 1, "lzma": 2}
+
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+
+
+def compress(payload, method=ARCHIVE_COMPRESSION):
+    if method == "lzma":
+        return lzma.compress(payload)
+    if method == "zlib":
+        return zlib.compress(payload, 6)
+    if method == "none":
+        return payload
+    raise ValueError(f"Unknown archive compression: {method}")
+
+
+def decompress(raw, method=None):
+    """Inflates a block (or a whole pre-block-format segment, when 'method' is None)."""
+    if method == METHODS["none"]:
+        return raw
+    if method == METHODS["lzma"] or (method is None and raw.startswith(LZMA_MAGIC)):
+        return lzma.decompress(raw)
+    return zlib.decompress(raw)
+
+
+def build_segment(timestamps, lines, method=ARCHIVE_COMPRESSION, block_messages=ARCHIVE_BLOCK_MESSAGES):
+    """Assembles a segment file from the messages' encoded JSON lines (see the layout above)."""
+    blocks = [
+        compress(b"\n".join(lines[i:i + block_messages]), method)
+        for i in range(0, len(lines), block_messages)
+    ]
+    header = HEADER.pack(SEGMENT_MAGIC, len(lines), block_messages, METHODS[method])
+    stamps = struct.pack(f"<{len(timestamps)}d", *timestamps)
+    offset = len(header) + len(stamps) + 8 * (len(blocks) + 1)
+    offsets = [offset]
+    for block in blocks:
+        offset += len(block)
+        offsets.append(offset)
+    return b"".join([header, stamps, struct.pack(f"<{len(offsets)}Q", *offsets)] + blocks)
+
+
+class SegmentReader:
+    """
+    Read access to one segment file through mmap. The timestamps and the
+    block offset index are read once; a slice of messages only inflates and
+    parses the blocks it covers, so scrolling back never materializes a
+    whole segment. Pages are cut straight out of the mapping.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # The mapping outlives the file handle; it is unmapped when the reader is dropped
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.count, self.block_messages, self.method = HEADER.unpack_from(self.map, 0)
+
+        start = HEADER.size
+        self.timestamps = array("d")
+        self.timestamps.frombytes(self.map[start:start + 8 * self.count])
+        if sys.byteorder == "big":
+            self.timestamps.byteswap()
+
+        blocks = -(-self.count // self.block_messages)
+        start += 8 * self.count
+        self.offsets = struct.unpack_from(f"<{blocks + 1}Q", self.map, start)
+
+    def slice(self, start, end):
+        """Messages [start, end) of this segment (fresh objects, safe to modify)."""
+        result = []
+        end = min(end, self.count)
+        size = self.block_messages
+        while start < end:
+            block = start // size
+            lines = self.block(block)
+            stop = min(end, (block + 1) * size)
+            result.extend(codec.loads(line) for line in lines[start - block * size:stop - block * size])
+            start = stop
+        return result
+
+    def block(self, index):
+        raw = self.map[self.offsets[index]:self.offsets[index + 1]]
+        return decompress(raw, self.method).split(b"\n")
+
+
+class LegacySegmentReader:
+    """Segments written before the block format: one compressed document, decoded whole."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = codec.decode_stored(decompress(f.read()))
+        self.timestamps = data.get("timestamps", [])
+        self.messages = data.get("messages", [])
+        self.count = len(self.messages)
+
+    def slice(self, start, end):
+        return [dict(msg) for msg in self.messages[start:end]]
+
+
+def open_segment(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(SEGMENT_MAGIC))
+    return SegmentReader(path) if magic == SEGMENT_MAGIC else LegacySegmentReader(path)
+
+
+class Segment:
+    """
+    One immutable file of archived messages, covering the absolute
+    positions [first_pos, first_pos + count) of its chat. 'first_ts' and
+    'last_ts' (normalized, ms) let a time cursor pick the segment without
+    opening it; the file itself holds the per-message timestamps.
+    """
+    def __init__(self, name, first_pos, count, first_ts, last_ts):
+        self.name = name
+        self.first_pos = first_pos
+        self.count = count
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+
+    @property
+    def end_pos(self):
+        return self.first_pos + self.count
+
+    def to_list(self):
+        return [self.name, self.first_pos, self.count, self.first_ts, self.last_ts]
+
+
+class ChatArchive:
+    """
+    The archived (cold) part of one chat: messages 0 .. count - 1, oldest
+    first, spread over segments. Edits to archived messages (e.g. deletes)
+    can't touch the immutable files and are kept in 'overrides' instead.
+    """
+    def __init__(self, archive, chat_key, state=None):
+        state = state or {}
+        self.archive = archive
+        self.chat_key = chat_key
+        self.segments = [Segment(*s) for s in state.get("segments", [])]
+        self.overrides = state.get("overrides", {})
+        # Newest archived message, to spot copies left in the hot shard by a crash
+        self.last_id = state.get("last_id")
+
+    @property
+    def count(self):
+        return self.segments[-1].end_pos if self.segments else 0
+
+    @property
+    def last_ts(self):
+        return self.segments[-1].last_ts if self.segments else 0
+
+    def state(self):
+        return {
+            "segments": [s.to_list() for s in self.segments],
+            "overrides": self.overrides,
+            "last_id": self.last_id
+        }
+
+    def bisect(self, ts, bisect_fn):
+        """Absolute position for a timestamp cursor (see ChatHistory._cursor)."""
+        i = bisect_fn([s.last_ts for s in self.segments], ts)
+        if i == len(self.segments):
+            return self.count
+        segment = self.segments[i]
+        return segment.first_pos + bisect_fn(self.archive.reader(segment).timestamps, ts)
+
+    def slice(self, start, end):
+        """Messages at absolute positions [start, end)."""
+        result = []
+        i = max(0, bisect_right([s.first_pos for s in self.segments], start) - 1)
+        for segment in self.segments[i:]:
+            if segment.first_pos >= end:
+                break
+            reader = self.archive.reader(segment)
+            result.extend(reader.slice(max(start, segment.first_pos) - segment.first_pos, end - segment.first_pos))
+        for msg in result:
+            fields = self.overrides.get(msg.get("id"))
+            if fields:
+                msg.update(fields)
+        return result
+
+    def message_at(self, pos, message_id):
+        """The archived message at 'pos' if it is 'message_id', else None."""
+        if not 0 <= pos < self.count:
+            return None
+        found = self.slice(pos, pos + 1)
+        return found[0] if found and found[0].get("id") == message_id else None
+
+    def override(self, message, fields):
+        """Merges 'fields' into an archived message. Returns the catalog line to persist."""
+        message.update(fields)
+        self.overrides.setdefault(message.get("id"), {}).update(fields)
+        return self.archive.catalog.encode_set(self.chat_key, self.state())
+
+    def stale_prefix(self, messages):
+        """How many leading hot messages are already archived (0 unless a crash left copies)."""
+        if not self.last_id:
+            return 0
+        for i, msg in enumerate(messages[:self.count]):
+            if msg.get("id") == self.last_id:
+                return i + 1
+        return 0
+
+
+class MessageArchive:
+    """
+    Cold tier of the message history: per chat, immutable compressed
+    segment files under '<directory>/.archive/<shard name>/', plus one
+    catalog (an IndexLogFileIO, chat_key -> ChatArchive state) listing
+    each chat's segments with their position and time ranges.
+
+    Recently used segments stay open (memory-mapped, see SegmentReader)
+    in a small LRU; messages are only decoded for the pages being read.
+    """
+    def __init__(self, directory, compression=ARCHIVE_COMPRESSION, cache_segments=ARCHIVE_CACHE_SEGMENTS):
+        self.directory = os.path.join(directory, ARCHIVE_DIR)
+        self.compression = compression
+        self.cache_segments = cache_segments
+        self.catalog = IndexLogFileIO(os.path.join(directory, CATALOG_FILE))
+        self.lock = threading.Lock()
+        self.chats = {key: ChatArchive(self, key, state) for key, state in self.catalog.read_json().items()}
+        # segment name -> SegmentReader
+        self._readers = OrderedDict()
+
+    def get(self, chat_key):
+        """The ChatArchive of a chat, or None if nothing was archived yet."""
+        return self.chats.get(chat_key)
+
+    def history(self, chat_key, hot_messages):
+        """Full history of a chat (archived + hot), e.g. to rebuild indexes."""
+        chat = self.get(chat_key)
+        if chat is None:
+            return hot_messages
+        return chat.slice(0, chat.count) + hot_messages[chat.stale_prefix(hot_messages):]
+
+    # ==========================================
+    # WRITING
+    # ==========================================
+
+    def write_segment(self, shard_name, first_pos, timestamps, messages):
+        """
+        Writes one segment file (atomically, fsynced) and returns its
+        Segment. Not visible to readers until add_segment() is called.
+        'messages' may be pre-encoded lines (from encode_messages()).
+        """
+        name = f"{shard_name}/{first_pos:012d}.seg"
+        lines = messages if messages and isinstance(messages[0], bytes) else self.encode_messages(messages)
+        payload = build_segment(timestamps, lines, self.compression)
+        if not FileIO(os.path.join(self.directory, name), durability="always").write_encoded(payload):
+            return None
+        return Segment(name, first_pos, len(timestamps), timestamps[0], timestamps[-1])
+
+    @staticmethod
+    def encode_messages(messages):
+        """One JSON line per message (JSON never contains a raw newline)."""
+        return [codec.dumps_bytes(msg) for msg in messages]
+
+    def add_segment(self, chat_key, segment, last_id):
+        """Publishes a written segment. Returns the catalog line to persist."""
+        chat = self.chats.get(chat_key)
+        if chat is None:
+            chat = self.chats[chat_key] = ChatArchive(self, chat_key)
+        chat.segments.append(segment)
+        chat.last_id = last_id
+        return self.catalog.encode_set(chat_key, chat.state())
+
+    def remove_segment_file(self, segment):
+        """Drops a segment file that was written but never published."""
+        try:
+            os.remove(os.path.join(self.directory, segment.name))
+        except OSError:
+            pass
+
+    def write(self, lines):
+        """Persists catalog lines (so the archive can sit alongside the other indexes)."""
+        return self.catalog.write_lines(lines) if lines else True
+
+    # ==========================================
+    # READING
+    # ==========================================
+
+    def reader(self, segment):
+        """The (cached) open reader of a segment."""
+        with self.lock:
+            reader = self._readers.get(segment.name)
+            if reader is not None:
+                self._readers.move_to_end(segment.name)
+                return reader
+
+        reader = open_segment(os.path.join(self.directory, segment.name))
+
+        with self.lock:
+            # Another thread may have opened it meanwhile; keep the first one
+            reader = self._readers.setdefault(segment.name, reader)
+            self._readers.move_to_end(segment.name)
+            while len(self._readers) > self.cache_segments:
+                # Not closed explicitly: a reader still in use elsewhere keeps its mapping
+                self._readers.popitem(last=False)
+        return reader
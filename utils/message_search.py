@@ -0,0 +1,210 @@
+import re
+import json
+from chat_server.utils.time_utils import normalize_timestamp
+from chat_server.config import SNIPPET_LENGTH
+
+# Lives next to the message index; the leading dot keeps it from ever matching a chat key
+SEARCH_FILE = ".message_search.db"
+
+# Only text is searchable (other types carry URLs or encoded media in 'content')
+INDEXED_TYPES = ("text",)
+
+WORD = re.compile(r"\w+")
+# Longer "words" are almost always pasted tokens or links
+MAX_TERM_LENGTH = 40
+# Postings counted per query term to find the rarest one (counting stops there)
+RARITY_PROBE = 10000
+# Hits read per query while holding the database lock
+FETCH_BATCH = 100
+
+
+def tokenize(text):
+    """Distinct search terms of a text, in order of appearance."""
+    if not isinstance(text, str):
+        return []
+    words = (w for w in WORD.findall(text.casefold()) if len(w) <= MAX_TERM_LENGTH)
+    return list(dict.fromkeys(words))
+
+
+def message_terms(message):
+    """Terms a message is filed under (none for deleted or non-text messages)."""
+    if not isinstance(message, dict) or message.get("is_deleted"):
+        return []
+    if message.get("type", "text") not in INDEXED_TYPES:
+        return []
+    return tokenize(message.get("content"))
+
+
+def snippet(text, query, length=SNIPPET_LENGTH):
+    """About 'length' characters of 'text' around the first query term it contains."""
+    if not isinstance(text, str):
+        return ""
+    if len(text) <= length:
+        return text
+
+    hit = 0
+    terms = tokenize(query)
+    folded = text.casefold()
+    # casefold() can change the length of some characters; then start at the beginning
+    if terms and len(folded) == len(text):
+        pattern = r"(?<!\w)(?:" + "|".join(map(re.escape, terms)) + r")(?!\w)"
+        match = re.search(pattern, folded)
+        if match:
+            hit = match.start()
+
+    start = max(0, min(hit - length // 3, len(text) - length))
+    end = start + length
+    return ("…" if start > 0 else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+
+
+class MessageSearchIndex:
+    """
+    Inverted index over message text, kept on disk in a SQLite table:
+    one (term, rank, chat_key, message_id) row per indexed word, clustered
+    by term and then by time, plus an index by (term, chat_key, rank) for
+    searches scoped to some chats. Nothing is held in memory; a query
+    reads the postings of its own terms in the searched chats only,
+    walking the rarest one newest first, probing the others by key, and
+    stopping once a page is full.
+
+    'db' is a SQLiteDatabase: the server's own with the SQLite backend (so
+    every worker shares one index), or a file next to the shards. If the
+    table is missing it is rebuilt from the shards; a tail of messages
+    lost in a crash is re-indexed when their chat is loaded.
+
+    add() and remove() only describe a change ("log lines"); write()
+    applies a batch of them in one transaction.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.is_new = db.create_table(
+            "message_terms",
+            "CREATE TABLE message_terms (term TEXT NOT NULL, rank REAL NOT NULL, chat_key TEXT NOT NULL, "
+            "message_id TEXT NOT NULL, PRIMARY KEY (term, rank, chat_key, message_id)) WITHOUT ROWID"
+        )
+        # Also added to indexes created before searches were scoped in SQL
+        db.query("CREATE INDEX IF NOT EXISTS idx_message_terms_chat ON message_terms (term, chat_key, rank)")
+
+    def add(self, chat_key, message):
+        """Line indexing a message (None if it has no terms)."""
+        return self._line("post", chat_key, message)
+
+    def remove(self, chat_key, message):
+        """Line unindexing a message as it was before a change (or None)."""
+        return self._line("unpost", chat_key, message)
+
+    def reconcile(self, chat_key, messages):
+        """
+        Re-indexes the newest messages of a freshly loaded chat that are
+        missing from the index (lost with the log tail). Returns log lines.
+        """
+        lines = []
+        for msg in reversed(messages):
+            line = self.add(chat_key, msg)
+            if line is None:
+                continue
+            _, _, message_id, rank, terms = line
+            if self.db.query(
+                "SELECT 1 FROM message_terms WHERE term = ? AND rank = ? AND chat_key = ? AND message_id = ?",
+                (terms[0], rank, chat_key, message_id)
+            ):
+                break
+            lines.append(line)
+        return lines
+
+    def write(self, lines):
+        if not lines:
+            return True
+        import sqlite3
+        try:
+            with self.db.transaction() as cur:
+                self._apply(cur, lines)
+        except sqlite3.Error as e:
+            print(f"Error writing message search index: {e}")
+            return False
+        return True
+
+    def rebuild(self, chats):
+        """Indexes (chat_key, messages) pairs from scratch, in one transaction."""
+        with self.db.transaction() as cur:
+            cur.execute("DELETE FROM message_terms")
+            for chat_key, messages in chats:
+                self._apply(cur, [line for line in (self.add(chat_key, msg) for msg in messages) if line])
+        self.is_new = False
+        return True
+
+    @staticmethod
+    def _apply(cur, lines):
+        for op, chat_key, message_id, rank, terms in lines:
+            rows = [(term, rank, chat_key, message_id) for term in terms]
+            if op == "post":
+                cur.executemany("INSERT OR IGNORE INTO message_terms VALUES (?, ?, ?, ?)", rows)
+            else:
+                cur.executemany(
+                    "DELETE FROM message_terms WHERE term = ? AND rank = ? AND chat_key = ? AND message_id = ?", rows
+                )
+
+    def search(self, query, chat_keys, limit, offset=0):
+        """
+        Returns (hits, has_more): one page of (chat_key, message_id) for
+        the messages containing every term of 'query', newest first.
+        Only the chats in 'chat_keys' are searched (every chat if None).
+        Blocking (disk reads).
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], False
+        if chat_keys is None:
+            scope, scope_params = "", []
+        else:
+            chat_keys = sorted(set(chat_keys))
+            if not chat_keys:
+                return [], False
+            # One parameter however many chats the user is in
+            scope, scope_params = " AND p.chat_key IN (SELECT value FROM json_each(?))", [json.dumps(chat_keys)]
+
+        # Walk the postings of the rarest term; the others are only probed
+        counts = sorted((self._count(term, scope, scope_params), term) for term in terms)
+        if counts[0][0] == 0:
+            return [], False
+        driver, others = counts[0][1], [term for _, term in counts[1:]]
+        probe = (
+            " AND EXISTS (SELECT 1 FROM message_terms AS o WHERE o.term = ? AND o.rank = p.rank"
+            " AND o.chat_key = p.chat_key AND o.message_id = p.message_id)"
+        )
+        sql = ("SELECT rank, chat_key, message_id FROM message_terms AS p WHERE p.term = ?" + scope
+               + probe * len(others) + "{after} ORDER BY p.rank DESC, p.chat_key DESC, p.message_id DESC LIMIT ?")
+        params = [driver, *scope_params, *others]
+
+        # Batches continue below the last hit, so the lock is never held for a whole walk
+        wanted = offset + limit + 1
+        hits = []
+        last = None
+        while len(hits) < wanted:
+            batch = min(FETCH_BATCH, wanted - len(hits))
+            if last is None:
+                rows = self.db.query(sql.format(after=""), [*params, batch])
+            else:
+                rows = self.db.query(
+                    sql.format(after=" AND (p.rank, p.chat_key, p.message_id) < (?, ?, ?)"), [*params, *last, batch]
+                )
+            hits.extend((chat_key, message_id) for _, chat_key, message_id in rows)
+            if len(rows) < batch:
+                break
+            last = rows[-1]
+        return hits[offset:offset + limit], len(hits) > offset + limit
+
+    def _count(self, term, scope="", scope_params=()):
+        """Postings of 'term' (in the searched chats), counted up to RARITY_PROBE (enough to pick the rarest)."""
+        return self.db.query(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM message_terms AS p WHERE p.term = ?{scope} LIMIT ?)",
+            (term, *scope_params, RARITY_PROBE)
+        )[0][0]
+
+    @staticmethod
+    def _line(op, chat_key, message):
+        terms = message_terms(message)
+        message_id = message.get("id") if isinstance(message, dict) else None
+        if not terms or message_id is None:
+            return None
+        return (op, chat_key, message_id, normalize_timestamp(message.get("timestamp")), terms)
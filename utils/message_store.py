@@ -0,0 +1,738 @@
+import os
+import re
+import hashlib
+import time
+import logging
+import threading
+import functools
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from chat_server.utils.file_io import LogFileIO
+from chat_server.utils.time_utils import normalize_timestamp
+from chat_server.utils.message_search import MessageSearchIndex, SEARCH_FILE
+from chat_server.utils.message_archive import MessageArchive
+from chat_server.config import (
+    MESSAGE_CACHE_BUDGET, RETENTION_HOT_MESSAGES, RETENTION_HOT_DAYS, ARCHIVE_SEGMENT_MESSAGES
+)
+
+# Chat keys are UUIDs or "uuid_uuid" pairs; anything else is hashed into a safe filename
+SAFE_KEY = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+# Live next to the shards; the leading dot keeps them from ever matching a chat key
+INDEX_FILE = ".message_index.db"
+# Where the indexes were kept before they moved into SQLite (removed once rebuilt)
+LEGACY_INDEX_FILES = (".message_index.json", ".message_search.json")
+
+# Changes to these fields re-file a message in the search index
+SEARCHABLE_FIELDS = ("content", "type", "is_deleted")
+
+
+def private_members(chat_key):
+    """The two user ids of a private chat key ("<id>_<id>"), or None for a group chat."""
+    ids = chat_key.split("_")
+    return ids if len(ids) == 2 else None
+
+
+def list_shards(directory):
+    """Paths of the chat shards in 'directory' (a shard may exist only as its .log)."""
+    if not os.path.isdir(directory):
+        return []
+    names = set()
+    for name in os.listdir(directory):
+        if name.startswith("."):
+            continue
+        if name.endswith(".json.log"):
+            name = name[:-len(".log")]
+        if name.endswith(".json"):
+            names.add(name)
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+class ChatHistory:
+    """
+    One chat's cached (hot) messages plus the indexes used for paging:
+    'positions' maps message id -> position and 'timestamps' holds the
+    normalized send time of each message (non-decreasing, for bisect).
+
+    Positions are absolute within the chat's whole history: the first
+    'base' messages live in the archive (see utils/message_archive.py),
+    so hot message i is at position base + i. Pages that reach back
+    past the hot window are read from the archive transparently.
+    """
+    def __init__(self, chat_key, shard, messages, size, archive=None, locate=None):
+        self.chat_key = chat_key
+        self.shard = shard
+        self.messages = messages
+        self.size = size
+        self.archive = archive
+        self.base = archive.count if archive else 0
+        # message_id -> absolute position, for archived ids (via the message index)
+        self.locate = locate
+        # Bumped on every update, so archiving can tell if it raced one
+        self.revision = 0
+        self.positions = {}
+        self.timestamps = []
+        for msg in messages:
+            self._index(msg)
+
+    @property
+    def total(self):
+        return self.base + len(self.messages)
+
+    def add(self, message):
+        self.messages.append(message)
+        self._index(message)
+
+    def find(self, message_id):
+        """Hot message with 'message_id', or None."""
+        pos = self.positions.get(message_id)
+        return self.messages[pos - self.base] if pos is not None else None
+
+    def at(self, message_id, pos):
+        """Message at position 'pos' if it is 'message_id', else looked up by id."""
+        if pos is not None and self.base <= pos < self.total and self.messages[pos - self.base].get("id") == message_id:
+            return self.messages[pos - self.base]
+        if pos is not None and pos < self.base:
+            return self.archive.message_at(pos, message_id)
+        return self.find(message_id)
+
+    def is_archived(self, pos):
+        return pos is not None and pos < self.base
+
+    def page(self, before=None, after=None, limit=50):
+        """
+        Returns (messages, has_more) for one page, oldest first.
+        'before'/'after' may be a message id or a timestamp; with neither,
+        the latest 'limit' messages are returned. Raises KeyError for an
+        unknown message id.
+        """
+        total = self.total
+
+        if after is not None:
+            start = self._cursor(after, bisect_right)
+            end = min(total, start + limit)
+            return self.slice(start, end), end < total
+
+        end = self._cursor(before, bisect_left) if before is not None else total
+        start = max(0, end - limit)
+        return self.slice(start, end), start > 0
+
+    def slice(self, start, end):
+        """Messages at positions [start, end), reading archived ones from their segments."""
+        hot = self.messages[max(0, start - self.base):max(0, end - self.base)]
+        if start >= self.base:
+            return hot
+        return self.archive.slice(start, min(end, self.base)) + hot
+
+    def trim(self, count):
+        """Drops the oldest 'count' hot messages once they are in the archive."""
+        for msg in self.messages[:count]:
+            self.positions.pop(msg.get("id"), None)
+        self.messages = self.messages[count:]
+        self.timestamps = self.timestamps[count:]
+        self.base += count
+
+    def _cursor(self, cursor, bisect_fn):
+        """Resolves a cursor to a position (boundary between two messages)."""
+        if isinstance(cursor, str):
+            pos = self.positions.get(cursor)
+            if pos is None and self.base and self.locate:
+                pos = self.locate(cursor)
+                pos = pos if self.is_archived(pos) else None
+            if pos is not None:
+                return pos + 1 if bisect_fn is bisect_right else pos
+        if isinstance(cursor, bool):
+            raise KeyError(cursor)
+        try:
+            ts = float(cursor)
+        except (TypeError, ValueError):
+            raise KeyError(cursor)
+        ts = normalize_timestamp(ts)
+        i = bisect_fn(self.timestamps, ts)
+        if i == 0 and self.base:
+            # Everything hot is later: the boundary is in (or at the end of) the archive
+            return self.archive.bisect(ts, bisect_fn)
+        return self.base + i
+
+    def _index(self, message):
+        self.positions[message.get("id")] = self.base + len(self.timestamps)
+        ts = normalize_timestamp(message.get("timestamp"))
+        # Keep the list sorted even if a client clock went backwards (or behind the archive)
+        floor = self.timestamps[-1] if self.timestamps else (self.archive.last_ts if self.base else None)
+        if floor is not None and ts < floor:
+            ts = floor
+        self.timestamps.append(ts)
+
+
+class MessageIndex:
+    """
+    Global message id -> (chat_key, position) map, so a message can be
+    found without knowing (or scanning) its chat. Positions are list
+    indexes in the chat's history, which never shift: deletes are soft.
+
+    Kept on disk in a SQLite table (one row per message, looked up by
+    primary key), so memory doesn't grow with the number of messages.
+    add() only describes an entry ("log line"); write() stores a batch
+    in one transaction. If the table is missing it is rebuilt from the
+    shards; entries lost in a crash are repaired whenever their chat is
+    loaded.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.is_new = db.create_table(
+            "message_locations",
+            "CREATE TABLE message_locations (id TEXT PRIMARY KEY, chat_key TEXT NOT NULL, pos INTEGER NOT NULL) WITHOUT ROWID",
+            "CREATE INDEX idx_message_locations_chat ON message_locations(chat_key)"
+        )
+
+    def get(self, message_id):
+        """(chat_key, position) of a message, or None. Blocking (a query)."""
+        rows = self.db.query("SELECT chat_key, pos FROM message_locations WHERE id = ?", (message_id,))
+        return tuple(rows[0]) if rows else None
+
+    def add(self, message_id, chat_key, pos):
+        """Line recording where a message lives (None without an id)."""
+        if message_id is None:
+            return None
+        return (message_id, chat_key, pos)
+
+    def reconcile(self, chat_key, messages, base=0):
+        """Brings the entries of a freshly loaded chat up to date. Returns log lines."""
+        filed = dict(self.db.query("SELECT id, pos FROM message_locations WHERE chat_key = ?", (chat_key,)))
+        lines = []
+        for pos, msg in enumerate(messages, base):
+            message_id = msg.get("id")
+            if message_id is not None and filed.get(message_id) != pos:
+                lines.append((message_id, chat_key, pos))
+        return lines
+
+    def write(self, lines):
+        if not lines:
+            return True
+        import sqlite3
+        try:
+            with self.db.transaction() as cur:
+                cur.executemany("INSERT OR REPLACE INTO message_locations (id, chat_key, pos) VALUES (?, ?, ?)", lines)
+        except sqlite3.Error as e:
+            print(f"Error writing message index: {e}")
+            return False
+        return True
+
+    def rebuild(self, chats):
+        """Builds the index from (chat_key, messages) pairs, in one transaction. Returns the entry count."""
+        count = 0
+        with self.db.transaction() as cur:
+            cur.execute("DELETE FROM message_locations")
+            for chat_key, messages in chats:
+                lines = [(msg["id"], chat_key, pos) for pos, msg in enumerate(messages) if msg.get("id") is not None]
+                cur.executemany("INSERT OR REPLACE INTO message_locations (id, chat_key, pos) VALUES (?, ?, ?)", lines)
+                count += len(lines)
+        self.is_new = False
+        return count
+
+    def chat_keys(self):
+        """Every chat with at least one indexed message."""
+        return [chat_key for chat_key, in self.db.query("SELECT DISTINCT chat_key FROM message_locations")]
+
+
+class MessageStore:
+    """
+    Message history sharded into one log-backed file per chat key:
+
+        database/messages/<chat_key>.json      (snapshot: { chat_key: [...] })
+        database/messages/<chat_key>.json.log  (pending appends/updates)
+
+    A chat's history is loaded on first access and kept in an LRU cache
+    bounded by 'budget' bytes (measured as the JSON size on disk), so memory
+    scales with the active chats rather than with the whole archive.
+    Messages can also be looked up by id alone through the MessageIndex,
+    and by the words they contain through the MessageSearchIndex; both
+    live on disk (SQLite) and are queried, never loaded whole.
+
+    Messages beyond a chat's hot window (config.RETENTION_*) are moved
+    into the MessageArchive, so shards stay small however old a chat gets.
+    """
+    def __init__(self, directory, budget=MESSAGE_CACHE_BUDGET, legacy_path=None):
+        self.directory = directory
+        self.budget = budget
+        self.lock = threading.Lock()
+
+        # chat_key -> ChatHistory
+        self._cache = OrderedDict()
+        self.cached_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        if legacy_path:
+            self._migrate_legacy(legacy_path)
+        self.archive = self._open_archive()
+        self.index = self._open_index()
+        self.search = self._open_search()
+        # user_id -> ids of the users they have a private chat with (built on first use)
+        self._peers = None
+        # Bumped whenever a new private pair is seen or the pairs are forgotten
+        self.peers_version = 0
+
+    # ==========================================
+    # PUBLIC API
+    # ==========================================
+
+    def get_history(self, chat_key):
+        """Returns the (cached) list of hot messages for a chat, oldest first."""
+        return self._entry(chat_key).messages
+
+    def get_page(self, chat_key, before=None, after=None, limit=50):
+        """Returns (messages, has_more) for one page of a chat (see ChatHistory.page)."""
+        entry = self._entry(chat_key)
+        with self.lock:
+            return entry.page(before=before, after=after, limit=limit)
+
+    def append(self, chat_key, message):
+        """Persists a new message as a single log record (plus its index entry)."""
+        entry = self._entry(chat_key)
+        ok = entry.shard.append(chat_key, message)
+        self.write_index_lines(self.add_cached(entry, message))
+        return ok
+
+    def find(self, chat_key, message_id):
+        """Returns the message with 'message_id' in a chat, or None."""
+        entry = self._entry(chat_key)
+        with self.lock:
+            return entry.find(message_id)
+
+    def locate(self, message_id):
+        """(chat_key, position) of a message in any chat, or None."""
+        if self.index is None:
+            return None
+        return self.index.get(message_id)
+
+    def get_message(self, message_id):
+        """Returns (chat_key, message) for a message id, or (None, None)."""
+        located = self.locate(message_id)
+        if located is None:
+            return None, None
+        chat_key, pos = located
+        entry = self._entry(chat_key)
+        with self.lock:
+            msg = entry.at(message_id, pos)
+        return (chat_key, msg) if msg is not None else (None, None)
+
+    def update(self, chat_key, message_id, fields):
+        """Merges 'fields' into a stored message. Returns False if it doesn't exist."""
+        entry = self._entry(chat_key)
+        msg = entry.find(message_id)
+        if msg is None:
+            lines = self.update_archived(entry, message_id, fields)
+            if lines is None:
+                return False
+            self.write_index_lines(lines)
+            return True
+        entry.shard.update(chat_key, message_id, fields)
+        self.write_index_lines(self.update_cached(entry, msg, fields))
+        return True
+
+    def search_messages(self, query, chat_keys, limit, offset=0):
+        """
+        Returns (hits, has_more): one page of (chat_key, message) for the
+        messages containing every word of 'query', newest first, in the
+        chats listed in 'chat_keys' (see MessageSearchIndex.search).
+        """
+        hits, has_more = self.search.search(query, chat_keys, limit, offset=offset)
+        found = []
+        for chat_key, message_id in hits:
+            found_key, msg = self.get_message(message_id)
+            if found_key == chat_key and not msg.get("is_deleted"):
+                found.append((chat_key, msg))
+        return found, has_more
+
+    def apply_remote(self, op, chat_key, value, committed_after=None):
+        """
+        Brings the in-memory state (cached chat, private peers) up to date
+        with an "append" (value: message) or "update" (value: (message_id,
+        fields)) another process already persisted, indexes included.
+        Nothing is written.
+
+        Appends arrive in bus order, which need not be commit order. One
+        committed before a message already cached here drops the chat from
+        the cache, so it is read again in commit order. 'committed_after'
+        (see committed_after()) tells which messages came after it; without
+        it the message's timestamp is compared with the newest cached one.
+        """
+        with self.lock:
+            entry = self._cache.get(chat_key)
+        if op == "append":
+            if entry is None:
+                with self.lock:
+                    if self._peers is not None and self._add_peers(chat_key):
+                        self.peers_version += 1
+            elif entry.find(value.get("id")) is None:
+                # (Already there if the chat was loaded after the commit)
+                if committed_after is not None:
+                    late = any(message_id in entry.positions for message_id in committed_after)
+                else:
+                    late = bool(entry.timestamps) and normalize_timestamp(value.get("timestamp")) < entry.timestamps[-1]
+                if late:
+                    self._forget(entry)
+                else:
+                    self.add_cached(entry, value)
+        elif op == "update" and entry is not None:
+            message_id, fields = value
+            msg = entry.find(message_id)
+            if msg is not None:
+                self.update_cached(entry, msg, fields)
+
+    def committed_after(self, chat_key, message_id):
+        """
+        Ids of the messages committed to a chat after 'message_id', or None
+        if the backend doesn't record commit order (one process writes the
+        shards). Blocking (disk reads).
+        """
+        return None
+
+    def drop_cache(self):
+        """
+        Forgets every cached chat (and the private peers), so they are read
+        again from disk: changes other processes made may have been missed.
+        """
+        with self.lock:
+            self._cache.clear()
+            self.cached_bytes = 0
+            self._peers = None
+            self.peers_version += 1
+
+    # --- Cache primitives (used by the async facade) ---
+
+    def private_peers(self, user_id):
+        """Ids of the users 'user_id' has a private chat with."""
+        with self.lock:
+            if self._peers is None:
+                self._peers = {}
+                for chat_key in self._chat_keys():
+                    self._add_peers(chat_key)
+            return set(self._peers.get(user_id, ()))
+
+    def cached(self, chat_key):
+        """Returns the cached ChatHistory for a chat (marking it recently used), or None."""
+        with self.lock:
+            entry = self._cache.get(chat_key)
+            if entry is not None:
+                self._cache.move_to_end(chat_key)
+            return entry
+
+    def load(self, chat_key):
+        """
+        Reads a chat's shard from disk and caches it. Blocking; the disk read
+        happens outside the lock so other (cached) chats stay available.
+        """
+        shard = self._open_shard(chat_key)
+        messages = shard.read_json().get(chat_key, [])
+        archive = self._archive_of(chat_key, shard)
+        stale = archive.stale_prefix(messages) if archive else 0
+        if stale:
+            # A crash came between archiving these and trimming the shard
+            messages = messages[stale:]
+            shard.write_lines([shard.encode_trim(chat_key, stale)])
+        entry = ChatHistory(
+            chat_key, shard, messages, self._disk_size(shard),
+            archive=archive, locate=functools.partial(self._archived_position, chat_key)
+        )
+
+        with self.lock:
+            existing = self._cache.get(chat_key)
+            if existing is not None:
+                # Another thread loaded it first
+                return existing
+            self._cache[chat_key] = entry
+            self.cached_bytes += entry.size
+            self._evict()
+
+        # The indexes are queried outside the lock (they have their own)
+        index_lines = [(self.index, line) for line in self.index.reconcile(chat_key, messages, entry.base)] if self.index else []
+        index_lines += [(self.search, line) for line in self.search.reconcile(chat_key, messages)]
+        self.write_index_lines(index_lines)
+        return entry
+
+    def add_cached(self, entry, message):
+        """
+        Adds a message to a cached chat and the indexes. Persistence is the
+        caller's job: returns the (index, log line) pairs to write.
+        """
+        with self.lock:
+            entry.add(message)
+            self._grow(entry, message)
+            if self._peers is not None and self._add_peers(entry.chat_key):
+                self.peers_version += 1
+            lines = []
+            if self.index is not None:
+                lines.append((self.index, self.index.add(message.get("id"), entry.chat_key, entry.total - 1)))
+            lines.append((self.search, self.search.add(entry.chat_key, message)))
+            return [(index, line) for index, line in lines if line]
+
+    def update_cached(self, entry, message, fields):
+        """
+        Merges fields into a cached message and re-indexes its text if that
+        changed. Persistence is the caller's job: returns (index, log line) pairs.
+        """
+        with self.lock:
+            lines, _ = self._apply_update(entry.chat_key, message, fields, dict.update)
+            self._grow(entry, fields)
+            entry.revision += 1
+            return lines
+
+    def update_archived(self, entry, message_id, fields):
+        """
+        Merges fields into an archived message. Segments are immutable, so
+        the change is kept as an override in the archive catalog. Returns
+        (index, log line) pairs, or None if the message isn't archived here.
+        """
+        pos = self._archived_position(entry.chat_key, message_id)
+        if not entry.is_archived(pos):
+            return None
+        message = entry.archive.message_at(pos, message_id)
+        if message is None:
+            return None
+        with self.lock:
+            lines, catalog_line = self._apply_update(entry.chat_key, message, fields, entry.archive.override)
+            return lines + [(self.archive, catalog_line)]
+
+    def write_index_lines(self, index_lines):
+        """Persists (index, log line) pairs, one write per index."""
+        lines_by_index = {}
+        for index, line in index_lines:
+            lines_by_index.setdefault(index, []).append(line)
+        for index, lines in lines_by_index.items():
+            index.write(lines)
+
+    # --- Archiving (hot -> cold tier) ---
+
+    def due_for_archive(self, entry, now_ms=None):
+        """
+        Number of oldest hot messages that are outside the hot window (neither
+        among the newest RETENTION_HOT_MESSAGES nor younger than RETENTION_HOT_DAYS),
+        rounded down to whole segments.
+        """
+        if self.archive is None:
+            return 0
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        cutoff = now_ms - RETENTION_HOT_DAYS * 24 * 3600 * 1000
+        count = min(len(entry.messages) - RETENTION_HOT_MESSAGES, bisect_left(entry.timestamps, cutoff))
+        return count - count % ARCHIVE_SEGMENT_MESSAGES if count > 0 else 0
+
+    def plan_archive(self, entry, now_ms=None):
+        """
+        Picks the messages to archive and encodes them, one batch per segment
+        (on the caller's thread: cached messages may change afterwards).
+        Returns the plan for write_archive() / commit_archive(), or None.
+        """
+        with self.lock:
+            count = self.due_for_archive(entry, now_ms)
+            if not count:
+                return None
+            batches = []
+            for offset in range(0, count, ARCHIVE_SEGMENT_MESSAGES):
+                timestamps = entry.timestamps[offset:offset + ARCHIVE_SEGMENT_MESSAGES]
+                messages = entry.messages[offset:offset + ARCHIVE_SEGMENT_MESSAGES]
+                batches.append((entry.base + offset, timestamps, MessageArchive.encode_messages(messages)))
+            return {
+                "count": count,
+                "base": entry.base,
+                "revision": entry.revision,
+                "last_id": entry.messages[count - 1].get("id"),
+                "batches": batches
+            }
+
+    def write_archive(self, entry, plan):
+        """Writes a plan's segment files (blocking; not visible yet). Returns the Segments, or None."""
+        shard_name = os.path.basename(entry.shard.filepath)[:-len(".json")]
+        segments = []
+        for first_pos, timestamps, payload in plan["batches"]:
+            segment = self.archive.write_segment(shard_name, first_pos, timestamps, payload)
+            if segment is None:
+                for written in segments:
+                    self.archive.remove_segment_file(written)
+                return None
+            segments.append(segment)
+        return segments
+
+    def commit_archive(self, entry, plan, segments):
+        """
+        Publishes written segments and drops their messages from the cached
+        chat. Returns the (index, log line) pairs for the archive catalog, or
+        None if the chat changed since the plan (the segments are discarded).
+        """
+        with self.lock:
+            current = (
+                self._cache.get(entry.chat_key) is entry
+                and entry.base == plan["base"] and entry.revision == plan["revision"]
+            )
+            if current:
+                for segment in segments:
+                    line = self.archive.add_segment(entry.chat_key, segment, plan["last_id"])
+                entry.archive = self.archive.get(entry.chat_key)
+                removed = entry.size * plan["count"] // max(1, len(entry.messages))
+                entry.trim(plan["count"])
+                entry.size -= removed
+                self.cached_bytes -= removed
+                return [(self.archive, line)]
+        for segment in segments:
+            self.archive.remove_segment_file(segment)
+        return None
+
+    def archive_chat(self, chat_key, now_ms=None):
+        """Moves a chat's messages beyond the hot window into the archive. Returns how many."""
+        entry = self._entry(chat_key)
+        plan = self.plan_archive(entry, now_ms)
+        segments = self.write_archive(entry, plan) if plan else None
+        lines = self.commit_archive(entry, plan, segments) if segments else None
+        if lines is None:
+            return 0
+        # Catalog first: if the trim is lost in a crash, load() drops the copies
+        self.write_index_lines(lines)
+        entry.shard.write_lines([entry.shard.encode_trim(chat_key, plan["count"])])
+        return plan["count"]
+
+    # ==========================================
+    # INTERNAL LOGIC
+    # ==========================================
+
+    def _apply_update(self, chat_key, message, fields, apply):
+        """
+        Runs apply(message, fields), re-filing the message in the search index
+        if its text changed (caller holds the lock). Returns (lines, apply's result).
+        """
+        reindex = any(field in fields for field in SEARCHABLE_FIELDS)
+        lines = [self.search.remove(chat_key, message)] if reindex else []
+        result = apply(message, fields)
+        if reindex:
+            lines.append(self.search.add(chat_key, message))
+        return [(self.search, line) for line in lines if line], result
+
+    def _archived_position(self, chat_key, message_id):
+        """Position of a message in 'chat_key' per the message index, or None."""
+        # No lock: called from ChatHistory while the caller holds it
+        located = self.index.get(message_id) if self.index else None
+        return located[1] if located and located[0] == chat_key else None
+
+    def _chat_keys(self):
+        return self.index.chat_keys() if self.index is not None else []
+
+    def _add_peers(self, chat_key):
+        # Caller holds the lock
+        members = private_members(chat_key)
+        if members:
+            a, b = members
+            peers = self._peers.setdefault(a, set())
+            if b not in peers:
+                peers.add(b)
+                self._peers.setdefault(b, set()).add(a)
+                return True
+        return False
+
+    def _open_archive(self):
+        return MessageArchive(self.directory)
+
+    def _archive_of(self, chat_key, shard):
+        """The cold part of a chat, read on demand (a ChatArchive), or None."""
+        return self.archive.get(chat_key) if self.archive else None
+
+    def _open_index(self):
+        index = MessageIndex(self._index_database(INDEX_FILE))
+        if index.is_new:
+            # First start with an index: one pass over the existing shards
+            count = index.rebuild(self._scan_shards())
+            logging.info(f"Built message index for {self.directory} ({count} messages)")
+            self._drop_legacy_indexes()
+        return index
+
+    def _open_search(self):
+        search = MessageSearchIndex(self._index_database(SEARCH_FILE))
+        if search.is_new:
+            search.rebuild(self._scan_shards())
+            logging.info(f"Built message search index for {self.directory}")
+            self._drop_legacy_indexes()
+        return search
+
+    def _index_database(self, name):
+        # Imported here: the JSON backend only needs SQLite for its indexes
+        from chat_server.utils.sqlite_backend import SQLiteDatabase
+        return SQLiteDatabase(os.path.join(self.directory, name), records=False)
+
+    def _drop_legacy_indexes(self):
+        for name in LEGACY_INDEX_FILES:
+            for path in (os.path.join(self.directory, name), os.path.join(self.directory, name + ".log")):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _scan_shards(self):
+        for path in list_shards(self.directory):
+            for chat_key, messages in LogFileIO(path).read_json().items():
+                yield chat_key, self.archive.history(chat_key, messages)
+
+    def _open_shard(self, chat_key):
+        return LogFileIO(self._shard_path(chat_key))
+
+    def _shard_path(self, chat_key):
+        name = chat_key if SAFE_KEY.match(chat_key) else "h_" + hashlib.sha1(chat_key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _entry(self, chat_key):
+        """Returns the cache entry for a chat, loading its shard on a miss."""
+        return self.cached(chat_key) or self.load(chat_key)
+
+    def _grow(self, entry, record):
+        # Rough size accounting: a record costs about what its JSON costs on disk
+        added = len(repr(record))
+        entry.size += added
+        self.cached_bytes += added
+        self._evict()
+
+    def _forget(self, entry):
+        """Drops one chat from the cache (it is loaded again on next use)."""
+        with self.lock:
+            if self._cache.get(entry.chat_key) is entry:
+                del self._cache[entry.chat_key]
+                self.cached_bytes -= entry.size
+
+    def _evict(self):
+        """Drops least recently used chats until the cache fits the budget."""
+        while self.cached_bytes > self.budget and len(self._cache) > 1:
+            chat_key, entry = self._cache.popitem(last=False)
+            self.cached_bytes -= entry.size
+            logging.debug(f"Evicted chat history {chat_key} from cache")
+
+    @staticmethod
+    def _disk_size(shard):
+        size = 0
+        for path in (shard.filepath, shard.log_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _migrate_legacy(self, legacy_path):
+        """
+        One-time split of the old single messages.json into per-chat shards.
+        Safe to run again after an interruption: messages a shard already
+        holds (by id) are not added twice.
+        """
+        legacy = LogFileIO(legacy_path)
+        if not os.path.exists(legacy.filepath) and not os.path.exists(legacy.log_path):
+            return
+
+        messages_db = legacy.read_json()
+        for chat_key, messages in messages_db.items():
+            shard = LogFileIO(self._shard_path(chat_key))
+            existing = shard.read_json().get(chat_key, [])
+            known = {msg.get("id") for msg in existing}
+            missing = [
+                msg for msg in messages
+                if msg.get("id") not in known or (msg.get("id") is None and msg not in existing)
+            ]
+            if missing:
+                shard.write_json({chat_key: existing + missing})
+
+        for path in (legacy.filepath, legacy.log_path):
+            if os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+        logging.info(f"Migrated {len(messages_db)} chats from {legacy_path} into {self.directory}")
@@ -0,0 +1,208 @@
+"""
+One-shot import of the JSON databases into SQLite.
+
+    python -m chat_server.utils.migrate_to_sqlite [--db PATH] [--force]
+
+JSON files are streamed record by record (one user / group / chat at a time),
+so memory stays flat no matter how large the JSON files are. The target
+tables must be empty unless --force is given, which clears them first.
+Afterwards set STORAGE_BACKEND = "sqlite" in config.py.
+"""
+import os
+import sys
+import json
+import argparse
+from chat_server.config import SQLITE_DB, SQLITE_TABLES, MESSAGES_DB, MESSAGES_DIR, ensure_dirs
+from chat_server.utils import codec
+from chat_server.utils.file_io import FileIO, LogFileIO
+from chat_server.utils.message_store import normalize_timestamp, list_shards
+from chat_server.utils.message_archive import MessageArchive
+from chat_server.utils.sqlite_backend import SQLiteDatabase, TABLES
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+
+
+def iter_json_object(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields (key, value) for each member of the top-level JSON object in
+    'path' without loading the whole file. Only one value is buffered at
+    a time. An empty or missing file yields nothing.
+    """
+    if not os.path.exists(path):
+        return
+    decoder = json.JSONDecoder()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            # Drop what has been consumed so the buffer only holds the current value
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip(chars=" \t\r\n"):
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def expect(char):
+            nonlocal pos
+            skip()
+            if pos >= len(buf) or buf[pos] != char:
+                raise ValueError(f"{path}: expected '{char}' at offset {pos}")
+            pos += 1
+
+        def decode():
+            nonlocal pos
+            skip()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # A number cut at the buffer edge still parses; make sure it ended
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        skip()
+        if pos >= len(buf):
+            return
+        expect("{")
+        while True:
+            skip(" \t\r\n,")
+            if pos < len(buf) and buf[pos] == "}":
+                return
+            key = decode()
+            expect(":")
+            yield key, decode()
+
+
+def _records(path):
+    """(key, value) pairs of a database file: streamed if JSON, loaded if written as msgpack."""
+    if not os.path.exists(path):
+        return iter(())
+    with open(path, 'rb') as f:
+        head = f.read(CHUNK_SIZE)
+    if not head.strip() or codec.is_json(head):
+        return iter_json_object(path)
+    return iter(FileIO(path).read_json().items())
+
+
+def _batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _table_rows(path, table):
+    columns = TABLES[table]
+    for key, record in _records(path):
+        values = tuple(record.get(col) if isinstance(record, dict) else None for col in columns)
+        yield (key, *values, codec.dumps(record))
+
+
+def _message_rows(chat_key, messages):
+    for msg in messages:
+        yield (
+            chat_key, msg.get("id"), normalize_timestamp(msg.get("timestamp")),
+            codec.dumps(msg)
+        )
+
+
+def _chats(messages_dir, legacy_path):
+    """Yields (chat_key, messages): per-chat shards (with their archive) first, then the legacy single file."""
+    archive = MessageArchive(messages_dir)
+    for path in list_shards(messages_dir):
+        # Shards are small (one chat) and may have a pending log to replay
+        for chat_key, messages in LogFileIO(path).read_json().items():
+            # Archived (older) messages come first
+            yield chat_key, archive.history(chat_key, messages)
+
+    legacy = LogFileIO(legacy_path)
+    if os.path.exists(legacy.log_path) and os.path.getsize(legacy.log_path):
+        # Fold pending records in so the snapshot can be streamed
+        legacy.compact()
+    yield from _records(legacy_path)
+
+
+def migrate(db_path=SQLITE_DB, tables=SQLITE_TABLES, messages_dir=MESSAGES_DIR,
+            legacy_messages=MESSAGES_DB, force=False, log=print):
+    """Copies every JSON database into SQLite. Returns { table: rows imported }."""
+    db = SQLiteDatabase(db_path, durability="os")
+    targets = list(tables.values()) + ["messages"]
+    try:
+        non_empty = [t for t in targets if db.query(f"SELECT 1 FROM {t} LIMIT 1")]
+        if non_empty and not force:
+            raise RuntimeError(f"Tables already contain data: {', '.join(non_empty)} (use --force to replace)")
+        with db.transaction() as cur:
+            for table in targets:
+                cur.execute(f"DELETE FROM {table}")
+            # The message search index is rebuilt from the new rows on the next start
+            cur.execute("DROP TABLE IF EXISTS message_terms")
+
+        counts = {}
+        for path, table in tables.items():
+            columns = TABLES[table]
+            cols = "".join(f", {col}" for col in columns)
+            marks = ", ?" * len(columns)
+            counts[table] = 0
+            for batch in _batches(_table_rows(path, table)):
+                with db.transaction() as cur:
+                    cur.executemany(f"INSERT OR REPLACE INTO {table} (id{cols}, data) VALUES (?{marks}, ?)", batch)
+                counts[table] += len(batch)
+            log(f"{table}: {counts[table]} rows from {path}")
+
+        counts["messages"] = 0
+        for chat_key, messages in _chats(messages_dir, legacy_messages):
+            for batch in _batches(_message_rows(chat_key, messages)):
+                with db.transaction() as cur:
+                    cur.executemany(
+                        "INSERT INTO messages (chat_key, id, timestamp, data) VALUES (?, ?, ?, ?)", batch
+                    )
+                counts["messages"] += len(batch)
+        log(f"messages: {counts['messages']} rows")
+
+        # Import ran unsynced; make it durable in one go
+        db.query("PRAGMA synchronous=FULL")
+        db.query("PRAGMA wal_checkpoint(TRUNCATE)")
+        return counts
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import the JSON databases into SQLite.")
+    parser.add_argument("--db", default=SQLITE_DB, help="Target SQLite file")
+    parser.add_argument("--force", action="store_true", help="Replace data already in the target tables")
+    args = parser.parse_args(argv)
+
+    ensure_dirs()
+    try:
+        migrate(args.db, force=args.force)
+    except (RuntimeError, ValueError, json.JSONDecodeError) as e:
+        print(f"Migration failed: {e}")
+        return 1
+    print(f"Done. Set STORAGE_BACKEND = \"sqlite\" in config.py to use {args.db}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
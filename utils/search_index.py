@@ -0,0 +1,269 @@
+import heapq
+from collections import Counter
+from itertools import islice
+from bisect import bisect_left, insort
+from chat_server.config import SEARCH_FUZZY_MIN_SIMILARITY, SEARCH_FUZZY_MAX_POSTING, SEARCH_FUZZY_RESCORE
+from chat_server.utils.indexes import IndexSpec
+
+
+def normalize(text):
+    return text.strip().casefold() if isinstance(text, str) else ""
+
+
+def trigrams(term):
+    """Trigrams of a term with start/end markers ('ali' -> ^al, ali, li$)."""
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def field_terms(*fields):
+    """extract() for a search index: the normalized values of 'fields'."""
+    def extract(record):
+        if not isinstance(record, dict):
+            return ()
+        terms = (normalize(record.get(field)) for field in fields)
+        return tuple(dict.fromkeys(t for t in terms if t))
+    return extract
+
+
+class _Terms:
+    """term -> record keys (insertion ordered), with reference counting."""
+    def __init__(self):
+        self.keys_by_term = {}
+
+    def add(self, term, key):
+        """Files 'key' under 'term'; True if the term is new."""
+        keys = self.keys_by_term.get(term)
+        if keys is None:
+            self.keys_by_term[term] = {key: None}
+            return True
+        keys[key] = None
+        return False
+
+    def remove(self, term, key):
+        """Unfiles 'key'; True if no record uses 'term' any more."""
+        keys = self.keys_by_term.get(term)
+        if keys is None:
+            return False
+        keys.pop(key, None)
+        if not keys:
+            del self.keys_by_term[term]
+            return True
+        return False
+
+    def get(self, term):
+        return self.keys_by_term.get(term, ())
+
+
+class TextSearchIndex:
+    """
+    Type-ahead search over short names, maintained like a SecondaryIndex
+    (rebuild / update / sync), so AsyncStore keeps it current on writes.
+
+    Prefix matches: the distinct terms are kept in one sorted list per
+    length. A query walks the lists from its own length upwards, so exact
+    matches come first, then shorter completions, then alphabetical order,
+    and it stops as soon as the page is full.
+
+    Approximate matches: a trigram -> terms postings map over the
+    'fuzzy' fields. The query's rarest trigrams are read first, up to
+    SEARCH_FUZZY_MAX_POSTING terms in all (common trigrams carry almost
+    no signal), which bounds the work per query; the best candidates are
+    then ranked by Dice similarity.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self.generation = None
+        self._clear()
+
+    def _clear(self):
+        self.prefix = _Terms()
+        self.fuzzy = _Terms()
+        # length -> sorted distinct terms of that length
+        self.by_length = {}
+        # trigram -> set of fuzzy terms
+        self.grams = {}
+        # key -> (prefix terms, fuzzy terms) it is filed under
+        self.terms_by_key = {}
+
+    # ==========================================
+    # MAINTENANCE
+    # ==========================================
+
+    def rebuild(self, data, generation):
+        """
+        Files every record of 'data'. Safe on a worker thread while the
+        event loop keeps writing: it walks a snapshot of the items, and
+        AsyncStore re-files the keys written in the meantime.
+        """
+        self._clear()
+        for key, record in list(data.items()):
+            terms = self._terms(record)
+            if not (terms[0] or terms[1]):
+                continue
+            self.terms_by_key[key] = terms
+            for term in terms[0]:
+                if self.prefix.add(term, key):
+                    # Sorted once at the end instead of insort() per term
+                    self.by_length.setdefault(len(term), []).append(term)
+            for term in terms[1]:
+                if self.fuzzy.add(term, key):
+                    for gram in trigrams(term):
+                        self.grams.setdefault(gram, set()).add(term)
+        for terms in self.by_length.values():
+            terms.sort()
+        self.generation = generation
+
+    def changes(self, data):
+        """
+        Keys whose terms in 'data' differ from what they are filed under
+        (including removed ones). Only reads the index, so it can run on a
+        worker thread while queries are served from it.
+        """
+        filed = self.terms_by_key
+        changed = [key for key, record in list(data.items()) if self._terms(record) != filed.get(key, ((), ()))]
+        changed.extend(key for key in list(filed) if key not in data)
+        return changed
+
+    def _terms(self, record):
+        if record is None:
+            return ((), ())
+        return (tuple(self.spec.extract(record)), tuple(self.spec.fuzzy_extract(record)))
+
+    def update(self, key, record):
+        """Re-files one record (None = removed)."""
+        new = self._terms(record)
+        old = self.terms_by_key.get(key, ((), ()))
+        if new == old:
+            return
+
+        for term in old[0]:
+            if term not in new[0] and self.prefix.remove(term, key):
+                self._drop_sorted(term)
+        for term in new[0]:
+            if self.prefix.add(term, key):
+                insort(self.by_length.setdefault(len(term), []), term)
+
+        for term in old[1]:
+            if term not in new[1] and self.fuzzy.remove(term, key):
+                for gram in trigrams(term):
+                    terms = self.grams.get(gram)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self.grams[gram]
+        for term in new[1]:
+            if self.fuzzy.add(term, key):
+                for gram in trigrams(term):
+                    self.grams.setdefault(gram, set()).add(term)
+
+        if new[0] or new[1]:
+            self.terms_by_key[key] = new
+        else:
+            self.terms_by_key.pop(key, None)
+
+    def sync(self, data):
+        """Re-files every record and drops the ones that are gone (full diff)."""
+        for key, record in data.items():
+            self.update(key, record)
+        for key in [k for k in self.terms_by_key if k not in data]:
+            self.update(key, None)
+
+    def _drop_sorted(self, term):
+        terms = self.by_length.get(len(term))
+        if terms is None:
+            return
+        i = bisect_left(terms, term)
+        if i < len(terms) and terms[i] == term:
+            del terms[i]
+        if not terms:
+            del self.by_length[len(term)]
+
+    # ==========================================
+    # QUERIES
+    # ==========================================
+
+    def search(self, query, limit, offset=0, fuzzy=True):
+        """
+        Returns (keys, has_more): one page of record keys, prefix matches
+        first, then approximate matches (if 'fuzzy') not already listed.
+        """
+        query = normalize(query)
+        wanted = offset + limit + 1
+        found = {}
+        if query:
+            self._prefix_matches(query, found, wanted)
+            if fuzzy and len(found) < wanted:
+                self._fuzzy_matches(query, found, wanted)
+        keys = list(found)
+        return keys[offset:offset + limit], len(keys) > offset + limit
+
+    def _collect(self, terms, index, found, wanted):
+        """Adds the keys of 'terms' to 'found'; True once 'wanted' is reached."""
+        for term in terms:
+            for key in index.get(term):
+                found.setdefault(key, None)
+                if len(found) >= wanted:
+                    return True
+        return False
+
+    def _prefix_matches(self, query, found, wanted):
+        for length in sorted(l for l in self.by_length if l >= len(query)):
+            terms = self.by_length[length]
+            i = bisect_left(terms, query)
+            matches = []
+            while i < len(terms) and terms[i].startswith(query):
+                matches.append(terms[i])
+                i += 1
+                # A page needs at most 'wanted' terms from one length
+                if len(matches) >= wanted:
+                    break
+            if self._collect(matches, self.prefix, found, wanted):
+                return
+
+    def _fuzzy_matches(self, query, found, wanted):
+        grams = trigrams(query)
+        # Rarest trigrams first, they carry the most signal; reading stops
+        # once SEARCH_FUZZY_MAX_POSTING terms were counted
+        budget = SEARCH_FUZZY_MAX_POSTING
+        shared = Counter()
+        for terms in sorted((self.grams.get(g, ()) for g in grams), key=len):
+            size = len(terms)
+            if size > budget:
+                if shared:
+                    break
+                # Every trigram is common: sample the rarest one
+                terms = islice(terms, budget)
+            shared.update(terms)
+            budget -= min(size, budget)
+
+        # The counts only cover the postings read: re-count the terms that
+        # shared the most of them against every trigram of the query
+        candidates = {term for term, _ in shared.most_common(wanted * SEARCH_FUZZY_RESCORE)}
+        counts = Counter()
+        for gram in grams:
+            counts.update(candidates.intersection(self.grams.get(gram, ())))
+
+        scored = []
+        for term, count in counts.items():
+            # Dice coefficient; a term of length n has n trigrams (with markers)
+            score = 2 * count / (len(grams) + len(term))
+            if score >= SEARCH_FUZZY_MIN_SIMILARITY:
+                scored.append((-score, abs(len(term) - len(query)), term))
+        # Each term yields at least one key, so 'wanted' terms are enough
+        best = heapq.nsmallest(wanted, scored)
+        self._collect((t for _, _, t in best), self.fuzzy, found, wanted)
+
+
+class SearchSpec(IndexSpec):
+    """
+    A TextSearchIndex over 'fields' (prefix matching); the subset in
+    'fuzzy_fields' is also matched approximately.
+    """
+    def __init__(self, name, fields, fuzzy_fields=()):
+        super().__init__(name, field_terms(*fields), index_class=TextSearchIndex)
+        self.fuzzy_extract = field_terms(*fuzzy_fields)
+
+
+# Handles are "name#tag"; the tag is noise for approximate matching
+USER_SEARCH = SearchSpec("user_search", fields=("username", "handle"), fuzzy_fields=("username",))
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from chat_server.config import DB_DIR, BACKUP_DIR, SNAPSHOT_INTERVAL, SNAPSHOT_RETENTION
+from chat_server.utils.async_store import run_io
+from chat_server.utils.file_io import file_lock
+
+MANIFEST = "manifest.json"
+# First bytes of every SQLite database file, and the files that go with one
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_COMPANIONS = ("-wal", "-shm", "-journal")
+
+
+class SnapshotService:
+    """
+    Takes periodic point-in-time copies of the database directory.
+
+    Snapshots live in '<BACKUP_DIR>/snapshots/<timestamp>/' and mirror the
+    layout of DB_DIR. Files that haven't changed since the previous snapshot
+    are hard-linked to it instead of copied, so an idle database costs
+    almost nothing per snapshot. Only the newest 'retention' snapshots are kept.
+
+    SQLite databases (STORAGE_BACKEND = "sqlite") are not copied as files:
+    the database and its -wal file change independently, so a file copy can
+    be torn. They are copied with SQLite's online backup instead, which
+    yields one consistent database file (the -wal/-shm files are skipped).
+
+    A log-structured file ('x.json' plus 'x.json.log', see LogFileIO) is
+    copied under the file's lock, so a compaction can't fold the log into
+    the snapshot between the two copies.
+
+    Each snapshot has a manifest.json: { relative_path: [mtime_ns, size, sha1] }
+    """
+    def __init__(self, source_dir=DB_DIR, backup_dir=BACKUP_DIR,
+                 interval=SNAPSHOT_INTERVAL, retention=SNAPSHOT_RETENTION):
+        self.source_dir = source_dir
+        self.snapshot_dir = os.path.join(backup_dir, "snapshots")
+        self.interval = interval
+        self.retention = retention
+        self._task = None
+
+    # ==========================================
+    # SCHEDULER
+    # ==========================================
+
+    def start(self):
+        """Starts the background loop on the running event loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Snapshots every 'interval' seconds; disk work runs on the I/O executor."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_io(self.take_snapshot)
+            except Exception as e:
+                logging.error(f"Snapshot failed: {e}")
+
+    # ==========================================
+    # SNAPSHOTS
+    # ==========================================
+
+    def take_snapshot(self):
+        """Creates one snapshot and applies retention. Returns its directory."""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        previous = self.list_snapshots()
+        prev_dir = previous[-1] if previous else None
+        prev_manifest = self._read_manifest(prev_dir) if prev_dir else {}
+
+        target = self._new_snapshot_path()
+        tmp_target = target + ".partial"
+        manifest = {}
+        copied = linked = 0
+        os.makedirs(tmp_target)
+
+        files = list(self._source_files())
+        listed = set(files)
+        for rel_path in files:
+            if rel_path.endswith(".log"):
+                base = rel_path[:-len(".log")]
+                if base in listed:
+                    # Copied along with its snapshot
+                    continue
+                # The snapshot may appear (a first compaction) while the log is copied
+                group = (base, rel_path)
+            elif rel_path + ".log" in listed:
+                group = (rel_path, rel_path + ".log")
+            else:
+                group = (rel_path,)
+
+            if len(group) > 1:
+                with file_lock(os.path.join(self.source_dir, group[0])):
+                    outcomes = [self._snapshot_file(path, tmp_target, prev_dir, prev_manifest, manifest) for path in group]
+            else:
+                outcomes = [self._snapshot_file(rel_path, tmp_target, prev_dir, prev_manifest, manifest)]
+            copied += outcomes.count("copied")
+            linked += outcomes.count("linked")
+
+        with open(os.path.join(tmp_target, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        # Only complete snapshots get a final name
+        os.replace(tmp_target, target)
+
+        logging.info(f"Snapshot {os.path.basename(target)}: {copied} copied, {linked} unchanged")
+        self._prune()
+        return target
+
+    def list_snapshots(self):
+        """Complete snapshot directories, oldest first."""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.snapshot_dir)
+            if not name.endswith(".partial") and os.path.exists(os.path.join(self.snapshot_dir, name, MANIFEST))
+        )
+        return [os.path.join(self.snapshot_dir, name) for name in names]
+
+    # ==========================================
+    # INTERNAL LOGIC
+    # ==========================================
+
+    def _snapshot_file(self, rel_path, tmp_target, prev_dir, prev_manifest, manifest):
+        """
+        Copies (or hard-links) one file into the snapshot being built and
+        records it in 'manifest'. Returns "copied", "linked" or None if the
+        file is gone.
+        """
+        src = os.path.join(self.source_dir, rel_path)
+        dst = os.path.join(tmp_target, rel_path)
+        try:
+            st = os.stat(src)
+        except OSError:
+            # Removed (or renamed by an atomic write) since listing
+            return None
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+        # A database's own stamp misses commits still in its -wal file
+        copy = self._backup_sqlite if self._is_sqlite(src) else self._copy
+        prev = prev_manifest.get(rel_path)
+        prev_file = os.path.join(prev_dir, rel_path) if prev else None
+        if (prev and copy is self._copy and [st.st_mtime_ns, st.st_size] == prev[:2]
+                and self._link(prev_file, dst)):
+            manifest[rel_path] = prev
+            return "linked"
+
+        # Stamp changed; the content may still be identical (e.g. rewritten with the same data)
+        digest = copy(src, dst)
+        if digest is None:
+            return None
+        manifest[rel_path] = [st.st_mtime_ns, st.st_size, digest]
+        if prev and prev[2] == digest:
+            os.remove(dst)
+            if self._link(prev_file, dst):
+                return "linked"
+            copy(src, dst)
+        return "copied"
+
+    def _source_files(self):
+        """Relative paths of every database file, skipping the backups themselves."""
+        backup_root = os.path.abspath(os.path.dirname(self.snapshot_dir))
+        for root, dirs, files in os.walk(self.source_dir):
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != backup_root]
+            for name in files:
+                if name.endswith((".tmp", ".migrated") + SQLITE_COMPANIONS):
+                    continue
+                yield os.path.relpath(os.path.join(root, name), self.source_dir)
+
+    def _new_snapshot_path(self):
+        # Names sort chronologically; microseconds keep back-to-back snapshots apart
+        while True:
+            path = os.path.join(self.snapshot_dir, datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+            if not os.path.exists(path) and not os.path.exists(path + ".partial"):
+                return path
+
+    @staticmethod
+    def _is_sqlite(path):
+        if path.endswith((".json", ".log")):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+        except OSError:
+            return False
+
+    @staticmethod
+    def _backup_sqlite(src, dst):
+        """Online backup of a SQLite database (consistent, WAL included); sha1 of the copy, or None."""
+        import sqlite3
+        try:
+            source = sqlite3.connect(src)
+            try:
+                target = sqlite3.connect(dst)
+                try:
+                    source.backup(target)
+                    # A standalone file: no -wal next to the snapshot
+                    target.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    target.close()
+            finally:
+                source.close()
+        except sqlite3.Error as e:
+            logging.error(f"Backup of {src} failed: {e}")
+            return None
+        sha1 = hashlib.sha1()
+        with open(dst, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _link(src, dst):
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            # Missing source or a filesystem without hard links
+            return False
+
+    @staticmethod
+    def _copy(src, dst):
+        """Copies src to dst and returns the sha1 of what was copied (None if src vanished)."""
+        sha1 = hashlib.sha1()
+        try:
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                for chunk in iter(lambda: fin.read(1024 * 1024), b""):
+                    sha1.update(chunk)
+                    fout.write(chunk)
+            shutil.copystat(src, dst)
+        except FileNotFoundError:
+            return None
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _read_manifest(snapshot):
+        try:
+            with open(os.path.join(snapshot, MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _prune(self):
+        """Removes the oldest snapshots beyond the retention count (and leftover partials)."""
+        for name in os.listdir(self.snapshot_dir):
+            path = os.path.join(self.snapshot_dir, name)
+            if name.endswith(".partial") and time.time() - os.path.getmtime(path) > self.interval:
+                shutil.rmtree(path, ignore_errors=True)
+
+        snapshots = self.list_snapshots()
+        for path in snapshots[:max(0, len(snapshots) - self.retention)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+# Singleton Instance
+snapshot_service = SnapshotService()
@@ -0,0 +1,525 @@
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from chat_server.utils import codec
+from chat_server.utils.file_io import durability_for, DURABILITY_ALWAYS, DURABILITY_OS
+from chat_server.utils.message_store import MessageStore, normalize_timestamp
+from chat_server.config import MESSAGE_CACHE_BUDGET, RETENTION_HOT_MESSAGES, SQLITE_CHANGE_LOG_KEEP
+
+# Record tables: name -> indexed fields (copied out of each record into their own column)
+TABLES = {
+    "users": ("handle", "username"),
+    "groups": ("join_code",),
+    "media_refs": (),
+}
+
+_MISSING = object()
+
+
+def merge_records(base, theirs, ours):
+    """
+    Three-way merge of two concurrent edits of one record: whatever only
+    'ours' changed since 'base' takes our value, everything else keeps
+    theirs. Nested dicts (e.g. a group's 'members') merge the same way, so
+    two workers adding different members to one group both get in. Where
+    both changed the same field, ours wins. _MISSING stands for "absent".
+    """
+    if ours == base:
+        return theirs
+    if theirs == base:
+        return ours
+    if not (isinstance(base, dict) and isinstance(theirs, dict) and isinstance(ours, dict)):
+        return ours
+    merged = {}
+    for key in dict.fromkeys([*theirs, *ours, *base]):
+        value = merge_records(base.get(key, _MISSING), theirs.get(key, _MISSING), ours.get(key, _MISSING))
+        if value is not _MISSING:
+            merged[key] = value
+    return merged
+
+
+class SQLiteDatabase:
+    """
+    One SQLite file in WAL mode, shared by every table store.
+
+    A single connection is used from the I/O executor threads, serialized
+    by 'lock'. With WAL, readers in other processes (backups, the migration
+    tool) never block the server's writes. The fsync behaviour follows the
+    durability mode configured for the file (see config.DURABILITY).
+
+    With 'records' False only the file is set up: the message indexes of
+    the JSON backend keep their tables in a database of their own.
+    """
+    SYNCHRONOUS = {DURABILITY_ALWAYS: "FULL", DURABILITY_OS: "OFF"}
+
+    def __init__(self, path, durability=None, records=True):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+        mode = durability or durability_for(path)[1]
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # 'batch' -> NORMAL: in WAL mode commits are synced at checkpoints
+        self.conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS.get(mode, 'NORMAL')}")
+        if records:
+            self._create_schema()
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """
+        Yields a cursor inside BEGIN IMMEDIATE ... COMMIT (rolled back on
+        error). With 'immediate' False it is a read snapshot that doesn't
+        take the write lock.
+        """
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+    def create_table(self, name, *statements):
+        """Runs the CREATE statements of table 'name' unless it exists. True if it was created."""
+        with self.transaction() as cur:
+            if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone():
+                return False
+            for sql in statements:
+                cur.execute(sql)
+            return True
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _create_schema(self):
+        with self.transaction() as cur:
+            for table, columns in TABLES.items():
+                extra = "".join(f", {col} TEXT" for col in columns)
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY{extra}, data TEXT NOT NULL)")
+                for col in columns:
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col} ON {table}({col})")
+
+            # Which record each commit touched, so other processes re-read only those (see SQLiteTableIO)
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS record_changes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, id TEXT NOT NULL)"
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_record_changes_tbl ON record_changes(tbl, seq)")
+
+            # 'seq' keeps insertion order, which is the order of a chat's history
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, chat_key TEXT NOT NULL, "
+                "id TEXT, timestamp REAL, data TEXT NOT NULL)"
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages(chat_key, timestamp)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages(chat_key, seq)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_id ON messages(id)")
+
+
+class SQLiteTableIO:
+    """
+    FileIO-compatible store for one record table ({ id: record }).
+
+    read_json()/write_json() keep the whole-dict contract the handlers use,
+    but a write only touches the rows whose JSON actually changed (and
+    deletes the ones that disappeared), in a single transaction.
+
+    Every write also logs the ids it touched in 'record_changes', so the
+    other worker processes sharing the file re-read only those records
+    (read_changes()) instead of the whole table.
+
+    write_records() writes only the given records. A record another
+    process changed since the version ours was based on is merged with
+    theirs (merge_records) instead of overwriting it.
+    """
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.columns = TABLES[table]
+        self.filepath = db.path
+        self.lock = threading.Lock()
+        # id -> JSON text as last read/written, to find changed rows
+        self._written = None
+        # Last change log entry reflected in what was read
+        self._seen = 0
+
+    def read_json(self):
+        with self.lock:
+            # One snapshot: the rows and the change log position they match
+            with self.db.transaction(immediate=False) as cur:
+                self._seen = self._last_change(cur)
+                rows = cur.execute(f"SELECT id, data FROM {self.table}").fetchall()
+            self._written = dict(rows)
+            return {key: codec.loads(text) for key, text in rows}
+
+    def read_changes(self):
+        """
+        Records other connections changed since the last read:
+        { id: (record, or None if deleted; JSON text it replaces) }, empty if
+        nothing changed. None if the change log no longer reaches back that
+        far (read_json() again).
+        """
+        with self.lock:
+            with self.db.transaction(immediate=False) as cur:
+                last = self._last_change(cur)
+                if last == self._seen:
+                    return {}
+                first = cur.execute("SELECT MIN(seq) FROM record_changes").fetchone()[0]
+                if self._written is None or first is None or first > self._seen + 1:
+                    return None
+                rows = cur.execute(
+                    f"SELECT c.id, t.data FROM (SELECT DISTINCT id FROM record_changes WHERE tbl = ? AND seq > ?) c "
+                    f"LEFT JOIN {self.table} t ON t.id = c.id",
+                    (self.table, self._seen)
+                ).fetchall()
+            self._seen = last
+            changes = {}
+            for key, text in rows:
+                previous = self._written.get(key)
+                if text is None:
+                    if key in self._written:
+                        del self._written[key]
+                        changes[key] = (None, previous)
+                elif previous != text:
+                    # Our own writes come back too; they are already in memory
+                    self._written[key] = text
+                    changes[key] = (codec.loads(text), previous)
+            return changes
+
+    def write_json(self, data):
+        return self.write_encoded(self.encode(data))
+
+    def encode(self, data):
+        """Serializes every record: { id: (json_text, indexed_values) }."""
+        rows = {}
+        for key, record in data.items():
+            values = tuple(record.get(col) if isinstance(record, dict) else None for col in self.columns)
+            rows[key] = (codec.dumps(record), values)
+        return rows
+
+    def encode_records(self, records):
+        """Serializes some records: { id: (json_text, indexed_values), or None to delete }."""
+        return {
+            key: None if record is None else self.encode({key: record})[key]
+            for key, record in records.items()
+        }
+
+    def write_records(self, rows, bases=None):
+        """
+        Writes the records in 'rows' (from encode_records()) and nothing else.
+        'bases' maps ids to the JSON text a record was derived from, when
+        that isn't the version last read here. Returns { id: merged record }
+        for the records merged with another process's change, or None if the
+        write failed.
+        """
+        bases = bases or {}
+        with self.lock:
+            if self._written is None:
+                self._written = dict(self.db.query(f"SELECT id, data FROM {self.table}"))
+            merged = {}
+            try:
+                with self.db.transaction() as cur:
+                    before = self._last_change(cur)
+                    upserts, deletes = [], []
+                    for key, row in rows.items():
+                        found = cur.execute(f"SELECT data FROM {self.table} WHERE id = ?", (key,)).fetchone()
+                        theirs = found[0] if found else None
+                        base = bases.get(key, self._written.get(key))
+                        if row is not None and theirs is not None and theirs != base:
+                            # Changed elsewhere since ours was read: keep both edits
+                            record = merge_records(
+                                codec.loads(base) if base is not None else _MISSING,
+                                codec.loads(theirs), codec.loads(row[0])
+                            )
+                            merged[key] = record
+                            row = self.encode({key: record})[key]
+                        if row is None:
+                            if theirs is not None:
+                                deletes.append((key,))
+                        elif row[0] != theirs:
+                            upserts.append((key, *row[1], row[0]))
+                    self._apply(cur, before, upserts, deletes)
+            except sqlite3.Error as e:
+                print(f"Error writing table {self.table}: {e}")
+                self._written = None
+                return None
+
+            for key, row in rows.items():
+                if key in merged:
+                    self._written[key] = codec.dumps(merged[key])
+                elif row is None:
+                    self._written.pop(key, None)
+                else:
+                    self._written[key] = row[0]
+            return merged
+
+    def write_encoded(self, rows):
+        """Applies the difference between 'rows' (from encode()) and the table."""
+        with self.lock:
+            if self._written is None:
+                self._written = dict(self.db.query(f"SELECT id, data FROM {self.table}"))
+
+            upserts = [
+                (key, *values, text) for key, (text, values) in rows.items()
+                if self._written.get(key) != text
+            ]
+            deletes = [(key,) for key in self._written if key not in rows]
+
+            try:
+                with self.db.transaction() as cur:
+                    self._apply(cur, self._last_change(cur), upserts, deletes)
+            except sqlite3.Error as e:
+                print(f"Error writing table {self.table}: {e}")
+                self._written = None
+                return False
+
+            self._written = {key: text for key, (text, _) in rows.items()}
+            return True
+
+    def _apply(self, cur, before, upserts, deletes):
+        # Inside the write transaction; 'before' is the change log position at its start
+        if not upserts and not deletes:
+            return
+        cols = "".join(f", {col}" for col in self.columns)
+        marks = ", ?" * len(self.columns)
+        if upserts:
+            cur.executemany(f"INSERT OR REPLACE INTO {self.table} (id{cols}, data) VALUES (?{marks}, ?)", upserts)
+        if deletes:
+            cur.executemany(f"DELETE FROM {self.table} WHERE id = ?", deletes)
+        cur.executemany(
+            "INSERT INTO record_changes (tbl, id) VALUES (?, ?)",
+            [(self.table, row[0]) for row in upserts] + [(self.table, key) for key, in deletes]
+        )
+        last = self._last_change(cur)
+        cur.execute("DELETE FROM record_changes WHERE seq <= ?", (last - SQLITE_CHANGE_LOG_KEEP,))
+        # Nobody else wrote since our last read: nothing of theirs to pick up
+        if before == self._seen:
+            self._seen = last
+
+    @staticmethod
+    def _last_change(cur):
+        return cur.execute("SELECT COALESCE(MAX(seq), 0) FROM record_changes").fetchone()[0]
+
+
+class SQLiteShard:
+    """
+    One chat's history inside the messages table. Implements the part of
+    LogFileIO that MessageStore and the async facade use, with "log lines"
+    being row operations applied in one transaction.
+
+    With a 'window', read_json() returns only the newest 'window' rows;
+    the older ones stay in the table and are paged in through 'cold' (a
+    SQLiteColdHistory), so loading a chat costs the same however long it is.
+    """
+    def __init__(self, db, chat_key, window=None):
+        self.db = db
+        self.chat_key = chat_key
+        self.window = window
+        self.size = 0
+        self.cold = None
+
+    def read_json(self):
+        if self.window is None:
+            rows = self.db.query("SELECT seq, data FROM messages WHERE chat_key = ? ORDER BY seq", (self.chat_key,))
+        else:
+            rows = self.db.query(
+                "SELECT seq, data FROM messages WHERE chat_key = ? ORDER BY seq DESC LIMIT ?",
+                (self.chat_key, self.window)
+            )
+            rows.reverse()
+            if len(rows) == self.window:
+                cold = SQLiteColdHistory(self.db, self.chat_key, rows[0][0])
+                self.cold = cold if cold.count else None
+        self.size = sum(len(text) for _, text in rows)
+        return {self.chat_key: [codec.loads(text) for _, text in rows]}
+
+    def append(self, key, value):
+        return self.write_lines([self.encode_append(key, value)])
+
+    def update(self, key, item_id, fields):
+        return self.write_lines([self.encode_update(key, item_id, fields)])
+
+    @staticmethod
+    def encode_append(key, value):
+        ts = normalize_timestamp(value.get("timestamp"))
+        return ("append", key, value.get("id"), ts, codec.dumps(value))
+
+    @staticmethod
+    def encode_update(key, item_id, fields):
+        return ("update", key, item_id, None, codec.dumps(fields))
+
+    def write(self, lines):
+        """Same as write_lines(): lets row updates travel with index lines (see update_archived)."""
+        return self.write_lines(lines)
+
+    def write_lines(self, lines):
+        try:
+            with self.db.transaction() as cur:
+                for op, key, item_id, ts, text in lines:
+                    if op == "append":
+                        cur.execute(
+                            "INSERT INTO messages (chat_key, id, timestamp, data) VALUES (?, ?, ?, ?)",
+                            (key, item_id, ts, text)
+                        )
+                        continue
+                    row = cur.execute(
+                        "SELECT seq, data FROM messages WHERE id = ? AND chat_key = ?", (item_id, key)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    message = codec.loads(row[1])
+                    message.update(codec.loads(text))
+                    cur.execute(
+                        "UPDATE messages SET data = ? WHERE seq = ?",
+                        (codec.dumps(message), row[0])
+                    )
+        except sqlite3.Error as e:
+            print(f"Error writing messages for {self.chat_key}: {e}")
+            return False
+        return True
+
+
+class SQLiteColdHistory:
+    """
+    The rows of a chat older than its loaded window: positions 0 .. count - 1,
+    oldest first, read a page at a time through the (chat_key, seq) and
+    (chat_key, timestamp) indexes. Plays the part of a ChatArchive for
+    ChatHistory, so paging back past the window works the same.
+    """
+    def __init__(self, db, chat_key, boundary):
+        self.db = db
+        self.chat_key = chat_key
+        # seq of the oldest loaded row; everything before it is cold
+        self.boundary = boundary
+        count, last_ts = db.query(
+            "SELECT COUNT(*), MAX(timestamp) FROM messages WHERE chat_key = ? AND seq < ?", (chat_key, boundary)
+        )[0]
+        self.count = count
+        self.last_ts = last_ts or 0
+
+    def bisect(self, ts, bisect_fn):
+        """Position for a timestamp cursor (see ChatHistory._cursor)."""
+        op = "<" if bisect_fn is bisect_left else "<="
+        return self.db.query(
+            f"SELECT COUNT(*) FROM messages WHERE chat_key = ? AND timestamp {op} ? AND seq < ?",
+            (self.chat_key, ts, self.boundary)
+        )[0][0]
+
+    def slice(self, start, end):
+        """Messages at positions [start, end), counted back from the boundary (recent pages are cheapest)."""
+        start, end = max(0, start), min(end, self.count)
+        if start >= end:
+            return []
+        rows = self.db.query(
+            "SELECT data FROM messages WHERE chat_key = ? AND seq < ? ORDER BY seq DESC LIMIT ? OFFSET ?",
+            (self.chat_key, self.boundary, end - start, self.count - end)
+        )
+        return [codec.loads(text) for text, in reversed(rows)]
+
+    def message_at(self, pos, message_id):
+        """The cold message 'message_id' (at 'pos'), or None."""
+        if not 0 <= pos < self.count:
+            return None
+        rows = self.db.query(
+            "SELECT data FROM messages WHERE id = ? AND chat_key = ? AND seq < ?",
+            (message_id, self.chat_key, self.boundary)
+        )
+        return codec.loads(rows[0][0]) if rows else None
+
+    def stale_prefix(self, messages):
+        # The loaded window and the cold rows never overlap
+        return 0
+
+
+class SQLiteMessageStore(MessageStore):
+    """
+    MessageStore whose shards are rows of the SQLite messages table.
+    Instead of an archive, a chat keeps its older rows in the table: a
+    load reads the newest RETENTION_HOT_MESSAGES, and paging back past
+    them queries the rest (see SQLiteColdHistory).
+    """
+    def __init__(self, db, budget=MESSAGE_CACHE_BUDGET):
+        self.db = db
+        super().__init__(os.path.dirname(db.path), budget=budget)
+
+    def _open_index(self):
+        # The messages(id) index in SQLite serves lookups by id
+        return None
+
+    def _open_archive(self):
+        # Older rows stay in the table and are paged in on demand (see SQLiteColdHistory)
+        return None
+
+    def _index_database(self, name):
+        # The search postings live in the shared database, so every worker uses one index
+        return self.db
+
+    def _archive_of(self, chat_key, shard):
+        return shard.cold
+
+    def locate(self, message_id):
+        rows = self.db.query("SELECT chat_key, seq FROM messages WHERE id = ? LIMIT 1", (message_id,))
+        if not rows:
+            return None
+        chat_key, seq = rows[0]
+        newer = self.db.query(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM messages WHERE chat_key = ? AND seq > ? LIMIT ?)",
+            (chat_key, seq, RETENTION_HOT_MESSAGES)
+        )[0][0]
+        if newer < RETENTION_HOT_MESSAGES:
+            # In the newest window, which every load includes: found by id
+            return chat_key, None
+        return chat_key, self._position(chat_key, seq)
+
+    def update_archived(self, entry, message_id, fields):
+        # A cold row is updated in place, along with the index lines
+        pos = self._archived_position(entry.chat_key, message_id)
+        if not entry.is_archived(pos):
+            return None
+        message = entry.archive.message_at(pos, message_id)
+        if message is None:
+            return None
+        with self.lock:
+            lines, _ = self._apply_update(entry.chat_key, message, fields, dict.update)
+        return lines + [(entry.shard, entry.shard.encode_update(entry.chat_key, message_id, fields))]
+
+    def committed_after(self, chat_key, message_id):
+        return [message_id for message_id, in self.db.query(
+            "SELECT id FROM messages WHERE chat_key = ? AND seq > "
+            "(SELECT seq FROM messages WHERE id = ? AND chat_key = ?)",
+            (chat_key, message_id, chat_key)
+        )]
+
+    def _archived_position(self, chat_key, message_id):
+        rows = self.db.query("SELECT seq FROM messages WHERE id = ? AND chat_key = ?", (message_id, chat_key))
+        return self._position(chat_key, rows[0][0]) if rows else None
+
+    def _position(self, chat_key, seq):
+        """Position of the row 'seq' in its chat's history."""
+        return self.db.query("SELECT COUNT(*) FROM messages WHERE chat_key = ? AND seq < ?", (chat_key, seq))[0][0]
+
+    def _chat_keys(self):
+        return [chat_key for chat_key, in self.db.query("SELECT DISTINCT chat_key FROM messages")]
+
+    def _scan_shards(self):
+        # Used to build the search index: every chat in the messages table
+        for chat_key, in self.db.query("SELECT DISTINCT chat_key FROM messages"):
+            yield from SQLiteShard(self.db, chat_key).read_json().items()
+
+    def _open_shard(self, chat_key):
+        # Only the newest rows are loaded; older pages are read when asked for
+        return SQLiteShard(self.db, chat_key, window=RETENTION_HOT_MESSAGES)
+
+    @staticmethod
+    def _disk_size(shard):
+        return shard.size
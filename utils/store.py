@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import deque
+from chat_server.utils.file_io import FileIO
+from chat_server.utils.async_store import AsyncStore, AsyncMessageStore
+from chat_server.config import STORAGE_BACKEND, SQLITE_DB, SQLITE_TABLES
+
+# Records replaced by a refresh that are remembered with the version they
+# were loaded as, for handlers still holding them (see write_records)
+SUPERSEDED_KEEP = 1024
+
+class SharedStore:
+    """
+    Process-wide, in-memory copy of one JSON database.
+
+    Reads are served from memory and only hit the disk again when the
+    file's mtime/size changes (e.g. edited by hand or by another process).
+    Backends that log which records change (SQLite, shared by the worker
+    processes) re-read just those records instead. Writes go straight
+    through to the underlying FileIO so the file on disk is always current.
+    'version' increases on every reload, refresh or write; 'generation'
+    only when the data is (re)loaded whole.
+
+    A handler may still hold records from before a refresh when it writes.
+    write_records() therefore only persists the records it names, applied
+    to the current data, and tells the backend which version each stale
+    record was based on so a concurrent change is merged, not overwritten.
+    """
+    def __init__(self, file_io):
+        self.file_io = file_io
+        self.filepath = file_io.filepath
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = 0
+        self.generation = 0
+        self._stamp = None
+        # Keys refreshed from other writers since take_refreshed() (indexes re-file them)
+        self._refreshed = set()
+        # (key, record object, JSON text it was loaded as) of records a refresh replaced
+        self._superseded = deque(maxlen=SUPERSEDED_KEEP)
+
+    def read_json(self):
+        """Returns the cached data, reloading (or refreshing) it if it changed on disk."""
+        with self.lock:
+            if self.data is not None:
+                if hasattr(self.file_io, "read_changes"):
+                    if self._apply_changes(self.file_io.read_changes()):
+                        return self.data
+                elif self._file_stamp() == self._stamp:
+                    return self.data
+            self.data = self.file_io.read_json()
+            self._stamp = self._file_stamp()
+            self.version += 1
+            self.generation += 1
+            return self.data
+
+    def take_refreshed(self):
+        """Keys of the records refreshed since the last call (see read_json)."""
+        with self.lock:
+            refreshed, self._refreshed = self._refreshed, set()
+            return refreshed
+
+    def write_records(self, records, rows):
+        """
+        Persists just 'records' ({ key: record, or None if removed }, encoded
+        as 'rows' by file_io.encode_records()) and applies them to the cached
+        data. Records merged with another process's change are cached merged.
+        """
+        with self.lock:
+            bases = {}
+            for key, record in records.items():
+                if record is not None and record is not self.data.get(key):
+                    # Not the cached record: replaced by a refresh since it was read, or new
+                    bases[key] = next((text for k, old, text in self._superseded if k == key and old is record), None)
+            merged = self.file_io.write_records(rows, bases)
+            applied = dict(records, **merged) if merged else records
+            self._patch(applied)
+            if merged:
+                # Indexes saw the unmerged records
+                self._refreshed.update(merged)
+            self.version += 1
+            return merged is not None
+
+    def _apply_changes(self, changes):
+        # Caller holds the lock. 'changes' is { key: (record, or None if deleted;
+        # text it replaces) }, or None when they can't be told apart any more
+        # (reload everything).
+        if changes is None:
+            return False
+        if changes:
+            for key, (record, previous) in changes.items():
+                old = self.data.get(key)
+                if old is not None and previous is not None:
+                    self._superseded.append((key, old, previous))
+            self._patch({key: record for key, (record, _) in changes.items()})
+            self.version += 1
+            self._refreshed.update(changes)
+        return True
+
+    def _patch(self, records):
+        # Caller holds the lock
+        if all(self.data.get(key) is record for key, record in records.items()):
+            return
+        # A patched copy: the loop may be iterating over the current dict
+        data = dict(self.data)
+        for key, record in records.items():
+            if record is None:
+                data.pop(key, None)
+            else:
+                data[key] = record
+        self.data = data
+
+    def write_json(self, data):
+        """Persists 'data' and makes it the cached copy."""
+        with self.lock:
+            ok = self.file_io.write_json(data)
+            self.data = data
+            self._stamp = self._file_stamp()
+            self.version += 1
+            return ok
+
+    def write_encoded(self, data, text):
+        """Persists text already produced by file_io.encode(data) and caches 'data'."""
+        with self.lock:
+            ok = self.file_io.write_encoded(text)
+            self.data = data
+            self._stamp = self._file_stamp()
+            self.version += 1
+            return ok
+
+    def _file_stamp(self):
+        """(mtime, size) of every file backing this store; changes when any of them does."""
+        if hasattr(self.file_io, "read_changes"):
+            # Not a plain file (SQLite): changes are read from the backend itself
+            return None
+        paths = [self.filepath, getattr(self.file_io, "log_path", None)]
+        stamp = []
+        for path in paths:
+            if not path:
+                continue
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+
+class StoreRegistry:
+    """
+    Hands out exactly one store per database path, so every handler shares
+    the same cached data, lock and write queue. Stores are returned wrapped
+    in their awaitable facades (see utils/async_store.py).
+
+    With backend "sqlite", the databases listed in config.SQLITE_TABLES and
+    the message history live in one SQLite file (see utils/sqlite_backend.py);
+    everything else stays a JSON file.
+    """
+    def __init__(self, backend=STORAGE_BACKEND, sqlite_path=SQLITE_DB):
+        self.backend = backend
+        self.sqlite_path = sqlite_path
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+    def get(self, filepath, io_class=FileIO):
+        """Returns the AsyncStore for 'filepath', creating it on first use."""
+        path = os.path.abspath(filepath)
+        with self._lock:
+            store = self._stores.get(path)
+            if store is None:
+                store = AsyncStore(SharedStore(self._open(path, io_class)))
+                self._stores[path] = store
+            return store
+
+    def get_messages(self, directory, legacy_path=None):
+        """Returns the AsyncMessageStore rooted at 'directory'."""
+        path = os.path.abspath(directory)
+        with self._lock:
+            store = self._stores.get(path)
+            if store is None:
+                if self.backend == "sqlite":
+                    from chat_server.utils.sqlite_backend import SQLiteMessageStore
+                    store = AsyncMessageStore(SQLiteMessageStore(self._database()))
+                else:
+                    # Imported here: the message store (and its indexes) isn't needed to start listening
+                    from chat_server.utils.message_store import MessageStore
+                    store = AsyncMessageStore(MessageStore(path, legacy_path=legacy_path))
+                self._stores[path] = store
+            return store
+
+    def _open(self, path, io_class):
+        table = SQLITE_TABLES.get(path) if self.backend == "sqlite" else None
+        if table:
+            from chat_server.utils.sqlite_backend import SQLiteTableIO
+            return SQLiteTableIO(self._database(), table)
+        return io_class(path)
+
+    def _database(self):
+        # Caller holds the lock. The backend (and sqlite3) is only imported when configured.
+        if self._db is None:
+            from chat_server.utils.sqlite_backend import SQLiteDatabase
+            self._db = SQLiteDatabase(self.sqlite_path)
+        return self._db
+
+# Singleton Instance
+registry = StoreRegistry()
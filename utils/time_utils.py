@@ -2,4 +2,12 @@ from datetime import datetime, timezone
 
 def get_current_timestamp():
     """Returns ISO 8601 formatted UTC timestamp (e.g., 2023-10-27T10:00:00+00:00)."""
-    return datetime.now(timezone.utc).isoformat()
\ No newline at end of file
+    return datetime.now(timezone.utc).isoformat()
+
+def normalize_timestamp(ts):
+    """Returns a timestamp in milliseconds (legacy messages stored seconds as floats)."""
+    try:
+        ts = float(ts)
+    except (TypeError, ValueError):
+        return 0
+    return ts * 1000 if ts < 1e11 else ts
\ No newline at end of file